@@ -0,0 +1,132 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import heapq
+import math
+from threading import Lock
+
+
+class ContactStore(object):
+    """ Addresses seen in indexed mails, with how often and how recently, for recipient autocompletion.
+
+        Every address is indexed under each of its lowercased substrings of up to GRAM_SIZE characters,
+        so short queries are a single lookup and longer ones only check the addresses of their rarest gram.
+        Addresses rank by count * 0.5 ** (age / HALF_LIFE); the current time scales every score alike,
+        so the order only depends on count and last_seen and broad queries walk a presorted list.
+    """
+
+    GRAM_SIZE = 3
+    FIELDS = ('sender', 'to', 'cc', 'bcc')
+    HALF_LIFE = 30 * 24 * 3600 * 1000
+    HEAP_CANDIDATES = 256
+
+    def __init__(self):
+        self._contacts = {}
+        self._grams = {}
+        self._ranked = None
+        self._lock = Lock()
+
+    def add(self, fields):
+        if not fields:
+            return
+        with self._lock:
+            for address in self._addresses(fields):
+                contact = self._contacts.get(address)
+                if contact is None:
+                    contact = self._contacts[address] = {'count': 0, 'last_seen': 0}
+                    self._index(address)
+                contact['count'] += 1
+                contact['last_seen'] = max(contact['last_seen'], fields.get('date') or 0)
+                self._ranked = None
+
+    def remove(self, fields):
+        if not fields:
+            return
+        with self._lock:
+            for address in self._addresses(fields):
+                contact = self._contacts.get(address)
+                if contact is None:
+                    continue
+                contact['count'] -= 1
+                self._ranked = None
+                if contact['count'] <= 0:
+                    del self._contacts[address]
+                    self._unindex(address)
+
+    def replace(self, old_fields, new_fields):
+        self.remove(old_fields)
+        self.add(new_fields)
+
+    def search(self, query, limit=10):
+        """ The limit best ranked addresses containing query, ignoring case """
+        query = query.strip().lower()
+        if not query:
+            return []
+        with self._lock:
+            candidates = self._candidates(query)
+            if len(candidates) <= self.HEAP_CANDIDATES:
+                return heapq.nsmallest(limit, candidates, key=self._sort_key)
+            matches = []
+            for address in self._ranked_addresses():
+                if address in candidates:
+                    matches.append(address)
+                    if len(matches) == limit:
+                        break
+            return matches
+
+    def __len__(self):
+        return len(self._contacts)
+
+    def _candidates(self, query):
+        if len(query) <= self.GRAM_SIZE:
+            return self._grams.get(query, set())
+        rarest = min((self._grams.get(gram, set()) for gram in self._query_grams(query)), key=len)
+        return set(address for address in rarest if query in address.lower())
+
+    def _sort_key(self, address):
+        contact = self._contacts[address]
+        return -(math.log(contact['count'], 2) + float(contact['last_seen']) / self.HALF_LIFE), address
+
+    def _ranked_addresses(self):
+        if self._ranked is None:
+            self._ranked = sorted(self._contacts, key=self._sort_key)
+        return self._ranked
+
+    def _index(self, address):
+        for gram in self._address_grams(address):
+            self._grams.setdefault(gram, set()).add(address)
+
+    def _unindex(self, address):
+        for gram in self._address_grams(address):
+            postings = self._grams.get(gram)
+            postings.discard(address)
+            if not postings:
+                del self._grams[gram]
+
+    def _address_grams(self, address):
+        address = address.lower()
+        return set(address[start:start + size]
+                   for size in xrange(1, self.GRAM_SIZE + 1)
+                   for start in xrange(len(address) - size + 1))
+
+    def _query_grams(self, query):
+        return set(query[start:start + self.GRAM_SIZE] for start in xrange(len(query) - self.GRAM_SIZE + 1))
+
+    def _addresses(self, fields):
+        addresses = set()
+        for field in self.FIELDS:
+            addresses.update(address.strip() for address in (fields.get(field) or '').split(','))
+        addresses.discard('')
+        return addresses
@@ -0,0 +1,130 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+
+from twisted.python import log
+
+
+class IncrementalIndexer(object):
+    """ Keeps the search index in sync with soledad, indexing only what changed since the last run """
+
+    WATERMARK = 'watermark'
+    TAGS_MIGRATED = 'tags_migrated'
+    # mails read from soledad at a time during a full rebuild; the index writer bounds the rest
+    REINDEX_BATCH = 200
+
+    def __init__(self, soledad_querier, search_engine, reindex_batch=REINDEX_BATCH, started_at=None):
+        self.querier = soledad_querier
+        self.search_engine = search_engine
+        self.reindex_batch = reindex_batch
+        watermark = search_engine.load_metadata(self.WATERMARK, {'generation': 0, 'pending': []})
+        self.generation = watermark['generation']
+        self.pending = set(watermark['pending'])
+        self.started_at = started_at or time.time()
+        self.time_to_usable_inbox = None
+        if self.generation:
+            self._inbox_usable('reopened search index')
+
+    def resume(self, callback=None):
+        """ Catches an existing index up with soledad, rebuilding it only when it can't be trusted """
+        self._migrate_tags()
+        if self._is_resumable():
+            self.index_changes()
+            if self.search_engine.doc_count() + len(self.pending) == self.querier.mail_count():
+                if callback:
+                    callback()
+                self._inbox_usable('caught up with soledad')
+                return False
+            log.msg('Search index does not match soledad, rebuilding it')
+        self.index_all(callback)
+        return True
+
+    def _migrate_tags(self):
+        # scans every header doc once per index; later syncs migrate the mails index_changes loads
+        if self.search_engine.load_metadata(self.TAGS_MIGRATED, False):
+            self.querier.tags_migrated = True
+            return
+        migrated = self.querier.migrate_tags()
+        if migrated:
+            log.msg('Moved the tags of %d mails to their flags doc' % migrated)
+        self.search_engine.store_metadata(self.TAGS_MIGRATED, True)
+
+    def _is_resumable(self):
+        # a fresh index has no watermark, and one ahead of soledad means soledad was reset
+        return 0 < self.generation <= self.querier.generation()
+
+    def index_all(self, callback=None):
+        generation = self.querier.generation()
+        self.search_engine.index_mails(self.querier.iter_mails(self.reindex_batch))
+        self.search_engine.flush()
+        if callback:
+            callback()
+        # mails skipped because their header or body docs have not been synced yet
+        self._advance(generation, pending=self.querier.idents().difference(self.search_engine.all_idents()))
+        self._inbox_usable('rebuilt search index')
+        return self.search_engine.doc_count()
+
+    def index_changes(self):
+        if not self.generation:
+            # nothing indexed yet, so every mail changed: stream them instead of loading them at once
+            return self.index_all()
+
+        generation, changed_idents, has_deletions = self.querier.changes_since(self.generation)
+        idents = changed_idents.union(self.pending)
+
+        removed_idents = set()
+        if has_deletions:
+            soledad_idents = self.querier.idents()
+            removed_idents = self.search_engine.all_idents().difference(soledad_idents)
+            idents.intersection_update(soledad_idents)
+        # committed with the first flush, before the watermark moves past the deletions
+        self.search_engine.remove_many_from_index(removed_idents)
+
+        ordered, pending, indexed = sorted(idents), set(), 0
+        for start in xrange(0, len(ordered), self.reindex_batch):
+            batch = set(ordered[start:start + self.reindex_batch])
+            mails = self.querier.mails_with_bodies(batch)
+            self.querier.migrate_mail_tags(mails)
+            self.search_engine.index_mails(mails)
+            self.search_engine.flush()
+            indexed += len(mails)
+            # mails still waiting for their header or body docs to be synced
+            pending.update(batch.difference(mail.ident for mail in mails))
+            remaining = ordered[start + self.reindex_batch:]
+            if remaining:
+                # a restart picks up the batches not indexed yet as pending
+                self._advance(generation, pending=pending.union(remaining))
+
+        self.search_engine.flush()
+        self._advance(generation, pending=pending)
+        return indexed + len(removed_idents)
+
+    def _advance(self, generation, pending):
+        self.generation = generation
+        self.pending = pending
+        self.search_engine.store_metadata(self.WATERMARK, {'generation': generation, 'pending': list(pending)})
+
+    def _inbox_usable(self, reason):
+        if self.time_to_usable_inbox is None:
+            self.time_to_usable_inbox = time.time() - self.started_at
+            log.msg('Inbox usable %.3fs after startup (%s)' % (self.time_to_usable_inbox, reason))
+
+    def stats(self):
+        return {'generation': self.generation,
+                'pending': len(self.pending),
+                'time_to_usable_inbox': self.time_to_usable_inbox}
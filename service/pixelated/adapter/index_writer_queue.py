@@ -0,0 +1,176 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import time
+from collections import OrderedDict
+from threading import Condition, Thread
+
+from twisted.python import log
+
+
+class IndexWriteError(Exception):
+    pass
+
+
+class IndexWriterQueue(object):
+    """ Applies index updates and deletions on a dedicated thread.
+
+        Operations are keyed by mail ident, so repeated updates of the same mail coalesce into one,
+        and they are committed in groups once max_batch operations are pending or max_delay seconds
+        passed since the first of them. Readers call flush() to wait until everything enqueued so far
+        is committed; a batch that failed to commit is raised as IndexWriteError to the first flush
+        waiting on it. apply_batch may return a callable, which runs once its batch is committed.
+    """
+
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+    def __init__(self, index, apply_batch, max_batch=250, max_delay=0.5, max_pending=1000):
+        self._index = index
+        self._apply_batch = apply_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+
+        self._condition = Condition()
+        # ident -> (sequence, operation); coalescing moves an ident to the back of the queue
+        self._pending = OrderedDict()
+        self._in_flight = []
+        self._failures = []
+        self._first_pending_at = None
+        self._flush_requested = False
+        self._closed = False
+        self._enqueued = 0
+        self.commits = 0
+        self.failed = 0
+        self.coalesced = 0
+
+        self._thread = Thread(target=self._run, name='index-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def update(self, ident, fields):
+        self._enqueue(ident, (self.UPDATE, fields))
+
+    def delete(self, ident):
+        self._enqueue(ident, (self.DELETE, None))
+
+    def _enqueue(self, ident, operation):
+        with self._condition:
+            while len(self._pending) >= self.max_pending and ident not in self._pending:
+                self._condition.wait()
+            self._enqueued += 1
+            sequence = self._enqueued
+            if ident in self._pending:
+                # keeps the replaced operation's sequence, so its writer still waits for this one
+                sequence, _ = self._pending.pop(ident)
+                self.coalesced += 1
+            if not self._pending:
+                self._first_pending_at = time.time()
+            self._pending[ident] = (sequence, operation)
+            self._condition.notify_all()
+
+    def _committed(self):
+        """ Every operation up to this sequence is either committed or failed """
+        sequences = self._in_flight + [sequence for sequence, _ in self._pending.itervalues()]
+        return min(sequences) - 1 if sequences else self._enqueued
+
+    def flush(self):
+        with self._condition:
+            target = self._enqueued
+            if self._committed() < target:
+                self._flush_requested = True
+                self._condition.notify_all()
+                while self._committed() < target:
+                    self._condition.wait()
+            failures = [failure for failure in self._failures if failure[0] <= target]
+            if failures:
+                self._failures = [failure for failure in self._failures if failure[0] > target]
+                raise IndexWriteError('Failed to commit %d index operations: %s' % (
+                    sum(count for _, count, _ in failures), failures[-1][2]))
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            self._thread.join()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+
+            deadline = self._first_pending_at + self.max_delay if self._pending else 0
+            while len(self._pending) < self.max_batch and not self._flush_requested and not self._closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = self._pending.items()[:self.max_batch]
+            for ident, _ in batch:
+                del self._pending[ident]
+            self._in_flight = [sequence for _, (sequence, _) in batch]
+            if not self._pending:
+                self._flush_requested = False
+            self._first_pending_at = time.time()
+            self._condition.notify_all()
+            return [(ident, operation) for ident, (_, operation) in batch]
+
+    def _run(self):
+        while True:
+            operations = self._next_batch()
+            if not operations and self._closed:
+                return
+
+            try:
+                self._commit(operations)
+                failure = None
+            except Exception as e:
+                log.err(None, 'Failed to commit %d index operations' % len(operations))
+                failure = (min(self._in_flight), len(operations), e)
+
+            with self._condition:
+                if failure:
+                    self._failures.append(failure)
+                    self.failed += len(operations)
+                else:
+                    self.commits += 1
+                self._in_flight = []
+                self._condition.notify_all()
+
+    def _commit(self, operations):
+        writer = self._index.writer()
+        try:
+            on_commit = self._apply_batch(writer, operations)
+            writer.commit()
+        except:
+            # a writer that failed to commit still holds the index lock
+            writer.cancel()
+            raise
+        if on_commit:
+            on_commit()
+
+    def stats(self):
+        with self._condition:
+            return {'pending': len(self._pending),
+                    'enqueued': self._enqueued,
+                    'committed': self._committed(),
+                    'failed': self.failed,
+                    'commits': self.commits,
+                    'coalesced': self.coalesced}
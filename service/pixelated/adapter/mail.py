@@ -18,9 +18,10 @@ from uuid import uuid4
 
 from leap.mail.imap.fields import fields
 import leap.mail.walk as walk
-import dateutil.parser as dateparser
 from pixelated.adapter.status import Status
+from pixelated.adapter.mail_headers import MailHeaders
 import pixelated.support.date
+from pixelated.support.text_extraction import readable_text
 from email.MIMEMultipart import MIMEMultipart
 from email.mime.text import MIMEText
 from pycryptopp.hash import sha256
@@ -184,18 +185,49 @@ class InputMail(Mail):
 
 
 class PixelatedMail(Mail):
+    MESSAGE_ID = re.compile('<[^>]+>')
+    TAGS_KEY = 'tags'
+
     @staticmethod
-    def from_soledad(fdoc, hdoc, bdoc, parts=None, soledad_querier=None):
+    def from_soledad(fdoc, hdoc, bdoc=None, parts=None, soledad_querier=None, body_loader=None):
+        """ With a body_loader the mail is lazy: bdoc and parts are only fetched when first accessed """
         mail = PixelatedMail()
-        mail.parts = parts
+        mail._parts = parts
         mail.boundary = str(uuid4()).replace('-', '')
-        mail.bdoc = bdoc
+        mail._bdoc = bdoc
         mail.fdoc = fdoc
         mail.hdoc = hdoc
         mail.querier = soledad_querier
+        mail._body_loader = body_loader
+        mail._changed_docs = set()
         mail._mime = None
+        mail._headers = None
+        mail._headers_rev = None
         return mail
 
+    @property
+    def bdoc(self):
+        self._load_body()
+        return self._bdoc
+
+    @property
+    def parts(self):
+        self._load_body()
+        return self._parts
+
+    @property
+    def body_loaded(self):
+        return self._body_loader is None
+
+    def set_body(self, bdoc, parts):
+        self._bdoc = bdoc
+        self._parts = parts
+        self._body_loader = None
+
+    def _load_body(self):
+        if self._body_loader is not None:
+            self._body_loader.load(self)
+
     @property
     def body(self):
         if self.parts and len(self.parts['alternatives']) > 1:
@@ -213,41 +245,70 @@ class PixelatedMail(Mail):
             return self.bdoc.content['raw']
 
     @property
-    def headers(self):
-        _headers = {
-            'To': [],
-            'Cc': [],
-            'Bcc': []
-        }
-        hdoc_headers = self.hdoc.content['headers']
+    def text(self):
+        """ Decoded and normalized body text, used for indexing and snippets """
+        if self.parts and self.parts['alternatives']:
+            parts = [(alternative['content'],
+                      alternative['headers'].get('Content-Type'),
+                      alternative['headers'].get('Content-Transfer-Encoding'))
+                     for alternative in self.parts['alternatives']]
+        else:
+            headers = self.hdoc.content['headers']
+            parts = [(self.bdoc.content['raw'],
+                      headers.get('Content-Type'),
+                      self.bdoc.content.get('content-transfer-encoding') or headers.get('Content-Transfer-Encoding'))]
+        return readable_text(parts)
 
-        for header in ['To', 'Cc', 'Bcc']:
-            header_value = hdoc_headers.get(header)
-            if not header_value:
-                continue
-            _headers[header] = header_value if type(header_value) is list else header_value.split(',')
-            _headers[header] = map(lambda x: x.strip(), _headers[header])
+    @property
+    def message_id(self):
+        ids = self.MESSAGE_ID.findall(self._hdoc_header('Message-Id') or '')
+        return ids[0] if ids else None
 
-        for header in ['From', 'Subject']:
-            _headers[header] = hdoc_headers.get(header)
+    @property
+    def references(self):
+        """ Message ids this mail follows up on, from References and In-Reply-To """
+        ids = self.MESSAGE_ID.findall(self._hdoc_header('References') or '')
+        ids.extend(parent for parent in self.MESSAGE_ID.findall(self._hdoc_header('In-Reply-To') or '') if parent not in ids)
+        return ids
 
-        _headers['Date'] = self._get_date()
+    def _hdoc_header(self, name):
+        for header, value in self.hdoc.content['headers'].items():
+            if header.lower() == name.lower():
+                return value
 
-        if self.parts and len(self.parts['alternatives']) > 1:
-            _headers['content_type'] = 'multipart/alternative; boundary="%s"' % self.boundary
-        elif self.hdoc.content['headers'].get('Content-Type'):
-            _headers['content_type'] = hdoc_headers.get('Content-Type')
+    @property
+    def headers(self):
+        """ Parsed once per header doc revision """
+        rev = getattr(self.hdoc, 'rev', None)
+        if self._headers is None or self._headers_rev != rev:
+            self._headers = self._parse_headers()
+            self._headers_rev = rev
+        return self._headers
+
+    def _parse_headers(self):
+        headers = MailHeaders.from_hdoc(self.hdoc.content)
+        # the part map of the header doc tells the alternatives apart without loading the body
+        if self.hdoc.content.get('multi') and len(self.alternative_parts(self.hdoc.content)) > 1:
+            headers = headers.replace(content_type='multipart/alternative; boundary="%s"' % self.boundary)
+        return headers
 
-        if hdoc_headers.get('Reply-To'):
-            _headers['Reply-To'] = hdoc_headers.get('Reply-To')
+    @staticmethod
+    def leaf_parts(hdoc_content):
+        if hdoc_content['multi']:
+            for part_key in hdoc_content.get('part_map', {}).keys():
+                for part in PixelatedMail.leaf_parts(hdoc_content['part_map'][part_key]):
+                    yield part
+        else:
+            yield hdoc_content, {elem[0]: elem[1] for elem in hdoc_content.get('headers', [])}
 
-        return _headers
+    @staticmethod
+    def is_attachment(headers_dict):
+        return 'attachment' in headers_dict.get('Content-Disposition', '')
 
-    def _get_date(self):
-        date = self.hdoc.content.get('date', None)
-        if not date:
-            date = self.hdoc.content['received'].split(";")[-1].strip()
-        return dateparser.parse(date).isoformat()
+    @staticmethod
+    def alternative_parts(hdoc_content):
+        return [(part, headers_dict) for part, headers_dict in PixelatedMail.leaf_parts(hdoc_content)
+                if not PixelatedMail.is_attachment(headers_dict)]
 
     @property
     def security_casing(self):
@@ -262,13 +323,28 @@ class PixelatedMail(Mail):
 
     @property
     def tags(self):
-        _tags = self.hdoc.content['headers'].get('X-Tags', '[]')
+        if self.TAGS_KEY in self.fdoc.content:
+            return set(self.fdoc.content[self.TAGS_KEY])
+        return self.legacy_tags(self.hdoc.content['headers'])
+
+    @staticmethod
+    def legacy_tags(headers):
+        _tags = headers.get('X-Tags', '[]')
         return set(_tags) if type(_tags) is list or type(_tags) is set else set(json.loads(_tags))
 
+    @property
+    def has_legacy_tags(self):
+        """ Whether the tags still live in the X-Tags header, where they were kept before moving to the flags doc """
+        return 'X-Tags' in self.hdoc.content['headers']
+
     @property
     def ident(self):
         return self.fdoc.content.get('chash')
 
+    @property
+    def attachments(self):
+        return self.parts['attachments'] if self.parts else []
+
     @property
     def mailbox_name(self):
         return self.fdoc.content.get('mbox')
@@ -284,8 +360,21 @@ class PixelatedMail(Mail):
     def save(self):
         return self.querier.save_mail(self)
 
+    def changed_docs(self):
+        """ The docs modified since the mail was loaded or last saved """
+        return [getattr(self, name) for name in ['fdoc', 'hdoc'] if name in self._changed_docs]
+
+    def mark_as_saved(self):
+        self._changed_docs.clear()
+
+    def _changed(self, doc_name):
+        self._changed_docs.add(doc_name)
+
     def set_mailbox(self, mailbox_name):
+        if self.fdoc.content.get('mbox') == mailbox_name:
+            return
         self.fdoc.content['mbox'] = mailbox_name
+        self._changed('fdoc')
 
     def remove_all_tags(self):
         self.update_tags(set([]))
@@ -295,26 +384,45 @@ class PixelatedMail(Mail):
         return self.tags
 
     def mark_as_read(self):
-        if Status.SEEN in self.fdoc.content['flags']:
-            return self
-        self.fdoc.content['flags'].append(Status.SEEN)
-        self.save()
+        if self.add_flag(Status.SEEN):
+            self.save()
         return self
 
     def mark_as_unread(self):
-        if Status.SEEN in self.fdoc.content['flags']:
-            self.fdoc.content['flags'].remove(Status.SEEN)
+        if self.remove_flag(Status.SEEN):
             self.save()
         return self
 
     def mark_as_not_recent(self):
-        if Status.RECENT in self.fdoc.content['flags']:
-            self.fdoc.content['flags'].remove(Status.RECENT)
+        if self.remove_flag(Status.RECENT):
             self.save()
         return self
 
+    def add_flag(self, flag):
+        if flag in self.fdoc.content['flags']:
+            return False
+        self.fdoc.content['flags'].append(flag)
+        self._changed('fdoc')
+        return True
+
+    def remove_flag(self, flag):
+        if flag not in self.fdoc.content['flags']:
+            return False
+        self.fdoc.content['flags'].remove(flag)
+        self._changed('fdoc')
+        return True
+
+    def set_tags(self, tags):
+        if self.has_legacy_tags:
+            del self.hdoc.content['headers']['X-Tags']
+            self._changed('hdoc')
+        elif set(tags) == self.tags:
+            return
+        self.fdoc.content[self.TAGS_KEY] = sorted(tags)
+        self._changed('fdoc')
+
     def _persist_mail_tags(self, current_tags):
-        self.hdoc.content['headers']['X-Tags'] = json.dumps(list(current_tags))
+        self.set_tags(current_tags)
         self.save()
 
     def has_tag(self, tag):
@@ -329,21 +437,22 @@ class PixelatedMail(Mail):
         return self.hdoc.content["headers"].get("OpenPGP", None) is not None
 
     def as_dict(self):
-        dict_mail = {'header': {k.lower(): v for k, v in self.headers.items()},
+        headers = self.headers
+        dict_mail = {'header': headers.as_dict(),
                      'ident': self.ident,
                      'tags': list(self.tags),
                      'status': list(self.status),
                      'security_casing': self.security_casing,
                      'body': self.body,
                      'mailbox': self.mailbox_name.lower(),
-                     'attachments': self.parts['attachments'] if self.parts else []}
+                     'attachments': self.attachments}
         dict_mail['replying'] = {'single': None, 'all': {'to-field': [], 'cc-field': []}}
 
-        sender_mail = self.headers.get('Reply-To', self.headers['From'])
+        sender_mail = headers.reply_to or headers.sender
 
-        recipients = [recipient for recipient in self.headers['To'] if recipient != InputMail.FROM_EMAIL_ADDRESS]
+        recipients = [recipient for recipient in headers.to if recipient != InputMail.FROM_EMAIL_ADDRESS]
         recipients.append(sender_mail)
-        ccs = [cc for cc in self.headers['Cc'] if cc != InputMail.FROM_EMAIL_ADDRESS]
+        ccs = [cc for cc in headers.cc if cc != InputMail.FROM_EMAIL_ADDRESS]
 
         dict_mail['replying']['single'] = sender_mail
         dict_mail['replying']['all']['to-field'] = recipients
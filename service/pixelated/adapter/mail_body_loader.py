@@ -0,0 +1,33 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+
+
+class MailBodyLoader(object):
+    """ Fetches the bodies of mails built together in one go, the first time any of them needs its own """
+
+    def __init__(self, load_bodies):
+        self._load_bodies = load_bodies
+        self._pending = []
+
+    def add(self, mail):
+        self._pending.append(mail)
+
+    def load(self, mail):
+        pending, self._pending = self._pending, []
+        mails = [pending_mail for pending_mail in pending if not pending_mail.body_loaded]
+        if not any(pending_mail is mail for pending_mail in mails):
+            mails.append(mail)
+        self._load_bodies(mails)
@@ -0,0 +1,112 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import pixelated.support.date
+
+
+class MailHeaders(object):
+    """ Parsed, read only headers of a header doc, also readable by the header names PixelatedMail.headers used to have """
+
+    __slots__ = ('to', 'cc', 'bcc', 'sender', 'subject', 'date', 'milliseconds', 'content_type', 'reply_to')
+
+    FIELDS = {'To': 'to', 'Cc': 'cc', 'Bcc': 'bcc', 'From': 'sender', 'Subject': 'subject', 'Date': 'date',
+              'content_type': 'content_type', 'Reply-To': 'reply_to'}
+    # only listed when set
+    OPTIONAL = ('content_type', 'Reply-To')
+
+    def __init__(self, to=(), cc=(), bcc=(), sender=None, subject=None, date=None, milliseconds=None,
+                 content_type=None, reply_to=None):
+        for name, value in zip(self.__slots__, (to, cc, bcc, sender, subject, date, milliseconds, content_type, reply_to)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('mail headers are read only')
+
+    @staticmethod
+    def from_hdoc(hdoc_content):
+        headers = hdoc_content['headers']
+        date = MailHeaders._date(hdoc_content)
+        return MailHeaders(to=MailHeaders._addresses(headers.get('To')),
+                           cc=MailHeaders._addresses(headers.get('Cc')),
+                           bcc=MailHeaders._addresses(headers.get('Bcc')),
+                           sender=headers.get('From'),
+                           subject=headers.get('Subject'),
+                           date=date.isoformat(),
+                           milliseconds=pixelated.support.date.datetime_milliseconds(date),
+                           content_type=headers.get('Content-Type') or None,
+                           reply_to=headers.get('Reply-To') or None)
+
+    @staticmethod
+    def _addresses(value):
+        if not value:
+            return ()
+        return tuple(address.strip() for address in (value if type(value) is list else value.split(',')))
+
+    @staticmethod
+    def _date(hdoc_content):
+        date = hdoc_content.get('date', None)
+        if not date:
+            date = hdoc_content['received'].split(";")[-1].strip()
+        return pixelated.support.date.parse(date)
+
+    def replace(self, **changes):
+        """ A copy with the given fields changed """
+        fields = dict((name, getattr(self, name)) for name in self.__slots__)
+        fields.update(changes)
+        return MailHeaders(**fields)
+
+    def __eq__(self, other):
+        return isinstance(other, MailHeaders) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getitem__(self, name):
+        value = getattr(self, self.FIELDS[name])
+        if value is None and name in self.OPTIONAL:
+            raise KeyError(name)
+        return value
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return name in self.FIELDS and (name not in self.OPTIONAL or getattr(self, self.FIELDS[name]) is not None)
+
+    def __iter__(self):
+        return iter([name for name, _ in self.items()])
+
+    def items(self):
+        """ The headers as (name, value) pairs, recipients as lists """
+        items = [('To', list(self.to)), ('Cc', list(self.cc)), ('Bcc', list(self.bcc)),
+                 ('From', self.sender), ('Subject', self.subject), ('Date', self.date)]
+        if self.content_type is not None:
+            items.append(('content_type', self.content_type))
+        if self.reply_to is not None:
+            items.append(('Reply-To', self.reply_to))
+        return items
+
+    def as_dict(self):
+        """ The headers keyed by their lower case names, as mails are rendered """
+        header = {'to': list(self.to), 'cc': list(self.cc), 'bcc': list(self.bcc),
+                  'from': self.sender, 'subject': self.subject, 'date': self.date}
+        if self.content_type is not None:
+            header['content_type'] = self.content_type
+        if self.reply_to is not None:
+            header['reply-to'] = self.reply_to
+        return header
@@ -13,16 +13,18 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from pixelated.adapter.status import Status
 
 
 class MailService:
     __slots__ = ['leap_session', 'account', 'mailbox_name']
 
-    def __init__(self, mailboxes, mail_sender, tag_service, soledad_querier):
+    def __init__(self, mailboxes, mail_sender, tag_service, soledad_querier, search_engine):
         self.tag_service = tag_service
         self.mailboxes = mailboxes
         self.querier = soledad_querier
         self.mail_sender = mail_sender
+        self.search_engine = search_engine
 
     def all_mails(self):
         return self.querier.all_mails()
@@ -31,13 +33,28 @@ class MailService:
         return self.querier.mails(ids)
 
     def update_tags(self, mail_id, new_tags):
-        reserved_words = self.tag_service.extract_reserved(new_tags)
-        if len(reserved_words):
-            raise ValueError('None of the following words can be used as tags: ' + ' '.join(reserved_words))
+        self._check_reserved_tags(new_tags)
         mail = self.mail(mail_id)
         mail.update_tags(set(new_tags))
         return mail
 
+    def update_many_tags(self, mail_ids, added_tags, removed_tags):
+        self._check_reserved_tags(set(added_tags).union(removed_tags))
+        mails = self.querier.mails(mail_ids)
+        changed_mails = []
+        for mail in mails:
+            new_tags = mail.tags.union(added_tags).difference(removed_tags)
+            if new_tags != mail.tags:
+                mail.set_tags(new_tags)
+                changed_mails.append(mail)
+        self.querier.save_mails(changed_mails)
+        return mails
+
+    def _check_reserved_tags(self, tags):
+        reserved_words = self.tag_service.extract_reserved(tags)
+        if len(reserved_words):
+            raise ValueError('None of the following words can be used as tags: ' + ' '.join(reserved_words))
+
     def mail(self, mail_id):
         return self.mailboxes.mail(mail_id)
 
@@ -48,7 +65,8 @@ class MailService:
         return self.mailboxes.sent().add(mail)
 
     def thread(self, thread_id):
-        raise NotImplementedError()
+        mails = self.querier.mails(self.search_engine.thread_idents(thread_id))
+        return sorted(mails, key=lambda mail: mail.headers.milliseconds)
 
     def mark_as_read(self, mail_id):
         return self.mail(mail_id).mark_as_read()
@@ -56,14 +74,34 @@ class MailService:
     def mark_as_unread(self, mail_id):
         return self.mail(mail_id).mark_as_unread()
 
-    def tags_for_thread(self, thread):
-        raise NotImplementedError()
+    def mark_many_as_read(self, mail_ids):
+        mails = self.querier.mails(mail_ids)
+        changed_mails = []
+        for mail in mails:
+            if Status.SEEN not in mail.flags:
+                mail.add_flag(Status.SEEN)
+                changed_mails.append(mail)
+        self.querier.save_mails(changed_mails)
+        return mails
+
+    def mark_many_as_unread(self, mail_ids):
+        mails = self.querier.mails(mail_ids)
+        changed_mails = []
+        for mail in mails:
+            if Status.SEEN in mail.flags:
+                mail.remove_flag(Status.SEEN)
+                changed_mails.append(mail)
+        self.querier.save_mails(changed_mails)
+        return mails
+
+    def tags_for_thread(self, thread_id):
+        return set().union(*[mail.tags for mail in self.thread(thread_id)])
 
     def add_tag_to_thread(self, thread_id, tag):
-        raise NotImplementedError()
+        return self.update_many_tags(list(self.search_engine.thread_idents(thread_id)), [tag], [])
 
     def remove_tag_from_thread(self, thread_id, tag):
-        raise NotImplementedError()
+        return self.update_many_tags(list(self.search_engine.thread_idents(thread_id)), [], [tag])
 
     def delete_mail(self, mail_id):
         return self.mailboxes.move_to_trash(mail_id)
@@ -72,6 +110,20 @@ class MailService:
         mail = self.mail(mail_id)
         self.querier.remove_mail(mail)
 
+    def delete_mails(self, mail_ids):
+        mails = self.querier.mails(mail_ids)
+        trash_name = self.mailboxes.trash().mailbox_name
+
+        removed_mails = [mail for mail in mails if mail.mailbox_name == trash_name]
+        trashed_mails = [mail for mail in mails if mail.mailbox_name != trash_name]
+        for mail in trashed_mails:
+            mail.set_tags(set([]))
+            mail.set_mailbox(trash_name)
+
+        self.querier.save_mails(trashed_mails)
+        self.querier.remove_mails(removed_mails)
+        return trashed_mails, removed_mails
+
     def save_draft(self, draft):
         raise NotImplementedError()
 
@@ -33,7 +33,7 @@ class Mailbox:
     def mails_by_tags(self, tags):
         if 'all' in tags or self.mailbox_tag in tags:
             return self.mails()
-        return [mail for mail in self.mails() if len(mail.tags.intersection(tags)) > 0]
+        return [mail for mail in self.querier.mails_by_tags(tags) if mail.mailbox_name == self.mailbox_name]
 
     def mail(self, mail_id):
         return self.querier.mail(mail_id)
@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from threading import Lock
+
+
+class MailboxIdents(object):
+    """ Idents of the indexed mails per mailbox, kept in step with the stored fields of indexed mails """
+
+    def __init__(self):
+        self._idents = {}
+        self._lock = Lock()
+
+    def add(self, fields):
+        if not fields:
+            return
+        with self._lock:
+            self._idents.setdefault(fields['mailbox'], set()).add(fields['ident'])
+
+    def remove(self, fields):
+        if not fields:
+            return
+        with self._lock:
+            idents = self._idents.get(fields['mailbox'], set())
+            idents.discard(fields['ident'])
+            if not idents:
+                self._idents.pop(fields['mailbox'], None)
+
+    def replace(self, old_fields, new_fields):
+        self.remove(old_fields)
+        self.add(new_fields)
+
+    def missing(self, mailbox, idents):
+        """ The given idents that are not indexed in the mailbox, in time proportional to len(idents) """
+        with self._lock:
+            indexed = self._idents.get(mailbox, set())
+            return set(ident for ident in idents if ident not in indexed)
+
+    def count(self, mailbox):
+        with self._lock:
+            return len(self._idents.get(mailbox, ()))
+
+    def all(self):
+        with self._lock:
+            return set().union(*self._idents.values())
@@ -29,14 +29,24 @@ class MailboxIndexerListener(object):
     def __init__(self, mailbox_name, soledad_querier):
         self.mailbox_name = mailbox_name
         self.querier = soledad_querier
+        self.generation = None
+        self.pending = set()
 
     def newMessages(self, exists, recent):
-        indexed_idents = set(self.SEARCH_ENGINE.search('tag:' + self.mailbox_name.lower(), all_mails=True))
-        soledad_idents = self.querier.idents_by_mailbox(self.mailbox_name)
-
-        missing_idents = soledad_idents.difference(indexed_idents)
-
-        self.SEARCH_ENGINE.index_mails(self.querier.mails(missing_idents))
+        if self.generation is None:
+            generation = self.querier.generation()
+            soledad_idents = self.querier.idents_by_mailbox(self.mailbox_name)
+        else:
+            generation, soledad_idents = self.querier.mailbox_changes_since(self.mailbox_name, self.generation)
+
+        missing_idents = self.SEARCH_ENGINE.missing_idents(self.mailbox_name, soledad_idents.union(self.pending))
+
+        mails = self.querier.mails_with_bodies(missing_idents) if missing_idents else []
+        if mails:
+            self.SEARCH_ENGINE.index_mails(mails)
+        # mails still waiting for their header or body docs to be synced
+        self.pending = missing_idents.difference(mail.ident for mail in mails)
+        self.generation = generation
 
     def __eq__(self, other):
         return other and other.mailbox_name == self.mailbox_name
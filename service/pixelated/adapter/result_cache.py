@@ -0,0 +1,54 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import time
+from threading import Lock
+
+from pixelated.support.lru_cache import LRUCache
+
+
+class ResultCache(object):
+    """ Search results of the current index generation, least recently used ones evicted first """
+
+    def __init__(self, max_entries=256):
+        self._cache = LRUCache(max_entries)
+        self._lock = Lock()
+        self._generation = 0
+        self.saved_seconds = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+
+    def get(self, key, compute):
+        generation = self._generation
+        entry = self._cache.get(key, is_valid=lambda (entry_generation, result, cost): entry_generation == generation)
+        if entry:
+            with self._lock:
+                self.saved_seconds += entry[2]
+            return entry[1]
+
+        started = time.time()
+        result = compute()
+        self._cache.put(key, (generation, result, time.time() - started))
+        return result
+
+    def stats(self):
+        stats = self._cache.stats()
+        return {'hits': stats['hits'],
+                'misses': stats['misses'],
+                'hit_ratio': stats['hit_ratio'],
+                'entries': stats['entries'],
+                'saved_ms': int(self.saved_seconds * 1000)}
@@ -17,25 +17,43 @@
 from pixelated.support.encrypted_file_storage import EncryptedFileStorage
 
 import os
+import json
 from pixelated.adapter.status import Status
-from pixelated.support.functional import flatten
+from pixelated.adapter.index_writer_queue import IndexWriterQueue
+from pixelated.adapter.tag_counts import TagCounts
+from pixelated.adapter.mailbox_idents import MailboxIdents
+from pixelated.adapter.contact_store import ContactStore
+from pixelated.adapter.thread_index import ThreadIndex
+from pixelated.adapter.searcher_pool import SearcherPool
+from pixelated.adapter.result_cache import ResultCache
 from whoosh.index import FileIndex
 from whoosh.fields import *
 from whoosh.qparser import QueryParser
+from whoosh.query import And, Or, NumericRange, TermRange
 from whoosh import sorting
 from pixelated.support.functional import unique
-from pixelated.support.date import milliseconds
+from twisted.python import log
 
 
 class SearchEngine(object):
     INDEX_FOLDER = os.path.join(os.environ['HOME'], '.leap', 'search_index')
     DEFAULT_TAGS = ['inbox', 'sent', 'drafts', 'trash']
+    SNIPPET_LENGTH = 140
+    METADATA_SUFFIX = '.meta'
+    SCHEMA = 'schema'
+    # bump whenever the schema or the meaning of indexed fields changes
+    SCHEMA_VERSION = 5
+    CONTACTS_LIMIT = 10
 
     def __init__(self, soledad_querier):
         self.soledad_querier = soledad_querier
         if not os.path.exists(self.INDEX_FOLDER):
             os.makedirs(self.INDEX_FOLDER)
         self._index = self._create_index()
+        self.tag_counts, self.mailbox_idents, self.contact_store, self.thread_index = self._load_stored_state()
+        self.searchers = SearcherPool(self._index)
+        self.results = ResultCache()
+        self.index_writer = IndexWriterQueue(self._index, self._apply_batch)
 
     def _add_to_tags(self, tags, group, skip_default_tags, count_type, query=None):
         query_matcher = re.compile(".*%s.*" % query.lower()) if query else re.compile(".*")
@@ -50,16 +68,21 @@ class SearchEngine(object):
                              'mails': []}
             tags[tag]['counts'][count_type] += count
 
-    def _search_tag_groups(self, is_filtering_tags):
-        seen = None
-        query_parser = QueryParser('tag', self._index.schema)
-        options = {'limit': None, 'groupedby': sorting.FieldFacet('tag', allow_overlap=True), 'maptype': sorting.Count}
+    def _tag_groups(self, is_filtering_tags):
+        self.flush()
+        seen = None if is_filtering_tags else self.tag_counts.reads()
+        return seen, self.tag_counts.totals()
 
+    def _load_stored_state(self):
+        """ Rebuilt from the committed index on every start, so it can't drift from what the index holds """
+        tag_counts, mailbox_idents, contact_store, thread_index = TagCounts(), MailboxIdents(), ContactStore(), ThreadIndex()
         with self._index.searcher() as searcher:
-            total = searcher.search(query_parser.parse('*'), **options).groups()
-            if not is_filtering_tags:
-                seen = searcher.search(query_parser.parse("* AND flags:%s" % Status.SEEN), **options).groups()
-        return seen, total
+            for fields in searcher.all_stored_fields():
+                tag_counts.add(fields)
+                mailbox_idents.add(fields)
+                contact_store.add(fields)
+                thread_index.add(fields)
+        return tag_counts, mailbox_idents, contact_store, thread_index
 
     def _init_tags_defaults(self):
         tags = {}
@@ -87,85 +110,264 @@ class SearchEngine(object):
 
     def tags(self, query, skip_default_tags):
         is_filtering_tags = True if query else False
-        seen, total = self._search_tag_groups(is_filtering_tags=is_filtering_tags)
+        seen, total = self._tag_groups(is_filtering_tags=is_filtering_tags)
         return self._build_tags(seen, total, skip_default_tags, query)
 
     def _mail_schema(self):
         return Schema(
-            ident=ID(stored=True, unique=True),
-            sender=ID(stored=False),
-            to=KEYWORD(stored=False, commas=True),
-            cc=KEYWORD(stored=False, commas=True),
-            bcc=KEYWORD(stored=False, commas=True),
-            subject=TEXT(stored=False),
-            date=NUMERIC(stored=False, sortable=True, bits=64, signed=False),
-            body=TEXT(stored=False),
+            ident=ID(stored=True, unique=True, sortable=True),
+            sender=ID(stored=True),
+            to=KEYWORD(stored=True, commas=True),
+            cc=KEYWORD(stored=True, commas=True),
+            bcc=KEYWORD(stored=True, commas=True),
+            subject=TEXT(stored=True),
+            date=NUMERIC(stored=True, sortable=True, bits=64, signed=True),
+            iso_date=STORED,
+            content=TEXT(stored=False),
+            snippet=STORED,
+            attachment_count=STORED,
+            mailbox=ID(stored=True),
             tag=KEYWORD(stored=True, commas=True),
             flags=KEYWORD(stored=True, commas=True),
-            raw=TEXT(stored=False))
+            message_id=ID(stored=True),
+            references=KEYWORD(stored=True))
 
     def _create_index(self):
         masterkey = self.soledad_querier.get_index_masterkey()
-        storage = EncryptedFileStorage(self.INDEX_FOLDER, masterkey)
-        return FileIndex.create(storage, self._mail_schema(), indexname='mails')
+        self._storage = EncryptedFileStorage(self.INDEX_FOLDER, masterkey)
+        self.reopened = False
+        try:
+            if self._storage.index_exists('mails') and self.load_metadata(self.SCHEMA) == self.SCHEMA_VERSION:
+                self.reopened = True
+                return self._storage.open_index('mails')
+        except Exception:
+            log.err(None, 'Could not reopen the search index, recreating it')
+
+        self._clear_metadata()
+        index = FileIndex.create(self._storage, self._mail_schema(), indexname='mails')
+        self.store_metadata(self.SCHEMA, self.SCHEMA_VERSION)
+        return index
+
+    def _clear_metadata(self):
+        for filename in self._storage.list():
+            if filename.endswith(self.METADATA_SUFFIX):
+                self._storage.delete_file(filename)
+
+    def load_metadata(self, name, default=None):
+        filename = name + self.METADATA_SUFFIX
+        if not self._storage.file_exists(filename):
+            return default
+        metadata_file = self._storage.open_file(filename)
+        try:
+            return json.loads(metadata_file.read())
+        finally:
+            metadata_file.close()
+
+    def store_metadata(self, name, metadata):
+        metadata_file = self._storage.create_file(name + self.METADATA_SUFFIX)
+        metadata_file.write(json.dumps(metadata))
+        metadata_file.close()
+
+    def flush(self):
+        self.index_writer.flush()
+
+    def _searcher(self):
+        self.flush()
+        return self.searchers.searcher()
+
+    def _apply_batch(self, writer, operations):
+        changes = []
+        with writer.searcher() as searcher:
+            for ident, (action, fields) in operations:
+                # update_document and delete_by_term would each open a reader over every segment again
+                docnums = list(searcher.document_numbers(ident=ident))
+                changes.append((searcher.stored_fields(docnums[0]) if docnums else None, fields))
+                for docnum in docnums:
+                    writer.delete_document(docnum)
+                if action != IndexWriterQueue.DELETE:
+                    writer.add_document(**fields)
+        return lambda: self._committed(changes)
+
+    def _committed(self, changes):
+        self.searchers.invalidate()
+        for old_fields, new_fields in changes:
+            self.tag_counts.replace(old_fields, new_fields)
+            self.mailbox_idents.replace(old_fields, new_fields)
+            self.contact_store.replace(old_fields, new_fields)
+            self.thread_index.replace(old_fields, new_fields)
+        # collapsed searches depend on the threads, so drop cached results once threads are up to date
+        self.results.invalidate()
 
     def index_mail(self, mail):
-        with self._index.writer() as writer:
-            self._index_mail(writer, mail)
-
-    def _index_mail(self, writer, mail):
-        mdict = mail.as_dict()
-        header = mdict['header']
-        tags = mdict.get('tags', [])
-        tags.append(mail.mailbox_name.lower())
-        index_data = {
-            'sender': unicode(header.get('from', '')),
-            'subject': unicode(header.get('subject', '')),
-            'date': milliseconds(header.get('date', '')),
-            'to': u','.join(header.get('to', [''])),
-            'cc': u','.join(header.get('cc', [''])),
-            'bcc': u','.join(header.get('bcc', [''])),
+        index_data = self._index_data(mail)
+        self.index_writer.update(index_data['ident'], index_data)
+
+    def _index_data(self, mail):
+        headers = mail.headers
+        mailbox = mail.mailbox_name.lower()
+        tags = list(mail.tags)
+        tags.append(mailbox)
+        text = mail.text
+        return {
+            'sender': unicode(headers.sender or ''),
+            'subject': unicode(headers.subject or ''),
+            'date': headers.milliseconds,
+            'iso_date': unicode(headers.date),
+            'to': u','.join(headers.to),
+            'cc': u','.join(headers.cc),
+            'bcc': u','.join(headers.bcc),
             'tag': u','.join(unique(tags)),
-            'body': unicode(mdict['body']),
-            'ident': unicode(mdict['ident']),
+            'content': self._content(headers, text),
+            'snippet': text[:self.SNIPPET_LENGTH],
+            'attachment_count': len(mail.attachments),
+            'mailbox': unicode(mailbox),
+            'ident': unicode(mail.ident),
             'flags': unicode(','.join(unique(mail.flags))),
-            'raw': unicode(mail.raw)
+            'message_id': unicode(mail.message_id or ''),
+            'references': u' '.join(mail.references)
         }
 
-        writer.update_document(**index_data)
+    def _content(self, headers, text):
+        """ Default search field: the readable header fields followed by the decoded body text """
+        fields = [headers.subject, headers.sender]
+        fields.extend(headers.to + headers.cc + headers.bcc)
+        return u' '.join(unicode(field) for field in fields if field) + u' ' + text
 
     def index_mails(self, mails, callback=None):
-        with self._index.writer() as writer:
-            for mail in mails:
-                self._index_mail(writer, mail)
+        for mail in mails:
+            self.index_mail(mail)
         if callback:
+            self.flush()
             callback()
 
     def _search_with_options(self, options, query):
-        with self._index.searcher() as searcher:
-            query = QueryParser('raw', self._index.schema).parse(query)
+        with self._searcher() as searcher:
+            query = QueryParser('content', self._index.schema).parse(query)
             results = searcher.search(query, **options)
         return results
 
     def search(self, query, window=25, page=1, all_mails=False):
         query = self.prepare_query(query)
-        return self._search_all_mails(query) if all_mails else self._paginated_search_mails(query, window, page)
+        if all_mails:
+            return self._cached(self._search_all_mails, query)
+        mails, total = self._cached(self._paginated_search_mails, query, window, page)
+        return [mail['ident'] for mail in mails], total
+
+    def search_summaries(self, query, window=25, page=1, threads=False):
+        """ One page of mails, or with threads of conversations each summarized by its newest matching mail """
+        if threads:
+            mails, total = self._cached(self._paginated_search_threads, self.prepare_query(query), window, page)
+            return [self._thread_summary(mail) for mail in mails], total
+        mails, total = self._cached(self._paginated_search_mails, self.prepare_query(query), window, page)
+        return [self._summary(mail) for mail in mails], total
+
+    def thread_idents(self, thread_id):
+        self.flush()
+        return self.thread_index.idents(thread_id)
+
+    def search_summaries_after(self, query, window=25, after='', exact=True):
+        """ One window of mails sorted newest first, starting right after the cursor of the previous window """
+        window, query = int(window), self.prepare_query(query)
+        mails = self._cached(self._search_after, query, window, after or '')
+        total = self._cached(self._count, query, exact)
+        next_cursor = self._cursor(mails[-1]) if len(mails) == window else None
+        return [self._summary(mail) for mail in mails], total, next_cursor
+
+    def _search_after(self, query, window, after):
+        restricted = And([query, self._after_cursor(after)]) if after else query
+        with self._searcher() as searcher:
+            results = searcher.search(restricted, limit=window, sortedby=[sorting.FieldFacet('date', reverse=True),
+                                                                           sorting.FieldFacet('ident', reverse=True)])
+            return [hit.fields() for hit in results]
+
+    def count(self, query, exact=True):
+        """ Number of mails matching the query, or an upper bound from the term statistics when not exact """
+        return self._cached(self._count, self.prepare_query(query), exact)
+
+    def _count(self, query, exact):
+        with self._searcher() as searcher:
+            if exact:
+                return len(searcher.search(query, limit=None, scored=False))
+            return query.estimate_size(searcher.reader())
+
+    def _cursor(self, fields):
+        return '%d:%s' % (fields['date'], fields['ident'])
+
+    def _after_cursor(self, cursor):
+        date, _, ident = cursor.partition(':')
+        date = int(date)
+        if not ident:
+            raise ValueError('Invalid cursor: %s' % cursor)
+        return Or([NumericRange('date', None, date, endexcl=True),
+                   And([NumericRange('date', date, date), TermRange('ident', None, unicode(ident), endexcl=True)])])
+
+    def _cached(self, search, query, *args):
+        # cached results belong to the index generation they were read from, so commit pending writes first
+        self.flush()
+        return self.results.get((search.__name__, unicode(query)) + args, lambda: search(query, *args))
+
+    def _summary(self, fields):
+        mailbox = fields['mailbox']
+        return {
+            'ident': fields['ident'],
+            'header': {
+                'from': fields['sender'] or None,
+                'to': self._split(fields['to']),
+                'cc': self._split(fields['cc']),
+                'subject': fields['subject'] or None,
+                'date': fields['iso_date']
+            },
+            'tags': [tag for tag in self._split(fields['tag']) if tag != mailbox],
+            'status': list(Status.from_flags(self._split(fields['flags']))),
+            'mailbox': mailbox,
+            'snippet': fields['snippet'],
+            'attachment_count': fields['attachment_count'],
+            'thread': self.thread_index.thread_of(fields['ident'])
+        }
+
+    def _thread_summary(self, fields):
+        summary = self._summary(fields)
+        summary['thread_size'] = self.thread_index.size(summary['thread'])
+        return summary
+
+    def _split(self, value):
+        return [item for item in value.split(',') if item]
 
     def _search_all_mails(self, query):
-        with self._index.searcher() as searcher:
+        with self._searcher() as searcher:
             sorting_facet = sorting.FieldFacet('date', reverse=True)
             results = searcher.search(query, sortedby=sorting_facet, reverse=True, limit=None)
             return unique([mail['ident'] for mail in results])
 
     def _paginated_search_mails(self, query, window, page):
-        page = int(page) if page is not None and int(page) > 1 else 1
-        window = int(window) if window is not None else 25
+        page, window = self._page(page, window)
 
-        with self._index.searcher() as searcher:
-            tags_facet = sorting.FieldFacet('tag', allow_overlap=True, maptype=sorting.Count)
+        with self._searcher() as searcher:
             sorting_facet = sorting.FieldFacet('date', reverse=True)
-            results = searcher.search_page(query, page, pagelen=window, groupedby=tags_facet, sortedby=sorting_facet)
-            return unique([mail['ident'] for mail in results]), sum(results.results.groups().values())
+            results = searcher.search_page(query, page, pagelen=window, sortedby=sorting_facet)
+            # the sorting collector sees every match, so the exact total comes for free
+            return [hit.fields() for hit in results], results.total
+
+    def _paginated_search_threads(self, query, window, page):
+        page, window = self._page(page, window)
+
+        with self._searcher() as searcher:
+            newest_first = sorting.FieldFacet('date', reverse=True)
+            thread = sorting.TranslateFacet(self._thread_of, sorting.FieldFacet('ident'))
+            results = searcher.search_page(query, page, pagelen=window, sortedby=newest_first,
+                                           collapse=thread, collapse_order=newest_first)
+            # the collapsing collector does not count mails displaced by a newer one of the same thread
+            idents = searcher.reader().column_reader('ident')
+            total = len(set(self._thread_of(idents[docnum]) for docnum in searcher.docs_for_query(query)))
+            return [hit.fields() for hit in results], total
+
+    def _thread_of(self, ident):
+        return self.thread_index.thread_of(ident.decode('utf-8') if isinstance(ident, str) else ident)
+
+    def _page(self, page, window):
+        page = int(page) if page is not None and int(page) > 1 else 1
+        window = int(window) if window is not None else 25
+        return page, window
 
     def prepare_query(self, query):
         query = (
@@ -174,27 +376,27 @@ class SearchEngine(object):
             .replace('-in:', 'AND NOT tag:')
             .replace('in:all', '*')
         )
-        return QueryParser('raw', self._index.schema).parse(query)
+        return QueryParser('content', self._index.schema).parse(query)
+
+    def doc_count(self):
+        with self._searcher() as searcher:
+            return searcher.doc_count()
+
+    def all_idents(self):
+        self.flush()
+        return self.mailbox_idents.all()
+
+    def missing_idents(self, mailbox, idents):
+        """ The given idents not indexed in the mailbox, without a flush: queued mails count as missing """
+        return self.mailbox_idents.missing(mailbox.lower(), idents)
 
     def remove_from_index(self, mail_id):
-        writer = self._index.writer()
-        try:
-            writer.delete_by_term('ident', mail_id)
-        finally:
-            writer.commit()
+        self.index_writer.delete(unicode(mail_id))
+
+    def remove_many_from_index(self, mail_ids):
+        for mail_id in mail_ids:
+            self.remove_from_index(mail_id)
 
     def contacts(self, query):
-        if query:
-            to = QueryParser('to', self._index.schema)
-            cc = QueryParser('cc', self._index.schema)
-            bcc = QueryParser('bcc', self._index.schema)
-            with self._index.searcher() as searcher:
-                to = searcher.search(to.parse("*%s*" % query), limit=None,
-                                     groupedby=sorting.FieldFacet('to', allow_overlap=True)).groups()
-                cc = searcher.search(cc.parse("*%s*" % query), limit=None,
-                                     groupedby=sorting.FieldFacet('cc', allow_overlap=True)).groups()
-                bcc = searcher.search(bcc.parse("*%s*" % query), limit=None,
-                                      groupedby=sorting.FieldFacet('bcc', allow_overlap=True)).groups()
-                return flatten([to, cc, bcc])
-
-        return []
+        self.flush()
+        return self.contact_store.search(query, limit=self.CONTACTS_LIMIT)
@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from threading import Lock
+
+
+class SearcherPool(object):
+    """ Long lived whoosh searchers shared between queries.
+
+        Whoosh readers seek and read through shared file objects, so a searcher is lent to one
+        query at a time. Returned searchers stay open and are only refreshed after invalidate()
+        reports a writer commit; a searcher lent out during a commit keeps answering from its
+        snapshot until it is returned.
+    """
+
+    def __init__(self, index, max_idle=8):
+        self._index = index
+        self.max_idle = max_idle
+        self._lock = Lock()
+        self._idle = []
+        self._generation = 0
+        self._closed = False
+        self.opened = 0
+        self.refreshed = 0
+        self.reused = 0
+
+    def searcher(self):
+        return _Lease(self)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for searcher, _ in idle:
+            searcher.close()
+
+    def _acquire(self):
+        with self._lock:
+            generation = self._generation
+            searcher, searcher_generation = self._idle.pop() if self._idle else (None, None)
+            if searcher is None:
+                self.opened += 1
+            elif searcher_generation != generation:
+                self.refreshed += 1
+            else:
+                self.reused += 1
+
+        if searcher is None:
+            searcher = self._index.searcher()
+        elif searcher_generation != generation:
+            searcher = searcher.refresh()
+        return searcher, generation
+
+    def _release(self, searcher, generation):
+        with self._lock:
+            if not self._closed and len(self._idle) < self.max_idle:
+                self._idle.append((searcher, generation))
+                return
+        searcher.close()
+
+    def stats(self):
+        with self._lock:
+            return {'idle': len(self._idle),
+                    'opened': self.opened,
+                    'refreshed': self.refreshed,
+                    'reused': self.reused}
+
+
+class _Lease(object):
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._searcher = None
+        self._generation = None
+
+    def __enter__(self):
+        self._searcher, self._generation = self._pool._acquire()
+        return self._searcher
+
+    def __exit__(self, *exc_info):
+        self._pool._release(self._searcher, self._generation)
+        self._searcher = None
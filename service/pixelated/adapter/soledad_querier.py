@@ -13,18 +13,46 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
-import base64
-import quopri
-
 from cryptography.fernet import Fernet
 from pixelated.adapter.mail import PixelatedMail
+from pixelated.adapter.mail_body_loader import MailBodyLoader
+from pixelated.support.functional import unique
+from pixelated.support.lru_cache import LRUCache
+from pixelated.support.transfer_decoding import DecodedContent
+from threading import Lock
 import re
 
 
 class SoledadQuerier:
+    # sqlite refuses statements with more than 999 bound variables
+    MAX_QUERY_VARIABLES = 500
+    MAIL_CACHE_SIZE = 32 * 1024 * 1024
+    # rough footprint of the flags and header docs of a cached mail
+    MAIL_OVERHEAD = 4 * 1024
+    MAIL_BATCH = 200
+    TAG_INDEX = 'by-type-and-tag'
 
     def __init__(self, soledad):
         self.soledad = soledad
+        self.soledad.create_index(self.TAG_INDEX, 'type', PixelatedMail.TAGS_KEY)
+        self.mail_cache = LRUCache(self.MAIL_CACHE_SIZE, sizeof=self._mail_size)
+        self._writes_lock = Lock()
+        self.saves = 0
+        self.saved_mails = 0
+        self.docs_written = 0
+        # set once migrate_tags has run, until then tags may only be in the X-Tags header
+        self.tags_migrated = False
+
+    def _mail_size(self, mail):
+        size = self.MAIL_OVERHEAD + len(mail.bdoc.content.get('raw') or '')
+        if mail.parts:
+            size += sum(len(alternative['content'] or '') for alternative in mail.parts['alternatives'])
+        return size
+
+    def _cached_mail(self, fdoc, hdoc):
+        def is_current(mail):
+            return mail.fdoc.rev == fdoc.rev and mail.hdoc.rev == hdoc.rev
+        return self.mail_cache.get(fdoc.content['chash'], is_valid=is_current)
 
     def get_index_masterkey(self):
         index_key = self.soledad.get_from_index('by-type', 'index_key')
@@ -69,7 +97,27 @@ class SoledadQuerier:
         fdocs_chash = [(fdoc, fdoc.content['chash']) for fdoc in self.soledad.get_from_index('by-type', 'flags')]
         if len(fdocs_chash) == 0:
             return []
-        return self._build_mails_from_fdocs(fdocs_chash)
+        return self.load_bodies(self._build_mails_from_fdocs(fdocs_chash))
+
+    def iter_mails(self, batch_size=MAIL_BATCH):
+        """ Every mail, built batch_size at a time so that only one batch of docs is held in memory """
+        last_doc_id = ''
+        while True:
+            fdocs = self._docs_after('flags', last_doc_id, batch_size)
+            if not fdocs:
+                return
+            last_doc_id = fdocs[-1].doc_id
+            for mail in self.load_bodies(self._build_mails_from_fdocs([(fdoc, fdoc.content['chash']) for fdoc in fdocs])):
+                yield mail
+
+    def _docs_after(self, doc_type, doc_id, limit):
+        # keyset paging instead of one open cursor, so writes between batches can't disturb it
+        db = self.soledad._db
+        cursor = db._db_handle.cursor()
+        cursor.execute("SELECT d.doc_id, d.doc_rev, d.content FROM document d, document_fields t"
+                       " WHERE d.doc_id = t.doc_id AND t.field_name = 'type' AND t.value = ?"
+                       " AND d.doc_id > ? ORDER BY d.doc_id LIMIT ?", (doc_type, doc_id, limit))
+        return [db._factory(doc_id, doc_rev, content) for doc_id, doc_rev, content in cursor.fetchall()]
 
     def all_mails_by_mailbox(self, mailbox_name):
         fdocs_chash = [(fdoc, fdoc.content['chash']) for fdoc in self.soledad.get_from_index('by-type-and-mbox', 'flags', mailbox_name)]
@@ -79,29 +127,78 @@ class SoledadQuerier:
         if len(fdocs_chash) == 0:
             return []
 
-        fdocs_hdocs = []
+        hdocs = self._get_many_from_index('head', 'chash', [chash for _, chash in fdocs_chash])
+        body_loader = MailBodyLoader(self.load_bodies)
+        mails = []
         for fdoc, chash in fdocs_chash:
-            hdoc = self.soledad.get_from_index('by-type-and-contenthash', 'head', chash)
-            if len(hdoc) == 0:
+            if chash in hdocs:
+                mails.append(self._mail_from_docs(fdoc, hdocs[chash][0], body_loader))
+        return mails
+
+    def _mail_from_docs(self, fdoc, hdoc, body_loader):
+        mail = self._cached_mail(fdoc, hdoc)
+        if not mail:
+            mail = PixelatedMail.from_soledad(fdoc, hdoc, soledad_querier=self, body_loader=body_loader)
+            body_loader.add(mail)
+        return mail
+
+    def load_bodies(self, mails):
+        """ Fetches the body and parts of all the given lazy mails with one query, returning the mails that have a body """
+        lazy_mails = [mail for mail in mails if not mail.body_loaded]
+        cdocs = self._get_many_from_index('cnt', 'phash', self._content_phashes([mail.hdoc for mail in lazy_mails]))
+        for mail in lazy_mails:
+            bdoc = cdocs.get(mail.hdoc.content.get('body'))
+            if not bdoc:
+                # the body is not synced yet
+                mail.set_body(None, None)
                 continue
-            fdocs_hdocs.append((fdoc, hdoc[0]))
-
-        fdocs_hdocs_bodyphash = [(f[0], f[1], f[1].content.get('body')) for f in fdocs_hdocs]
-        fdocs_hdocs_bdocs_parts = []
-        for fdoc, hdoc, body_phash in fdocs_hdocs_bodyphash:
-            bdoc = self.soledad.get_from_index('by-type-and-payloadhash', 'cnt', body_phash)
-            if len(bdoc) == 0:
-                continue
-            parts = self._extract_parts(hdoc.content)
-            fdocs_hdocs_bdocs_parts.append((fdoc, hdoc, bdoc[0], parts))
-
-        return [PixelatedMail.from_soledad(*raw_mail, soledad_querier=self) for raw_mail in fdocs_hdocs_bdocs_parts]
+            mail.set_body(bdoc[0], self._extract_parts(mail.hdoc.content, cdocs))
+            self.mail_cache.put(mail.ident, mail)
+        return [mail for mail in mails if mail.bdoc]
+
+    def _content_phashes(self, hdocs):
+        phashes = []
+        for hdoc in hdocs:
+            phashes.append(hdoc.content.get('body'))
+            phashes.extend(part.get('phash') for part, _ in PixelatedMail.alternative_parts(hdoc.content))
+        return unique(phashes)
+
+    def _get_many_from_index(self, doc_type, field, values):
+        db = self.soledad._db
+        docs_by_value = {}
+        values = [value for value in unique(values) if value]
+        for start in range(0, len(values), self.MAX_QUERY_VARIABLES):
+            batch = values[start:start + self.MAX_QUERY_VARIABLES]
+            statement = ("SELECT d.doc_id, d.doc_rev, d.content, v.value"
+                         " FROM document d, document_fields t, document_fields v"
+                         " WHERE d.doc_id = t.doc_id AND t.field_name = 'type' AND t.value = ?"
+                         " AND d.doc_id = v.doc_id AND v.field_name = ? AND v.value IN (%s)"
+                         % ','.join('?' * len(batch)))
+            cursor = db._db_handle.cursor()
+            cursor.execute(statement, [doc_type, field] + batch)
+            for doc_id, doc_rev, content, value in cursor.fetchall():
+                docs_by_value.setdefault(value, []).append(db._factory(doc_id, doc_rev, content))
+        return docs_by_value
 
     def save_mail(self, mail):
-        # XXX update only what has to be updated
-        self.soledad.put_doc(mail.fdoc)
-        self.soledad.put_doc(mail.hdoc)
-        self._update_index([mail.fdoc, mail.hdoc])
+        self.save_mails([mail])
+
+    def save_mails(self, mails):
+        """ Writes only the docs each mail changed since it was loaded """
+        docs = []
+        for mail in mails:
+            for doc in mail.changed_docs():
+                self.soledad.put_doc(doc)
+                docs.append(doc)
+            mail.mark_as_saved()
+        self._update_index(docs)
+        self._count_writes(len(mails), len(docs))
+
+        for mail in mails:
+            if mail.body_loaded:
+                self.mail_cache.put(mail.ident, mail)
+            else:
+                self.mail_cache.remove(mail.ident)
 
     def create_mail(self, mail, mailbox_name):
         mbox = [m for m in self.soledad.get_from_index('by-type', 'mbox') if m.content['mbox'] == 'INBOX'][0]
@@ -118,47 +215,106 @@ class SoledadQuerier:
     def mail(self, ident):
         fdoc = self.soledad.get_from_index('by-type-and-contenthash', 'flags', ident)[0]
         hdoc = self.soledad.get_from_index('by-type-and-contenthash', 'head', ident)[0]
-        parts = self._extract_parts(hdoc.content)
-        bdoc = self.soledad.get_from_index('by-type-and-payloadhash', 'cnt', hdoc.content['body'])[0]
-
-        return PixelatedMail.from_soledad(fdoc, hdoc, bdoc, parts=parts, soledad_querier=self)
+        return self._mail_from_docs(fdoc, hdoc, MailBodyLoader(self.load_bodies))
 
     def attachment(self, ident, encoding):
+        attachment = self.attachment_content(ident, encoding)
+        return {'content': attachment['content'].read(),
+                'content-type': attachment['content-type']}
+
+    def attachment_content(self, ident, encoding):
         bdoc = self.soledad.get_from_index('by-type-and-payloadhash', 'cnt', ident)[0]
-        return {'content': self._try_decode(bdoc.content['raw'], encoding),
+        return {'content': DecodedContent(bdoc.content['raw'], encoding),
                 'content-type': bdoc.content['content-type']}
 
-    def _try_decode(self, raw, encoding):
-        encoding = encoding.lower()
-        if encoding == 'base64':
-            return base64.decodestring(raw)
-        elif encoding == 'quoted-printable':
-            return quopri.decodestring(raw)
-        else:
-            return str(raw)
-
     def mails(self, idents):
-        fdocs_chash = [(self.soledad.get_from_index('by-type-and-contenthash', 'flags', ident), ident) for ident in idents]
-        fdocs_chash = [(result[0], ident) for result, ident in fdocs_chash if result]
+        """ Lazy mails: their bodies are fetched together the first time one of them is read """
+        fdocs = self._get_many_from_index('flags', 'chash', idents)
+        fdocs_chash = [(fdocs[ident][0], ident) for ident in idents if ident in fdocs]
         return self._build_mails_from_fdocs(fdocs_chash)
 
-    def _extract_parts(self, hdoc, parts=None):
-        if not parts:
-            parts = {'alternatives': [], 'attachments': []}
-
-        if hdoc['multi']:
-            for part_key in hdoc.get('part_map', {}).keys():
-                self._extract_parts(hdoc['part_map'][part_key], parts)
-        else:
-            headers_dict = {elem[0]: elem[1] for elem in hdoc.get('headers', [])}
-            if 'attachment' in headers_dict.get('Content-Disposition', ''):
-                parts['attachments'].append(self._extract_attachment(hdoc, headers_dict))
+    def mails_by_tags(self, tags):
+        fdocs = {}
+        for tag in tags:
+            for fdoc in self.soledad.get_from_index(self.TAG_INDEX, 'flags', tag):
+                fdocs[fdoc.content['chash']] = fdoc
+        if not self.tags_migrated:
+            legacy_idents = [ident for ident in self._legacy_tagged_idents(tags) if ident not in fdocs]
+            for ident, legacy_fdocs in self._get_many_from_index('flags', 'chash', legacy_idents).items():
+                untagged = [fdoc for fdoc in legacy_fdocs if PixelatedMail.TAGS_KEY not in fdoc.content]
+                if untagged:
+                    fdocs[ident] = untagged[0]
+        return self._build_mails_from_fdocs([(fdoc, chash) for chash, fdoc in fdocs.items()])
+
+    def _legacy_tagged_idents(self, tags):
+        tags = set(tags)
+        for hdoc in self._legacy_hdocs():
+            if tags.intersection(PixelatedMail.legacy_tags(hdoc.content['headers'])):
+                yield hdoc.content['chash']
+
+    def _legacy_hdocs(self):
+        last_doc_id = ''
+        while True:
+            hdocs = self._docs_after('head', last_doc_id, self.MAIL_BATCH)
+            if not hdocs:
+                return
+            last_doc_id = hdocs[-1].doc_id
+            for hdoc in hdocs:
+                if 'X-Tags' in hdoc.content.get('headers', {}):
+                    yield hdoc
+
+    def migrate_tags(self):
+        """ Moves tags still kept in the X-Tags header of the header doc to the flags docs, returning how many mails moved """
+        migrated = 0
+        legacy_idents = []
+        for hdoc in self._legacy_hdocs():
+            legacy_idents.append(hdoc.content['chash'])
+            if len(legacy_idents) == self.MAIL_BATCH:
+                migrated += self.migrate_mail_tags(self.mails(legacy_idents))
+                legacy_idents = []
+        migrated += self.migrate_mail_tags(self.mails(legacy_idents))
+        self.tags_migrated = True
+        return migrated
+
+    def migrate_mail_tags(self, mails):
+        """ Moves the legacy tags of the given mails to their flags docs, returning how many mails moved """
+        legacy_mails = [mail for mail in mails if mail.has_legacy_tags]
+        if not legacy_mails:
+            return 0
+        # the header doc is shared by every copy of a mail, so all of their flags docs take the tags first
+        fdocs = self._get_many_from_index('flags', 'chash', [mail.ident for mail in legacy_mails])
+        copies = []
+        for mail in legacy_mails:
+            tags = sorted(PixelatedMail.legacy_tags(mail.hdoc.content['headers']))
+            for fdoc in fdocs.get(mail.ident, []):
+                if fdoc.doc_id != mail.fdoc.doc_id and PixelatedMail.TAGS_KEY not in fdoc.content:
+                    fdoc.content[PixelatedMail.TAGS_KEY] = tags
+                    self.soledad.put_doc(fdoc)
+                    copies.append(fdoc)
+            mail.set_tags(mail.tags)
+        self._update_index(copies)
+        self.save_mails(legacy_mails)
+        return len(legacy_mails)
+
+    def mails_with_bodies(self, idents):
+        """ Mails with their bodies already fetched, leaving out those whose body has not synced yet """
+        return self.load_bodies(self.mails(idents))
+
+    def _extract_parts(self, hdoc, cdocs=None):
+        parts = {'alternatives': [], 'attachments': []}
+
+        for part, headers_dict in PixelatedMail.leaf_parts(hdoc):
+            if PixelatedMail.is_attachment(headers_dict):
+                parts['attachments'].append(self._extract_attachment(part, headers_dict))
             else:
-                parts['alternatives'].append(self._extract_alternative(hdoc, headers_dict))
+                parts['alternatives'].append(self._extract_alternative(part, headers_dict, cdocs))
         return parts
 
-    def _extract_alternative(self, hdoc, headers_dict):
-        bdoc = self.soledad.get_from_index('by-type-and-payloadhash', 'cnt', hdoc['phash'])[0]
+    def _extract_alternative(self, hdoc, headers_dict, cdocs=None):
+        if cdocs and hdoc['phash'] in cdocs:
+            bdoc = cdocs[hdoc['phash']][0]
+        else:
+            bdoc = self.soledad.get_from_index('by-type-and-payloadhash', 'cnt', hdoc['phash'])[0]
         raw_content = bdoc.content['raw']
         return {'headers': headers_dict, 'content': raw_content}
 
@@ -171,15 +327,71 @@ class SoledadQuerier:
         return {'headers': headers_dict, 'ident': hdoc['phash'], 'name': filename}
 
     def remove_mail(self, mail):
-        _mail = self.mail(mail.ident)
-        # FIX-ME: Must go through all the part_map phash to delete all the cdocs
-        self.soledad.delete_doc(_mail.fdoc)
-        self.soledad.delete_doc(_mail.hdoc)
-        self.soledad.delete_doc(_mail.bdoc)
+        self.remove_mails([self.mail(mail.ident)])
+
+    def remove_mails(self, mails):
+        for mail in mails:
+            self.mail_cache.remove(mail.ident)
+            # FIX-ME: Must go through all the part_map phash to delete all the cdocs
+            self.soledad.delete_doc(mail.fdoc)
+            self.soledad.delete_doc(mail.hdoc)
+            if mail.bdoc:
+                self.soledad.delete_doc(mail.bdoc)
+
+    def idents(self):
+        return set(doc.content['chash'] for doc in self.soledad.get_from_index('by-type', 'flags'))
+
+    def mail_count(self):
+        """ Distinct mails, as indexed: a mail kept in several mailboxes has one flags doc per copy """
+        cursor = self.soledad._db._db_handle.cursor()
+        cursor.execute("SELECT COUNT(DISTINCT c.value) FROM document_fields t, document_fields c"
+                       " WHERE t.doc_id = c.doc_id AND t.field_name = 'type' AND t.value = 'flags'"
+                       " AND c.field_name = 'chash'")
+        return cursor.fetchone()[0]
+
+    def generation(self):
+        return self.soledad._db._get_generation()
+
+    def changes_since(self, generation):
+        generation, _, changes = self.soledad._db.whats_changed(generation)
+        doc_ids = unique([doc_id for doc_id, _, _ in changes])
+
+        changed_idents, has_deletions = set(), False
+        for doc in self.soledad.get_docs(doc_ids, check_for_conflicts=False, include_deleted=True):
+            if doc.is_tombstone():
+                has_deletions = True
+            elif doc.content.get('type') in ['flags', 'head']:
+                changed_idents.add(doc.content['chash'])
+        return generation, changed_idents, has_deletions
 
     def idents_by_mailbox(self, mailbox_name):
         return set(doc.content['chash'] for doc in self.soledad.get_from_index('by-type-and-mbox-and-deleted', 'flags', mailbox_name, '0'))
 
+    def mailbox_changes_since(self, mailbox_name, generation):
+        """ Idents of the mails in the mailbox whose flags doc changed after the given generation """
+        generation, _, changes = self.soledad._db.whats_changed(generation)
+        doc_ids = unique([doc_id for doc_id, _, _ in changes])
+
+        idents = set()
+        for doc in self.soledad.get_docs(doc_ids, check_for_conflicts=False):
+            content = doc.content
+            if content.get('type') == 'flags' and content.get('mbox') == mailbox_name and not content.get('deleted'):
+                idents.add(content['chash'])
+        return generation, idents
+
+    def _count_writes(self, mails, docs):
+        with self._writes_lock:
+            self.saves += 1
+            self.saved_mails += mails
+            self.docs_written += docs
+
+    def write_stats(self):
+        with self._writes_lock:
+            return {'saves': self.saves,
+                    'mails': self.saved_mails,
+                    'docs_written': self.docs_written,
+                    'docs_per_save': float(self.docs_written) / self.saves if self.saves else 0.0}
+
     def _update_index(self, docs):
         db = self.soledad._db
 
@@ -0,0 +1,60 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from threading import Lock
+
+from pixelated.adapter.status import Status
+
+
+class TagCounts(object):
+    """ Total and read mail counts per tag, kept in step with the stored fields of indexed mails """
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = Lock()
+
+    def add(self, fields):
+        self._count(fields, 1)
+
+    def remove(self, fields):
+        self._count(fields, -1)
+
+    def _count(self, fields, delta):
+        if not fields:
+            return
+        read = Status.SEEN in self._split(fields.get('flags'))
+        with self._lock:
+            for tag in set(self._split(fields.get('tag'))):
+                count = self._counts.setdefault(tag, {'total': 0, 'read': 0})
+                count['total'] += delta
+                if read:
+                    count['read'] += delta
+                if count['total'] <= 0:
+                    del self._counts[tag]
+
+    def replace(self, old_fields, new_fields):
+        self.remove(old_fields)
+        self.add(new_fields)
+
+    def totals(self):
+        with self._lock:
+            return dict((tag, count['total']) for tag, count in self._counts.iteritems())
+
+    def reads(self):
+        with self._lock:
+            return dict((tag, count['read']) for tag, count in self._counts.iteritems() if count['read'])
+
+    def _split(self, value):
+        return [item.strip() for item in (value or '').split(',') if item.strip()]
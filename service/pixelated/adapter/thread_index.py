@@ -0,0 +1,131 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import re
+from threading import Lock
+
+
+class ThreadIndex(object):
+    """ Groups indexed mails into conversations, kept in step with the stored fields of indexed mails.
+
+        Mails are linked through their Message-ID and the ids they reference, including ids of mails
+        not seen yet, so replies arriving before their parent still end up together. Mails without
+        references fall back to their subject stripped of reply and forward prefixes. A thread is
+        identified by the ident of its oldest mail.
+    """
+
+    REPLY_PREFIX = re.compile(r'^\s*((re|fwd?|aw|sv)(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+
+    def __init__(self):
+        self._mails = {}
+        self._parent = {}
+        self._nodes = {}
+        self._members = {}
+        self._thread_ids = {}
+        self._lock = Lock()
+
+    def add(self, fields):
+        if not fields:
+            return
+        with self._lock:
+            ident = fields['ident']
+            message_id = fields.get('message_id')
+            references = (fields.get('references') or '').split()
+            self._mails[ident] = {'node': 'msg:' + message_id if message_id else 'ident:' + ident,
+                                  'links': ['msg:' + reference for reference in references] or self._subject_links(fields),
+                                  'date': fields.get('date') or 0}
+            self._link(ident)
+
+    def remove(self, fields):
+        if not fields:
+            return
+        with self._lock:
+            mail = self._mails.pop(fields['ident'], None)
+            if mail is None:
+                return
+            root = self._find(mail['node'])
+            for node in self._nodes.pop(root):
+                del self._parent[node]
+            self._thread_ids.pop(root, None)
+            for ident in self._members.pop(root):
+                if ident in self._mails:
+                    self._link(ident)
+
+    def replace(self, old_fields, new_fields):
+        if old_fields and new_fields and self._threading_fields(old_fields) == self._threading_fields(new_fields):
+            return
+        self.remove(old_fields)
+        self.add(new_fields)
+
+    def thread_of(self, ident):
+        with self._lock:
+            mail = self._mails.get(ident)
+            return self._thread_id(self._find(mail['node'])) if mail else None
+
+    def idents(self, thread_id):
+        """ Idents of the mails in the thread of thread_id, which may be any ident of the thread """
+        with self._lock:
+            mail = self._mails.get(thread_id)
+            return set(self._members[self._find(mail['node'])]) if mail else set()
+
+    def size(self, thread_id):
+        with self._lock:
+            mail = self._mails.get(thread_id)
+            return len(self._members[self._find(mail['node'])]) if mail else 0
+
+    def _link(self, ident):
+        mail = self._mails[ident]
+        root = self._find(mail['node'])
+        for link in mail['links']:
+            root = self._union(root, link)
+        self._members[root].add(ident)
+        self._thread_ids.pop(root, None)
+
+    def _find(self, node):
+        if node not in self._parent:
+            self._parent[node] = node
+            self._nodes[node] = {node}
+            self._members[node] = set()
+        root = node
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while node != root:
+            self._parent[node], node = root, self._parent[node]
+        return root
+
+    def _union(self, node, other):
+        root, other = self._find(node), self._find(other)
+        if root == other:
+            return root
+        if len(self._nodes[root]) < len(self._nodes[other]):
+            root, other = other, root
+        self._parent[other] = root
+        self._nodes[root].update(self._nodes.pop(other))
+        self._members[root].update(self._members.pop(other))
+        self._thread_ids.pop(root, None)
+        self._thread_ids.pop(other, None)
+        return root
+
+    def _thread_id(self, root):
+        if root not in self._thread_ids:
+            self._thread_ids[root] = min(self._members[root], key=lambda ident: (self._mails[ident]['date'], ident))
+        return self._thread_ids[root]
+
+    def _subject_links(self, fields):
+        subject = u' '.join(self.REPLY_PREFIX.sub(u'', fields.get('subject') or u'').lower().split())
+        return ['subject:' + subject] if subject else []
+
+    def _threading_fields(self, fields):
+        return [fields.get(name) for name in ('ident', 'message_id', 'references', 'subject', 'date')]
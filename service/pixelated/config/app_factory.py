@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 import sys
+import time
 
 from OpenSSL import SSL
 from OpenSSL import crypto
@@ -21,6 +22,7 @@ from twisted.internet import reactor
 from twisted.internet import ssl
 from twisted.web import resource
 from twisted.web.util import redirectTo
+from twisted.python import log
 from pixelated.config.routes import setup_routes
 from pixelated.adapter.mail_service import MailService
 from pixelated.adapter.mail import InputMail
@@ -28,6 +30,7 @@ from pixelated.adapter.mail_sender import MailSender
 from pixelated.adapter.mailboxes import Mailboxes
 from pixelated.adapter.soledad_querier import SoledadQuerier
 from pixelated.adapter.search import SearchEngine
+from pixelated.adapter.incremental_indexer import IncrementalIndexer
 from pixelated.adapter.draft_service import DraftService
 from pixelated.adapter.mailbox_indexer_listener import MailboxIndexerListener
 import pixelated.bitmask_libraries.session as LeapSession
@@ -35,6 +38,8 @@ from pixelated.bitmask_libraries.leap_srp import LeapAuthException
 from requests.exceptions import ConnectionError
 from pixelated.controllers import *
 from pixelated.adapter.tag_service import TagService
+from pixelated.support.executor import Executor
+import pixelated.support.date
 from leap.common.events import (
     register,
     unregister,
@@ -44,20 +49,24 @@ from twisted.web.server import Site
 
 CREATE_KEYS_IF_KEYS_DONT_EXISTS_CALLBACK = 12345
 
+# SQLCipher serializes on a single connection, whoosh searchers read concurrently
+SOLEDAD_THREADS = 1
+SEARCH_THREADS = 4
 
-def init_index_and_remove_dupes(querier, search_engine, mail_service):
+
+def init_index_and_remove_dupes(querier, incremental_indexer):
     def wrapper(*args, **kwargs):
         querier.remove_duplicates()
-        search_engine.index_mails(mails=mail_service.all_mails(),
-                                  callback=querier.mark_all_as_not_recent)
+        incremental_indexer.resume(callback=querier.mark_all_as_not_recent)
 
     return wrapper
 
 
-def update_info_sync_and_index_partial(sync_info_controller, search_engine, mail_service):
+def update_info_sync_and_index_partial(sync_info_controller, incremental_indexer):
     def wrapper(soledad_sync_status):
         sync_info_controller.set_sync_info(soledad_sync_status)
-        search_engine.index_mails(mails=mail_service.all_mails())
+        indexed = incremental_indexer.index_changes()
+        log.msg('Incrementally indexed %d mails up to generation %d' % (indexed, incremental_indexer.generation))
 
     return wrapper
 
@@ -89,40 +98,54 @@ def init_app(app):
     soledad_querier = SoledadQuerier(soledad=leap_session.account._soledad)
 
     tag_service = TagService()
+    started_at = time.time()
     search_engine = SearchEngine(soledad_querier)
+    incremental_indexer = IncrementalIndexer(soledad_querier, search_engine, started_at=started_at)
     pixelated_mail_sender = MailSender(leap_session.account_email())
 
     pixelated_mailboxes = Mailboxes(leap_session.account, soledad_querier)
     draft_service = DraftService(pixelated_mailboxes)
-    mail_service = MailService(pixelated_mailboxes, pixelated_mail_sender, tag_service, soledad_querier)
+    mail_service = MailService(pixelated_mailboxes, pixelated_mail_sender, tag_service, soledad_querier, search_engine)
 
     MailboxIndexerListener.SEARCH_ENGINE = search_engine
     InputMail.FROM_EMAIL_ADDRESS = leap_session.account_email()
 
+    soledad_executor = Executor('soledad', max_threads=SOLEDAD_THREADS)
+    search_executor = Executor('search', max_threads=SEARCH_THREADS)
+
     home_controller = HomeController()
     features_controller = FeaturesController()
     mails_controller = MailsController(mail_service=mail_service,
                                        draft_service=draft_service,
-                                       search_engine=search_engine)
-    tags_controller = TagsController(search_engine=search_engine)
-    contacts_controller = ContactsController(search_engine=search_engine)
+                                       search_engine=search_engine,
+                                       soledad_executor=soledad_executor,
+                                       search_executor=search_executor)
+    tags_controller = TagsController(search_engine=search_engine, search_executor=search_executor)
+    contacts_controller = ContactsController(search_engine=search_engine, search_executor=search_executor)
     sync_info_controller = SyncInfoController()
     attachments_controller = AttachmentsController(soledad_querier)
+    stats_controller = StatsController(mail_cache=soledad_querier.mail_cache.stats,
+                                       mail_writes=soledad_querier.write_stats,
+                                       index_writer=search_engine.index_writer.stats,
+                                       searchers=search_engine.searchers.stats,
+                                       query_cache=search_engine.results.stats,
+                                       soledad_pool=soledad_executor.stats,
+                                       search_pool=search_executor.stats,
+                                       indexer=incremental_indexer.stats,
+                                       dates=pixelated.support.date.cache_stats)
 
     register(signal=proto.SOLEDAD_SYNC_RECEIVE_STATUS,
              callback=update_info_sync_and_index_partial(sync_info_controller=sync_info_controller,
-                                                         search_engine=search_engine,
-                                                         mail_service=mail_service))
+                                                         incremental_indexer=incremental_indexer))
     register(signal=proto.SOLEDAD_DONE_DATA_SYNC,
              callback=init_index_and_remove_dupes(querier=soledad_querier,
-                                                  search_engine=search_engine,
-                                                  mail_service=mail_service))
+                                                  incremental_indexer=incremental_indexer))
 
     register(signal=proto.SOLEDAD_DONE_DATA_SYNC, uid=CREATE_KEYS_IF_KEYS_DONT_EXISTS_CALLBACK,
              callback=look_for_user_key_and_create_if_cant_find(leap_session))
 
     setup_routes(app, home_controller, mails_controller, tags_controller, features_controller,
-                 sync_info_controller, attachments_controller, contacts_controller)
+                 sync_info_controller, attachments_controller, contacts_controller, stats_controller)
 
 
 def create_app(app, args):
@@ -1,12 +1,14 @@
 def setup_routes(app, home_controller, mails_controller, tags_controller, features_controller, sync_info_controller,
-                 attachments_controller, contacts_controller):
+                 attachments_controller, contacts_controller, stats_controller):
     # mails
     app.route('/mails', methods=['GET'])(mails_controller.mails)
     app.route('/mail/<mail_id>/read', methods=['POST'])(mails_controller.mark_mail_as_read)
     app.route('/mail/<mail_id>/unread', methods=['POST'])(mails_controller.mark_mail_as_unread)
     app.route('/mails/unread', methods=['POST'])(mails_controller.mark_many_mail_unread)
     app.route('/mails/read', methods=['POST'])(mails_controller.mark_many_mail_read)
+    app.route('/mails/tags', methods=['POST'])(mails_controller.many_mail_tags)
     app.route('/mail/<mail_id>', methods=['GET'])(mails_controller.mail)
+    app.route('/thread/<thread_id>', methods=['GET'])(mails_controller.thread)
     app.route('/mail/<mail_id>', methods=['DELETE'])(mails_controller.delete_mail)
     app.route('/mails', methods=['DELETE'])(mails_controller.delete_mails)
     app.route('/mails', methods=['POST'])(mails_controller.send_mail)
@@ -22,5 +24,7 @@ def setup_routes(app, home_controller, mails_controller, tags_controller, featur
     app.route('/sync_info', methods=['GET'])(sync_info_controller.sync_info)
     # attachments
     app.route('/attachment/<attachment_id>', methods=['GET'])(attachments_controller.attachment)
+    # stats
+    app.route('/stats', methods=['GET'])(stats_controller.stats)
     # static
     app.route('/', methods=['GET'], branch=True)(home_controller.home)
@@ -38,3 +38,4 @@ from features_controller import FeaturesController
 from sync_info_controller import SyncInfoController
 from attachments_controller import AttachmentsController
 from contacts_controller import ContactsController
+from stats_controller import StatsController
@@ -14,35 +14,64 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 
-import io
 import re
-from twisted.protocols.basic import FileSender
+from pixelated.support.transfer_decoding import ChunkProducer
 from twisted.python.log import err
 
 
 class AttachmentsController:
 
+    BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
     def __init__(self, querier):
         self.querier = querier
 
     def attachment(self, request, attachment_id):
         encoding = request.args.get('encoding', [None])[0]
         filename = request.args.get('filename', [attachment_id])[0]
-        attachment = self.querier.attachment(attachment_id, encoding)
+        content = self.querier.attachment_content(attachment_id, encoding)['content']
+        length = len(content)
 
         request.setHeader(b'Content-Type', b'application/force-download')
         request.setHeader(b'Content-Disposition', bytes('attachment; filename=' + filename))
-        bytes_io = io.BytesIO(attachment['content'])
-        d = FileSender().beginFileTransfer(bytes_io, request)
+        request.setHeader(b'Accept-Ranges', b'bytes')
+
+        start, end = 0, length - 1
+        byte_range = self._byte_range(request.getHeader(b'range'))
+        if byte_range:
+            start, end = self._resolve_range(byte_range, length)
+            if start > end:
+                request.setResponseCode(416)
+                request.setHeader(b'Content-Range', bytes('bytes */%d' % length))
+                return ''
+            request.setResponseCode(206)
+            request.setHeader(b'Content-Range', bytes('bytes %d-%d/%d' % (start, end, length)))
+        request.setHeader(b'Content-Length', bytes(end - start + 1))
+
+        d = ChunkProducer(content.chunks(start, end)).beginProducing(request)
 
         def cbFinished(ignored):
-            bytes_io.close()
             request.finish()
 
         d.addErrback(err).addCallback(cbFinished)
 
         return d
 
+    def _byte_range(self, header):
+        # RFC 7233: a syntactically invalid range is ignored and the whole attachment is served
+        match = self.BYTE_RANGE.match(header.strip()) if header else None
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first and last and int(last) < int(first):
+            return None
+        return first, last
+
+    def _resolve_range(self, (first, last), length):
+        if not first:
+            return max(length - int(last), 0), length - 1
+        return int(first), min(int(last), length - 1) if last else length - 1
+
     def _extract_mimetype(self, content_type):
         match = re.compile('([A-Za-z-]+\/[A-Za-z-]+)').search(content_type)
         return match.group(1)
@@ -15,17 +15,17 @@
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 
 from pixelated.controllers import respond_json_deferred
-from twisted.internet.threads import deferToThread
 
 
 class ContactsController:
 
-    def __init__(self, search_engine):
+    def __init__(self, search_engine, search_executor):
         self._search_engine = search_engine
+        self._search_executor = search_executor
 
     def contacts(self, request):
         query = request.args.get('q', [''])[0]
-        d = deferToThread(lambda: self._search_engine.contacts(query))
+        d = self._search_executor.run(lambda: self._search_engine.contacts(query))
         d.addCallback(lambda tags: respond_json_deferred(tags, request))
 
         return d
@@ -21,111 +21,207 @@ from pixelated.controllers import respond_json
 
 class MailsController:
 
-    def __init__(self, mail_service, draft_service, search_engine):
+    def __init__(self, mail_service, draft_service, search_engine, soledad_executor, search_executor):
         self._mail_service = mail_service
         self._draft_service = draft_service
         self._search_engine = search_engine
+        self._soledad_executor = soledad_executor
+        self._search_executor = search_executor
 
     def mails(self, request):
-        mail_ids, total = self._search_engine.search(request.args.get('q')[0], request.args.get('w')[0], request.args.get('p')[0])
-        mails = self._mail_service.mails(mail_ids)
-
-        response = {
-            "stats": {
-                "total": total,
-            },
-            "mails": [mail.as_dict() for mail in mails]
-        }
-
-        return json.dumps(response)
+        query, window = request.args.get('q')[0], request.args.get('w')[0]
+
+        def _response(mails, total, **extra):
+            response = {
+                "stats": {
+                    "total": total,
+                },
+                "mails": mails
+            }
+            response.update(extra)
+            return respond_json(response, request)
+
+        if 'after' in request.args:
+            exact = request.args.get('exact', ['true'])[0] != 'false'
+            d = self._search_executor.run(self._search_engine.search_summaries_after, query, window,
+                                          request.args['after'][0], exact)
+            d.addCallback(lambda (mails, total, next_cursor): _response(mails, total, next=next_cursor))
+            d.addErrback(self._bad_request, request)
+        elif request.args.get('threads', ['false'])[0] == 'true':
+            d = self._search_executor.run(self._search_engine.search_summaries, query, window, request.args.get('p')[0],
+                                          threads=True)
+            d.addCallback(lambda (threads, total): _response(threads, total))
+        else:
+            d = self._search_executor.run(self._search_engine.search_summaries, query, window, request.args.get('p')[0])
+            d.addCallback(lambda (mails, total): _response(mails, total))
+        return d
 
     def mail(self, request, mail_id):
-        mail = self._mail_service.mail(mail_id)
-        return respond_json(mail.as_dict(), request)
+        d = self._soledad_executor.run(lambda: self._mail_service.mail(mail_id).as_dict())
+        d.addCallback(lambda mail: respond_json(mail, request))
+        return d
+
+    def thread(self, request, thread_id):
+        d = self._soledad_executor.run(lambda: [mail.as_dict() for mail in self._mail_service.thread(thread_id)])
+        d.addCallback(lambda mails: respond_json(mails, request) if mails else respond_json(None, request, 404))
+        return d
 
     def mark_mail_as_read(self, request, mail_id):
-        mail = self._mail_service.mark_as_read(mail_id)
-        self._search_engine.index_mail(mail)
-        return ""
+        d = self._soledad_executor.run(lambda: self._search_engine.index_mail(self._mail_service.mark_as_read(mail_id)))
+        d.addCallback(lambda _: "")
+        return d
 
     def mark_mail_as_unread(self, request, mail_id):
-        mail = self._mail_service.mark_as_unread(mail_id)
-        self._search_engine.index_mail(mail)
-        return ""
+        d = self._soledad_executor.run(lambda: self._search_engine.index_mail(self._mail_service.mark_as_unread(mail_id)))
+        d.addCallback(lambda _: "")
+        return d
 
     def mark_many_mail_unread(self, request):
-        content_dict = json.load(request.content)
-        idents = content_dict.get('idents')
-        for ident in idents:
-            mail = self._mail_service.mark_as_unread(ident)
-            self._search_engine.index_mail(mail)
-        return ""
+        try:
+            idents = self._idents(request)
+        except ValueError as e:
+            return respond_json(e.message, request, 400)
+        d = self._soledad_executor.run(lambda: self._search_engine.index_mails(self._mail_service.mark_many_as_unread(idents)))
+        d.addCallback(lambda _: "")
+        return d
 
     def mark_many_mail_read(self, request):
-        content_dict = json.load(request.content)
-        idents = content_dict.get('idents')
-        for ident in idents:
-            mail = self._mail_service.mark_as_read(ident)
-            self._search_engine.index_mail(mail)
-        return ""
+        try:
+            idents = self._idents(request)
+        except ValueError as e:
+            return respond_json(e.message, request, 400)
+        d = self._soledad_executor.run(lambda: self._search_engine.index_mails(self._mail_service.mark_many_as_read(idents)))
+        d.addCallback(lambda _: "")
+        return d
+
+    def many_mail_tags(self, request):
+        try:
+            content_dict = self._json_object(request)
+            idents = self._list(content_dict.get('idents'), 'idents')
+            added_tags = map(lambda tag: tag.lower(), self._list(content_dict.get('add', []), 'add', basestring))
+            removed_tags = map(lambda tag: tag.lower(), self._list(content_dict.get('remove', []), 'remove', basestring))
+        except ValueError as e:
+            return respond_json(e.message, request, 400)
+
+        def _update_tags():
+            mails = self._mail_service.update_many_tags(idents, added_tags, removed_tags)
+            self._search_engine.index_mails(mails)
+            return [mail.as_dict() for mail in mails]
+
+        d = self._soledad_executor.run(_update_tags)
+        d.addCallback(lambda mails: respond_json(mails, request))
+        d.addErrback(self._forbidden, request)
+        return d
 
     def delete_mail(self, request, mail_id):
-        mail = self._mail_service.mail(mail_id)
-        if mail.mailbox_name == 'TRASH':
-            self._mail_service.delete_permanent(mail_id)
-        else:
-            trashed_mail = self._mail_service.delete_mail(mail_id)
-            self._search_engine.index_mail(trashed_mail)
-        return respond_json(None, request)
+        def _delete():
+            mail = self._mail_service.mail(mail_id)
+            if mail.mailbox_name == 'TRASH':
+                self._mail_service.delete_permanent(mail_id)
+            else:
+                trashed_mail = self._mail_service.delete_mail(mail_id)
+                self._search_engine.index_mail(trashed_mail)
+
+        d = self._soledad_executor.run(_delete)
+        d.addCallback(lambda _: respond_json(None, request))
+        return d
 
     def delete_mails(self, request):
-        idents = json.loads(request.form['idents'])
-        for ident in idents:
-            self.delete_mail(ident)
-        return respond_json(None, request)
+        try:
+            idents = self._idents(request)
+        except ValueError as e:
+            return respond_json(e.message, request, 400)
+
+        def _delete():
+            trashed_mails, removed_mails = self._mail_service.delete_mails(idents)
+            self._search_engine.index_mails(trashed_mails)
+            self._search_engine.remove_many_from_index([mail.ident for mail in removed_mails])
+
+        d = self._soledad_executor.run(_delete)
+        d.addCallback(lambda _: respond_json(None, request))
+        return d
+
+    def _idents(self, request):
+        """ The idents of a bulk request, raising ValueError when they are missing or malformed """
+        if request.args and 'idents' in request.args:
+            return self._list(json.loads(request.args['idents'][0]), 'idents')
+        return self._list(self._json_object(request).get('idents'), 'idents')
+
+    def _json_object(self, request):
+        content = json.load(request.content)
+        if not isinstance(content, dict):
+            raise ValueError('Expected a JSON object')
+        return content
+
+    def _list(self, value, name, item_type=(basestring, int, long)):
+        if not isinstance(value, list) or not all(isinstance(item, item_type) for item in value):
+            raise ValueError("Expected '%s' to be a list" % name)
+        return value
 
     def send_mail(self, request):
-        try:
-            content_dict = json.loads(request.content.read())
+        content = request.content.read()
+
+        def _send():
+            content_dict = json.loads(content)
             _mail = InputMail.from_dict(content_dict)
             draft_id = content_dict.get('ident')
             if draft_id:
                 self._search_engine.remove_from_index(draft_id)
             _mail = self._mail_service.send(draft_id, _mail)
             self._search_engine.index_mail(_mail)
+            return _mail.as_dict()
 
-            return respond_json(_mail.as_dict(), request)
-        except Exception as error:
-            return respond_json({'message': self._format_exception(error)}, request, status_code=422)
+        d = self._soledad_executor.run(_send)
+        d.addCallback(lambda mail: respond_json(mail, request))
+        d.addErrback(lambda failure: respond_json({'message': self._format_exception(failure.value)}, request, status_code=422))
+        return d
 
     def mail_tags(self, request, mail_id):
         content_dict = json.loads(request.content.read())
         new_tags = map(lambda tag: tag.lower(), content_dict['newtags'])
-        try:
+
+        def _update_tags():
             self._mail_service.update_tags(mail_id, new_tags)
             mail = self._mail_service.mail(mail_id)
             self._search_engine.index_mail(mail)
-        except ValueError as ve:
-            return respond_json(ve.message, request, 403)
-        return respond_json(mail.as_dict(), request)
+            return mail.as_dict()
+
+        d = self._soledad_executor.run(_update_tags)
+        d.addCallback(lambda mail: respond_json(mail, request))
+        d.addErrback(self._forbidden, request)
+        return d
 
     def update_draft(self, request):
         content_dict = json.loads(request.content.read())
 
-        _mail = InputMail.from_dict(content_dict)
-        draft_id = content_dict.get('ident')
-        if draft_id:
-            ident = self._draft_service.update_draft(draft_id, _mail).ident
-            self._search_engine.remove_from_index(draft_id)
-        else:
-            ident = self._draft_service.create_draft(_mail).ident
+        def _save_draft():
+            _mail = InputMail.from_dict(content_dict)
+            draft_id = content_dict.get('ident')
+            if draft_id:
+                ident = self._draft_service.update_draft(draft_id, _mail).ident
+                self._search_engine.remove_from_index(draft_id)
+            else:
+                ident = self._draft_service.create_draft(_mail).ident
 
-        self._search_engine.index_mail(self._mail_service.mail(ident))
-        return respond_json({'ident': ident}, request)
+            self._search_engine.index_mail(self._mail_service.mail(ident))
+            return ident
+
+        d = self._soledad_executor.run(_save_draft)
+        d.addCallback(lambda ident: respond_json({'ident': ident}, request))
+        return d
 
     def reply_all_template(self, request, mail_id):
-        mail = self._mail_service.reply_all_template(mail_id)
-        return respond_json(mail, request)
+        d = self._soledad_executor.run(self._mail_service.reply_all_template, mail_id)
+        d.addCallback(lambda mail: respond_json(mail, request))
+        return d
+
+    def _forbidden(self, failure, request):
+        failure.trap(ValueError)
+        return respond_json(failure.value.message, request, 403)
+
+    def _bad_request(self, failure, request):
+        failure.trap(ValueError)
+        return respond_json(failure.value.message, request, 400)
 
     def _format_exception(self, exception):
         exception_info = map(str, list(exception.args))
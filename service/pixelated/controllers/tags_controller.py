@@ -15,19 +15,19 @@
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 
 from pixelated.controllers import respond_json_deferred
-from twisted.internet.threads import deferToThread
 
 
 class TagsController:
 
-    def __init__(self, search_engine):
+    def __init__(self, search_engine, search_executor):
         self._search_engine = search_engine
+        self._search_executor = search_executor
 
     def tags(self, request):
         query = request.args.get('q', [''])[0]
         skip_default_tags = request.args.get('skipDefaultTags', [False])[0]
 
-        d = deferToThread(lambda: self._search_engine.tags(query=query, skip_default_tags=skip_default_tags))
+        d = self._search_executor.run(lambda: self._search_engine.tags(query=query, skip_default_tags=skip_default_tags))
         d.addCallback(lambda tags: respond_json_deferred(tags, request))
 
         return d
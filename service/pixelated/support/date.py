@@ -14,17 +14,90 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 import datetime
+import re
 import dateutil.parser
 
-from dateutil.tz import tzlocal
+from dateutil.tz import tzlocal, tzoffset, tzutc
+from pixelated.support.lru_cache import LRUCache
+
+CACHE_SIZE = 20000
+
+MONTHS = {'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+          'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12}
+
+# 'Wed, 3 Sep 2014 12:36:17 -0300 (BRT)', as in Date and Received headers
+RFC2822_DATE = re.compile(r'\s*(?:[a-z]{3},?\s*)?(\d{1,2})\s+([a-z]{3})\s+(\d{4})\s+(\d{1,2}):(\d{2})(?::(\d{2}))?'
+                          r'\s*(?:([+-])(\d{2})(\d{2})(?:\s*\([^)]*\))?|(gmt|utc|z))?\s*$', re.IGNORECASE)
+
+# '2014-09-03T12:36:17.123-03:00', as stored in the index and sent by the client
+ISO_DATE = re.compile(r'\s*(\d{4})-(\d{2})-(\d{2})[t ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?'
+                      r'\s*(?:([+-])(\d{2}):?(\d{2})|(z))?\s*$', re.IGNORECASE)
+
+_parsed = LRUCache(CACHE_SIZE)
 
 
 def iso_now():
     return datetime.datetime.now(tzlocal()).isoformat()
 
 
+def parse(date):
+    """ Parses a date string, the common RFC 2822 and ISO 8601 forms without dateutil; results are cached per string """
+    parsed = _parsed.get(date)
+    if parsed is None:
+        parsed = _parse_rfc2822(date) or _parse_iso(date) or dateutil.parser.parse(date)
+        _parsed.put(date, parsed)
+    return parsed
+
+
+def cache_stats():
+    return _parsed.stats()
+
+
+def _parse_rfc2822(date):
+    match = RFC2822_DATE.match(date)
+    if not match:
+        return None
+    day, month, year, hour, minute, second, sign, offset_hours, offset_minutes, utc = match.groups()
+    return _datetime(int(year), MONTHS.get(month.lower()), int(day), int(hour), int(minute), int(second or 0), 0,
+                     _timezone(sign, offset_hours, offset_minutes, utc))
+
+
+def _parse_iso(date):
+    match = ISO_DATE.match(date)
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, sign, offset_hours, offset_minutes, utc = match.groups()
+    microsecond = int(fraction[:6].ljust(6, '0')) if fraction else 0
+    return _datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0), microsecond,
+                     _timezone(sign, offset_hours, offset_minutes, utc))
+
+
+def _datetime(year, month, day, hour, minute, second, microsecond, tz):
+    if month is None:
+        return None
+    try:
+        return datetime.datetime(year, month, day, hour, minute, second, microsecond, tz)
+    except ValueError:
+        # leave out of range values to dateutil
+        return None
+
+
+def _timezone(sign, offset_hours, offset_minutes, utc):
+    if utc:
+        return tzutc()
+    if not sign:
+        return None
+    offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+    if offset == 0:
+        return tzutc()
+    return tzoffset(None, -offset if sign == '-' else offset)
+
+
 def milliseconds(date):
-    date = dateutil.parser.parse(date)
+    return datetime_milliseconds(parse(date))
+
+
+def datetime_milliseconds(date):
     date = date.replace(tzinfo=None)
     epoch = datetime.datetime.utcfromtimestamp(0)
     delta = date - epoch
@@ -16,27 +16,60 @@
 
 import io
 import os
+import struct
 
 from whoosh.filedb.filestore import FileStorage
 
 from whoosh.filedb.structfile import StructFile, BufferFile
 from cryptography.fernet import Fernet
 from whoosh.util import random_name
+from pixelated.support.lru_cache import LRUCache
 
 
 class EncryptedFileStorage(FileStorage):
+    """ Whoosh storage keeping every file Fernet encrypted on disk.
+
+        Files are encrypted in fixed size chunks behind a small header, so a read only decrypts
+        the chunks it touches. Decrypted files are kept in memory keyed by name and modification
+        time and served as buffers; files too large for the cache are read chunk by chunk.
+    """
+
+    MAGIC = 'PXENC1'
+    HEADER = struct.Struct('!IQ')
+    TOKEN_LENGTH = struct.Struct('!I')
+    CHUNK_SIZE = 64 * 1024
+    CACHE_SIZE = 64 * 1024 * 1024
+    MAX_CACHED_FILE = 16 * 1024 * 1024
+
     def __init__(self, path, masterkey=None):
         self.masterkey = masterkey
         self.f = Fernet(masterkey)
         self._tmp_storage = self.temp_storage
         self.length_cache = {}
+        self.cache = LRUCache(self.CACHE_SIZE, sizeof=lambda (stamp, content): len(content))
         FileStorage.__init__(self, path, supports_mmap=False)
 
     def open_file(self, name, **kwargs):
-        return self._open_encrypted_file(name, onclose=self._encrypt_index_on_close(name))
+        path = self._fpath(name)
+        stamp = self._stamp(path)
+        cached = self.cache.get(name, is_valid=lambda (cached_stamp, content): cached_stamp == stamp)
+        if cached:
+            content = cached[1]
+        else:
+            encrypted = open(path, 'rb')
+            if self._is_chunked(encrypted) and stamp[1] > self.MAX_CACHED_FILE:
+                chunked = _ChunkedFile(encrypted, self.f)
+                self.length_cache[name] = chunked.length
+                return StructFile(chunked, name=name)
+            with encrypted:
+                content = self._decrypt(encrypted)
+            self.cache.put(name, (stamp, content))
+        self.length_cache[name] = len(content)
+        return BufferFile(buffer(content), name=name)
 
     def create_file(self, name, excl=False, mode="w+b", **kwargs):
-        f = StructFile(io.BytesIO(), name=name, onclose=self._encrypt_index_on_close(name))
+        # encrypt when the buffer itself closes: the writer's sorting pool closes raw_file() directly
+        f = StructFile(_ClosingBuffer(self._encrypt_index_on_close(name)), name=name)
         f.is_real = False
         return f
 
@@ -46,20 +79,140 @@ class EncryptedFileStorage(FileStorage):
         return EncryptedFileStorage(path, self.masterkey).create()
 
     def file_length(self, name):
+        if name not in self.length_cache:
+            with open(self._fpath(name), 'rb') as encrypted:
+                self.length_cache[name] = self._plain_length(encrypted)
         return self.length_cache[name]
 
+    def delete_file(self, name):
+        FileStorage.delete_file(self, name)
+        self._forget(name)
+
+    def rename_file(self, oldname, newname, safe=False):
+        FileStorage.rename_file(self, oldname, newname, safe)
+        self._forget(oldname)
+        self._forget(newname)
+
+    def _forget(self, name):
+        self.cache.remove(name)
+        self.length_cache.pop(name, None)
+
+    def _stamp(self, path):
+        stat = os.stat(path)
+        return stat.st_mtime, stat.st_size
+
     def _encrypt_index_on_close(self, name):
-        def wrapper(struct_file):
-            struct_file.seek(0)
-            content = struct_file.file.read()
+        def wrapper(content):
             self.length_cache[name] = len(content)
-            encrypted_content = self.f.encrypt(content)
-            with open(self._fpath(name), 'w+b') as f:
-                f.write(encrypted_content)
+            path = self._fpath(name)
+            with open(path, 'w+b') as f:
+                self._encrypt(content, f)
+            if len(content) <= self.MAX_CACHED_FILE:
+                self.cache.put(name, (self._stamp(path), content))
         return wrapper
 
-    def _open_encrypted_file(self, name, onclose=lambda x: None):
-        file_content = open(self._fpath(name), "rb").read()
-        decrypted = self.f.decrypt(file_content)
-        self.length_cache[name] = len(decrypted)
-        return BufferFile(buffer(decrypted), name=name, onclose=onclose)
+    def _encrypt(self, content, out):
+        out.write(self.MAGIC + self.HEADER.pack(self.CHUNK_SIZE, len(content)))
+        for position in xrange(0, len(content), self.CHUNK_SIZE):
+            token = self.f.encrypt(content[position:position + self.CHUNK_SIZE])
+            out.write(self.TOKEN_LENGTH.pack(len(token)) + token)
+
+    def _is_chunked(self, encrypted):
+        encrypted.seek(0)
+        chunked = encrypted.read(len(self.MAGIC)) == self.MAGIC
+        encrypted.seek(0)
+        return chunked
+
+    def _decrypt(self, encrypted):
+        if not self._is_chunked(encrypted):
+            return self.f.decrypt(encrypted.read())
+        encrypted.seek(len(self.MAGIC) + self.HEADER.size)
+        chunks = []
+        while True:
+            token_length = encrypted.read(self.TOKEN_LENGTH.size)
+            if not token_length:
+                return ''.join(chunks)
+            chunks.append(self.f.decrypt(encrypted.read(self.TOKEN_LENGTH.unpack(token_length)[0])))
+
+    def _plain_length(self, encrypted):
+        if not self._is_chunked(encrypted):
+            return len(self._decrypt(encrypted))
+        encrypted.seek(len(self.MAGIC))
+        return self.HEADER.unpack(encrypted.read(self.HEADER.size))[1]
+
+
+class _ClosingBuffer(io.BytesIO):
+    """ In memory file handing its content to onclose when closed """
+
+    def __init__(self, onclose):
+        io.BytesIO.__init__(self)
+        self._onclose = onclose
+
+    def close(self):
+        if not self.closed:
+            self._onclose(self.getvalue())
+        io.BytesIO.close(self)
+
+
+class _ChunkedFile(object):
+    """ Read only file object decrypting the chunks of an EncryptedFileStorage file as they are read """
+
+    def __init__(self, encrypted, fernet):
+        self._encrypted = encrypted
+        self._fernet = fernet
+        self._data_start = len(EncryptedFileStorage.MAGIC) + EncryptedFileStorage.HEADER.size
+        encrypted.seek(len(EncryptedFileStorage.MAGIC))
+        self._chunk_size, self.length = EncryptedFileStorage.HEADER.unpack(
+            encrypted.read(EncryptedFileStorage.HEADER.size))
+        token_length = encrypted.read(EncryptedFileStorage.TOKEN_LENGTH.size)
+        self._chunk_span = EncryptedFileStorage.TOKEN_LENGTH.size + EncryptedFileStorage.TOKEN_LENGTH.unpack(token_length)[0]
+        self._position = 0
+        self._chunk_index = None
+        self._chunk = ''
+
+    def _load_chunk(self, index):
+        if index != self._chunk_index:
+            self._encrypted.seek(self._data_start + index * self._chunk_span)
+            token_length = EncryptedFileStorage.TOKEN_LENGTH.unpack(
+                self._encrypted.read(EncryptedFileStorage.TOKEN_LENGTH.size))[0]
+            self._chunk = self._fernet.decrypt(self._encrypted.read(token_length))
+            self._chunk_index = index
+        return self._chunk
+
+    def read(self, size=-1):
+        end = self.length if size is None or size < 0 else min(self._position + size, self.length)
+        parts = []
+        while self._position < end:
+            index, offset = divmod(self._position, self._chunk_size)
+            part = self._load_chunk(index)[offset:offset + end - self._position]
+            parts.append(part)
+            self._position += len(part)
+        return ''.join(parts)
+
+    def readline(self, size=-1):
+        # pickle.load, used on the writer's sort runs, reads through readline
+        end = self.length if size is None or size < 0 else min(self._position + size, self.length)
+        parts = []
+        while self._position < end:
+            index, offset = divmod(self._position, self._chunk_size)
+            chunk = self._load_chunk(index)
+            stop = chunk.find('\n', offset, offset + end - self._position) + 1 or offset + end - self._position
+            part = chunk[offset:stop]
+            parts.append(part)
+            self._position += len(part)
+            if part.endswith('\n'):
+                break
+        return ''.join(parts)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.length
+        self._position = offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._encrypted.close()
@@ -0,0 +1,52 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from threading import Lock
+
+from twisted.internet import reactor as default_reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+
+class Executor(object):
+    """ Runs blocking calls on a bounded, named thread pool and hands back deferreds on the reactor """
+
+    def __init__(self, name, max_threads, reactor=default_reactor):
+        self.name = name
+        self._reactor = reactor
+        self._pool = ThreadPool(minthreads=0, maxthreads=max_threads, name=name)
+        self._lock = Lock()
+        self._submitted = 0
+        self._max_queued = 0
+        self._pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+    def run(self, f, *args, **kwargs):
+        with self._lock:
+            self._submitted += 1
+            self._max_queued = max(self._max_queued, self._pool.q.qsize() + 1)
+        return deferToThreadPool(self._reactor, self._pool, f, *args, **kwargs)
+
+    def stop(self):
+        if self._pool.started:
+            self._pool.stop()
+
+    def stats(self):
+        return {'queued': self._pool.q.qsize(),
+                'max_queued': self._max_queued,
+                'working': len(self._pool.working),
+                'threads': len(self._pool.threads),
+                'max_threads': self._pool.max,
+                'submitted': self._submitted}
@@ -0,0 +1,78 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """ Bounded least recently used cache, sized by a caller supplied measure of each value """
+
+    def __init__(self, max_size, sizeof=lambda value: 1):
+        self.max_size = max_size
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, is_valid=lambda value: True):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            value, size = self._entries.pop(key)
+            if not is_valid(value):
+                self.size -= size
+                self.misses += 1
+                return None
+
+            self._entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._discard(key)
+            size = self._sizeof(value)
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def remove(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        if key in self._entries:
+            _, size = self._entries.pop(key)
+            self.size -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'size': self.size,
+                'max_size': self.max_size}
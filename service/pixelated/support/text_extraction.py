@@ -0,0 +1,119 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import re
+from HTMLParser import HTMLParser, HTMLParseError
+from htmlentitydefs import name2codepoint
+
+from pixelated.support.transfer_decoding import DecodedContent
+
+
+CHARSET = re.compile(r'charset="?([\w.:-]+)"?', re.IGNORECASE)
+
+
+def readable_text(parts):
+    """ Normalized text of (content, content_type, encoding) body parts, preferring plain text over html """
+    plain = [part for part in parts if _is_plain(part[1])]
+    html = [part for part in parts if _is_html(part[1])]
+    return normalize(u' '.join(part_text(*part) for part in plain or html))
+
+
+def part_text(content, content_type=None, encoding=None):
+    charset = _charset(content_type)
+    if isinstance(content, unicode) and not _is_transfer_encoded(encoding):
+        text = content
+    else:
+        text = _to_unicode(DecodedContent(content or '', encoding, charset=charset).read(), charset)
+    return html_to_text(text) if _is_html(content_type) else text
+
+
+def html_to_text(html):
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except HTMLParseError:
+        pass
+    return extractor.text()
+
+
+def normalize(text):
+    return u' '.join(text.split())
+
+
+def _is_plain(content_type):
+    # parts without a content type are plain text by default (RFC 2045)
+    return not content_type or 'text/plain' in content_type.lower()
+
+
+def _is_html(content_type):
+    return 'text/html' in (content_type or '').lower()
+
+
+def _is_transfer_encoded(encoding):
+    return (encoding or '').lower() in ('base64', 'quoted-printable')
+
+
+def _charset(content_type):
+    match = CHARSET.search(content_type or '')
+    return match.group(1) if match else 'utf-8'
+
+
+def _to_unicode(content, charset):
+    if isinstance(content, unicode):
+        return content
+    try:
+        return content.decode(charset, 'replace')
+    except LookupError:
+        return content.decode('utf-8', 'replace')
+
+
+class _TextExtractor(HTMLParser):
+    SKIPPED = ('script', 'style', 'head', 'title')
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self._pieces = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self._skipping += 1
+        else:
+            self._pieces.append(u' ')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED:
+            self._skipping = max(self._skipping - 1, 0)
+        else:
+            self._pieces.append(u' ')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._pieces.append(data)
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+
+    def handle_charref(self, name):
+        try:
+            codepoint = int(name[1:], 16) if name.lower().startswith('x') else int(name)
+            self.handle_data(unichr(codepoint))
+        except ValueError:
+            pass
+
+    def text(self):
+        return u''.join(self._pieces)
@@ -0,0 +1,169 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import binascii
+import codecs
+import re
+
+from twisted.internet.defer import Deferred
+from twisted.internet.interfaces import IPullProducer
+from zope.interface import implements
+
+
+class DecodedContent(object):
+    """ Content transfer decoding of a MIME part, done chunk by chunk instead of in one copy """
+
+    CHUNK_SIZE = 64 * 1024
+    # a2b_base64 skips anything outside the alphabet, so chunks are aligned on alphabet characters only
+    NOT_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
+
+    def __init__(self, raw, encoding=None, chunk_size=CHUNK_SIZE, charset='utf-8'):
+        self._raw = raw
+        self._encoding = (encoding or '').lower()
+        self._chunk_size = chunk_size
+        self._charset = self._known_charset(charset)
+        self._length = None
+
+    @staticmethod
+    def _known_charset(charset):
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            return 'utf-8'
+
+    def __len__(self):
+        if self._length is None:
+            if self._encoding == 'base64':
+                self._length = self._base64_length()
+            else:
+                self._length = sum(len(chunk) for chunk in self.chunks())
+        return self._length
+
+    def read(self):
+        return ''.join(self.chunks())
+
+    def chunks(self, start=0, end=None):
+        """ Decoded chunks covering the byte range start..end, both inclusive """
+        offset = 0
+        for chunk in self._decoded_chunks():
+            chunk_end = offset + len(chunk)
+            if chunk_end > start:
+                yield chunk[max(start - offset, 0):None if end is None else end + 1 - offset]
+            if end is not None and chunk_end > end:
+                return
+            offset = chunk_end
+
+    def _decoded_chunks(self):
+        if self._encoding == 'base64':
+            return self._base64_chunks()
+        if self._encoding == 'quoted-printable':
+            return self._quoted_printable_chunks()
+        return self._raw_pieces()
+
+    def _raw_pieces(self):
+        # soledad hands out unicode, which is encoded back to the bytes of the part's charset
+        for position in xrange(0, len(self._raw), self._chunk_size):
+            piece = self._raw[position:position + self._chunk_size]
+            yield piece.encode(self._charset, 'replace') if isinstance(piece, unicode) else piece
+
+    def _base64_chunks(self):
+        pending = ''
+        for piece in self._raw_pieces():
+            pending += self.NOT_BASE64.sub('', piece)
+            aligned = len(pending) - len(pending) % 4
+            if aligned:
+                yield binascii.a2b_base64(pending[:aligned])
+            pending = pending[aligned:]
+        if pending:
+            yield binascii.a2b_base64(pending)
+
+    def _quoted_printable_chunks(self):
+        pending = ''
+        for piece in self._raw_pieces():
+            pending += piece
+            complete = pending.rfind('\n') + 1
+            if complete:
+                yield binascii.a2b_qp(pending[:complete])
+            pending = pending[complete:]
+        if pending:
+            yield binascii.a2b_qp(pending)
+
+    def _base64_length(self):
+        """ Computed from the encoded size when the content is well formed, by decoding it otherwise """
+        encoded = equals = 0
+        for piece in self._raw_pieces():
+            piece = ''.join(piece.split())
+            if self.NOT_BASE64.search(piece):
+                return self._decoded_length()
+            encoded += len(piece)
+            equals += piece.count('=')
+        padding = 0
+        position = len(self._raw) - 1
+        while position >= 0 and padding < 2:
+            char = self._raw[position]
+            position -= 1
+            if char.isspace():
+                continue
+            if char != '=':
+                break
+            padding += 1
+        if encoded % 4 or equals != padding:
+            return self._decoded_length()
+        return encoded / 4 * 3 - padding
+
+    def _decoded_length(self):
+        return sum(len(chunk) for chunk in self._base64_chunks())
+
+
+class ChunkProducer(object):
+    """ Pull producer writing an iterable of chunks to a consumer, one chunk per resumeProducing """
+
+    implements(IPullProducer)
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._consumer = None
+        self._deferred = None
+
+    def beginProducing(self, consumer):
+        self._consumer = consumer
+        deferred = self._deferred = Deferred()
+        consumer.registerProducer(self, False)
+        return deferred
+
+    def resumeProducing(self):
+        if not self._consumer:
+            return
+        try:
+            chunk = next(self._chunks, None)
+            while chunk == '':
+                chunk = next(self._chunks, None)
+        except Exception as error:
+            self._stop().errback(error)
+            return
+        if chunk is None:
+            self._stop().callback(None)
+        else:
+            self._consumer.write(chunk)
+
+    def stopProducing(self):
+        if self._consumer:
+            self._stop().errback(Exception('Consumer asked us to stop producing'))
+
+    def _stop(self):
+        self._consumer.unregisterProducer()
+        self._consumer = None
+        deferred, self._deferred = self._deferred, None
+        return deferred
@@ -31,10 +31,11 @@ from pixelated.adapter.soledad_querier import SoledadQuerier
 from pixelated.adapter.tag_service import TagService
 from pixelated.config import app_factory
 from pixelated.controllers import FeaturesController, HomeController, MailsController, TagsController, \
-    SyncInfoController, AttachmentsController, ContactsController
+    SyncInfoController, AttachmentsController, ContactsController, StatsController
 import pixelated.runserver
 from pixelated.adapter.mail import PixelatedMail
 from pixelated.adapter.search import SearchEngine
+from pixelated.support.executor import Executor
 from test.support.integration.model import MailBuilder
 
 
@@ -59,24 +60,37 @@ class AppTestClient:
         self.mail_sender = Mock()
         self.tag_service = TagService()
         self.draft_service = DraftService(self.mailboxes)
-        self.mail_service = MailService(self.mailboxes, self.mail_sender, self.tag_service,
-                                        self.soledad_querier)
         self.search_engine = SearchEngine(self.soledad_querier)
+        self.mail_service = MailService(self.mailboxes, self.mail_sender, self.tag_service,
+                                        self.soledad_querier, self.search_engine)
         self.search_engine.index_mails(self.mail_service.all_mails())
 
+        self.soledad_executor = Executor('soledad', max_threads=app_factory.SOLEDAD_THREADS)
+        self.search_executor = Executor('search', max_threads=app_factory.SEARCH_THREADS)
+
         features_controller = FeaturesController()
         features_controller.DISABLED_FEATURES.append('autoReload')
         home_controller = HomeController()
         mails_controller = MailsController(mail_service=self.mail_service,
                                            draft_service=self.draft_service,
-                                           search_engine=self.search_engine)
-        tags_controller = TagsController(search_engine=self.search_engine)
-        contacts_controller = ContactsController(search_engine=self.search_engine)
+                                           search_engine=self.search_engine,
+                                           soledad_executor=self.soledad_executor,
+                                           search_executor=self.search_executor)
+        tags_controller = TagsController(search_engine=self.search_engine, search_executor=self.search_executor)
+        contacts_controller = ContactsController(search_engine=self.search_engine,
+                                                 search_executor=self.search_executor)
         sync_info_controller = SyncInfoController()
         attachments_controller = AttachmentsController(self.soledad_querier)
+        stats_controller = StatsController(mail_cache=self.soledad_querier.mail_cache.stats,
+                                           index_writer=self.search_engine.index_writer.stats,
+                                           searchers=self.search_engine.searchers.stats,
+                                           query_cache=self.search_engine.results.stats,
+                                           soledad_pool=self.soledad_executor.stats,
+                                           search_pool=self.search_executor.stats)
 
         setup_routes(self.app, home_controller, mails_controller, tags_controller,
-                     features_controller, sync_info_controller, attachments_controller, contacts_controller)
+                     features_controller, sync_info_controller, attachments_controller, contacts_controller,
+                     stats_controller)
 
     def _render(self, request, as_json=True):
         def get_request_written_data(_=None):
@@ -15,6 +15,9 @@
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 import unittest
 
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import blockingCallFromThread
 from pixelated.controllers import *
 from test.support.integration.app_test_client import AppTestClient
 from test.support.integration.model import ResponseMail
@@ -34,8 +37,16 @@ class SoledadTestBase(unittest.TestCase):
     def setUp(self):
         self.client = AppTestClient()
 
+    def _wait(self, call, *args, **kwargs):
+        """ Renders the request on the reactor and blocks until its response is written, for tests not run as @deferred """
+        def _render():
+            res, req = call(*args, **kwargs)
+            d = res if isinstance(res, Deferred) else succeed(res)
+            return d.addCallback(lambda result: (result, req))
+        return blockingCallFromThread(reactor, _render)
+
     def get_mails_by_tag(self, tag, page=1, window=100):
-        res, req = self.client.get("/mails", {
+        res, req = self._wait(self.client.get, "/mails", {
             'q': ['tag:%s' % tag],
             'w': [str(window)],
             'p': [str(page)]
@@ -43,43 +54,44 @@ class SoledadTestBase(unittest.TestCase):
         return [ResponseMail(m) for m in res['mails']]
 
     def post_mail(self, data):
-        res, req = self.client.post('/mails', data)
+        res, req = self._wait(self.client.post, '/mails', data)
         return ResponseMail(res)
 
     def get_attachment(self, ident, encoding):
-        res, req = self.client.get("/attachment/%s" % ident, {'encoding': [encoding]}, as_json=False)
+        res, req = self._wait(self.client.get, "/attachment/%s" % ident, {'encoding': [encoding]}, as_json=False)
         return res
 
     def put_mail(self, data):
-        res, req = self.client.put('/mails', data)
+        res, req = self._wait(self.client.put, '/mails', data)
         return res['ident']
 
     def post_tags(self, mail_ident, tags_json):
-        res, req = self.client.post("/mail/%s/tags" % mail_ident, tags_json)
+        res, req = self._wait(self.client.post, "/mail/%s/tags" % mail_ident, tags_json)
         return res
 
+    # get_tags and get_contacts hand back the response deferred to @deferred tests, which run on the reactor
     def get_tags(self, **kwargs):
         res, req = self.client.get('/tags', kwargs)
         return res
 
     def delete_mail(self, mail_ident):
-        res, req = self.client.delete("/mail/%s" % mail_ident)
+        res, req = self._wait(self.client.delete, "/mail/%s" % mail_ident)
         return req
 
     def mark_as_read(self, mail_ident):
-        res, req = self.client.post("/mail/%s/read" % mail_ident)
+        res, req = self._wait(self.client.post, "/mail/%s/read" % mail_ident)
         return req
 
     def mark_as_unread(self, mail_ident):
-        res, req = self.client.post("/mail/%s/unread" % mail_ident)
+        res, req = self._wait(self.client.post, "/mail/%s/unread" % mail_ident)
         return req
 
     def mark_many_as_unread(self, idents):
-        res, req = self.client.post('/mails/unread', json.dumps({'idents': idents}))
+        res, req = self._wait(self.client.post, '/mails/unread', json.dumps({'idents': idents}))
         return req
 
     def mark_many_as_read(self, idents):
-        res, req = self.client.post('/mails/read', json.dumps({'idents': idents}))
+        res, req = self._wait(self.client.post, '/mails/read', json.dumps({'idents': idents}))
         return req
 
     def get_contacts(self, query):
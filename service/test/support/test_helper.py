@@ -15,6 +15,8 @@
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 from datetime import datetime
 
+from twisted.internet import defer
+
 from pixelated.adapter.mail import InputMail
 
 
@@ -76,3 +78,15 @@ class TestRequest:
 
     def __init__(self, json):
         self.json = json
+
+
+class SynchronousExecutor:
+
+    def run(self, f, *args, **kwargs):
+        return defer.maybeDeferred(f, *args, **kwargs)
+
+
+def deferred_result(d):
+    result = []
+    d.addBoth(result.append)
+    return result[0]
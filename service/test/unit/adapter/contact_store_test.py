@@ -0,0 +1,62 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.adapter.contact_store import ContactStore
+
+DAY = 24 * 3600 * 1000
+
+
+class ContactStoreTest(unittest.TestCase):
+
+    def _fields(self, sender, to='', cc='', bcc='', date=0):
+        return {'sender': sender, 'to': to, 'cc': cc, 'bcc': bcc, 'date': date}
+
+    def _contact_store(self, all_fields):
+        contact_store = ContactStore()
+        for fields in all_fields:
+            contact_store.add(fields)
+        return contact_store
+
+    def test_finds_senders_and_recipients_by_prefix_and_substring(self):
+        store = self._contact_store([self._fields(u'Alice <alice@pixelated.org>', to=u'bob@example.org',
+                                                  cc=u'carol@example.org', bcc=u'dave@example.org')])
+
+        self.assertEquals([u'Alice <alice@pixelated.org>'], store.search(u'ali'))
+        self.assertEquals([u'bob@example.org'], store.search(u'B'))
+        self.assertEquals([u'carol@example.org'], store.search(u'rol@exam'))
+        self.assertEquals([u'dave@example.org'], store.search(u'DAVE@'))
+        self.assertEquals([], store.search(u'nobody'))
+        self.assertEquals([], store.search(u'  '))
+
+    def test_ranks_by_frequency_and_recency(self):
+        now = 100 * DAY
+        store = self._contact_store([self._fields(u'me@pixelated.org', to=u'old@pixelated.org', date=now - 90 * DAY),
+                                     self._fields(u'me@pixelated.org', to=u'old@pixelated.org', date=now - 90 * DAY),
+                                     self._fields(u'me@pixelated.org', to=u'recent@pixelated.org', date=now)])
+
+        self.assertEquals([u'me@pixelated.org', u'recent@pixelated.org', u'old@pixelated.org'],
+                          store.search(u'pixelated'))
+        self.assertEquals([u'me@pixelated.org'], store.search(u'pixelated', limit=1))
+
+    def test_removed_mails_forget_their_addresses(self):
+        fields = self._fields(u'alice@pixelated.org', to=u'bob@pixelated.org')
+        store = self._contact_store([fields, self._fields(u'alice@pixelated.org')])
+
+        store.replace(fields, None)
+
+        self.assertEquals([u'alice@pixelated.org'], store.search(u'pixelated'))
+        self.assertEquals(1, len(store))
@@ -0,0 +1,219 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import time
+import unittest
+
+from mockito import *
+from pixelated.adapter.incremental_indexer import IncrementalIndexer
+
+
+class IncrementalIndexerTest(unittest.TestCase):
+    def setUp(self):
+        self.querier = mock()
+        self.search_engine = mock()
+        when(self.search_engine).load_metadata('watermark', any()).thenReturn({'generation': 10, 'pending': []})
+        when(self.search_engine).load_metadata('tags_migrated', any()).thenReturn(True)
+
+    def _mail(self, ident):
+        mail = mock()
+        mail.ident = ident
+        return mail
+
+    def test_indexes_only_mails_changed_since_last_generation(self):
+        changed_mail = self._mail('changed')
+        when(self.querier).changes_since(10).thenReturn((12, {'changed'}, False))
+        when(self.querier).mails_with_bodies({'changed'}).thenReturn([changed_mail])
+
+        indexer = IncrementalIndexer(self.querier, self.search_engine)
+        indexed = indexer.index_changes()
+
+        self.assertEquals(1, indexed)
+        self.assertEquals(12, indexer.generation)
+        verify(self.search_engine).index_mails([changed_mail])
+        verify(self.search_engine).store_metadata('watermark', {'generation': 12, 'pending': []})
+
+    def test_index_changes_migrates_the_legacy_tags_of_newly_synced_mails(self):
+        synced_mail = self._mail('synced')
+        when(self.querier).changes_since(10).thenReturn((12, {'synced'}, False))
+        when(self.querier).mails_with_bodies({'synced'}).thenReturn([synced_mail])
+
+        IncrementalIndexer(self.querier, self.search_engine).index_changes()
+
+        verify(self.querier).migrate_mail_tags([synced_mail])
+
+    def test_keeps_incomplete_mails_pending_for_the_next_run(self):
+        when(self.querier).changes_since(10).thenReturn((12, {'incomplete'}, False))
+        when(self.querier).mails_with_bodies({'incomplete'}).thenReturn([])
+
+        indexer = IncrementalIndexer(self.querier, self.search_engine)
+        indexer.index_changes()
+
+        self.assertEquals({'incomplete'}, indexer.pending)
+
+        complete_mail = self._mail('incomplete')
+        when(self.querier).changes_since(12).thenReturn((13, set(), False))
+        when(self.querier).mails_with_bodies({'incomplete'}).thenReturn([complete_mail])
+
+        self.assertEquals(1, indexer.index_changes())
+        self.assertEquals(set(), indexer.pending)
+
+    def test_removes_deleted_mails_from_index(self):
+        when(self.querier).changes_since(10).thenReturn((11, set(), True))
+        when(self.querier).idents().thenReturn({'kept'})
+        when(self.search_engine).all_idents().thenReturn({'kept', 'deleted'})
+
+        indexer = IncrementalIndexer(self.querier, self.search_engine)
+        indexed = indexer.index_changes()
+
+        self.assertEquals(1, indexed)
+        verify(self.search_engine).remove_many_from_index({'deleted'})
+
+    def test_index_all_moves_watermark_to_current_generation(self):
+        when(self.querier).generation().thenReturn(42)
+        when(self.querier).iter_mails(IncrementalIndexer.REINDEX_BATCH).thenReturn(iter([]))
+        when(self.querier).idents().thenReturn(set())
+        when(self.search_engine).all_idents().thenReturn(set())
+
+        indexer = IncrementalIndexer(self.querier, self.search_engine)
+        indexer.index_all()
+
+        self.assertEquals(42, indexer.generation)
+        verify(self.search_engine).store_metadata('watermark', {'generation': 42, 'pending': []})
+
+    def test_index_all_keeps_mails_it_could_not_load_pending(self):
+        when(self.querier).generation().thenReturn(42)
+        when(self.querier).iter_mails(IncrementalIndexer.REINDEX_BATCH).thenReturn(iter([]))
+        when(self.querier).idents().thenReturn({'indexed', 'without_body'})
+        when(self.search_engine).all_idents().thenReturn({'indexed'})
+
+        indexer = IncrementalIndexer(self.querier, self.search_engine)
+        indexer.index_all()
+
+        self.assertEquals({'without_body'}, indexer.pending)
+
+        complete_mail = self._mail('without_body')
+        when(self.querier).changes_since(42).thenReturn((43, set(), False))
+        when(self.querier).mails_with_bodies({'without_body'}).thenReturn([complete_mail])
+
+        self.assertEquals(1, indexer.index_changes())
+        self.assertEquals(set(), indexer.pending)
+
+    def test_resume_catches_up_a_reopened_index_without_rebuilding(self):
+        when(self.querier).generation().thenReturn(12)
+        when(self.querier).changes_since(10).thenReturn((12, set(), False))
+        when(self.querier).mail_count().thenReturn(3)
+        when(self.search_engine).doc_count().thenReturn(3)
+
+        indexer = IncrementalIndexer(self.querier, self.search_engine)
+        rebuilt = indexer.resume()
+
+        self.assertFalse(rebuilt)
+        self.assertIsNotNone(indexer.time_to_usable_inbox)
+        verify(self.querier, never).iter_mails(any())
+
+    def test_resume_rebuilds_when_index_and_soledad_counts_differ(self):
+        when(self.querier).generation().thenReturn(12)
+        when(self.querier).changes_since(10).thenReturn((12, set(), False))
+        when(self.querier).mail_count().thenReturn(4)
+        when(self.search_engine).doc_count().thenReturn(3)
+        when(self.querier).iter_mails(IncrementalIndexer.REINDEX_BATCH).thenReturn(iter([]))
+        when(self.querier).idents().thenReturn(set())
+        when(self.search_engine).all_idents().thenReturn(set())
+
+        rebuilt = IncrementalIndexer(self.querier, self.search_engine).resume()
+
+        self.assertTrue(rebuilt)
+        verify(self.querier).iter_mails(IncrementalIndexer.REINDEX_BATCH)
+
+    def test_resume_rebuilds_a_freshly_created_index(self):
+        when(self.search_engine).load_metadata('watermark', any()).thenReturn({'generation': 0, 'pending': []})
+        when(self.querier).generation().thenReturn(12)
+        when(self.querier).iter_mails(IncrementalIndexer.REINDEX_BATCH).thenReturn(iter([]))
+        when(self.querier).idents().thenReturn(set())
+        when(self.search_engine).all_idents().thenReturn(set())
+
+        rebuilt = IncrementalIndexer(self.querier, self.search_engine).resume()
+
+        self.assertTrue(rebuilt)
+        verify(self.querier, never).changes_since(any())
+
+    def test_resume_rebuilds_when_the_watermark_is_ahead_of_soledad(self):
+        when(self.querier).generation().thenReturn(5)
+        when(self.querier).iter_mails(IncrementalIndexer.REINDEX_BATCH).thenReturn(iter([]))
+        when(self.querier).idents().thenReturn(set())
+        when(self.search_engine).all_idents().thenReturn(set())
+
+        rebuilt = IncrementalIndexer(self.querier, self.search_engine).resume()
+
+        self.assertTrue(rebuilt)
+        verify(self.querier, never).changes_since(any())
+
+    def test_time_to_usable_inbox_is_measured_from_the_given_start(self):
+        indexer = IncrementalIndexer(self.querier, self.search_engine, started_at=time.time() - 30)
+
+        self.assertTrue(indexer.time_to_usable_inbox >= 30)
+
+    def test_resume_migrates_every_mail_once_per_index(self):
+        when(self.search_engine).load_metadata('tags_migrated', any()).thenReturn(False)
+        when(self.querier).migrate_tags().thenReturn(2)
+        when(self.querier).generation().thenReturn(10)
+        when(self.querier).changes_since(10).thenReturn((10, set(), False))
+        when(self.querier).mail_count().thenReturn(0)
+        when(self.search_engine).doc_count().thenReturn(0)
+
+        IncrementalIndexer(self.querier, self.search_engine).resume()
+
+        verify(self.querier).migrate_tags()
+        verify(self.search_engine).store_metadata('tags_migrated', True)
+
+    def test_resume_skips_the_full_migration_once_done(self):
+        when(self.querier).generation().thenReturn(10)
+        when(self.querier).changes_since(10).thenReturn((10, set(), False))
+        when(self.querier).mail_count().thenReturn(0)
+        when(self.search_engine).doc_count().thenReturn(0)
+
+        IncrementalIndexer(self.querier, self.search_engine).resume()
+
+        verify(self.querier, never).migrate_tags()
+        self.assertTrue(self.querier.tags_migrated)
+
+    def test_index_changes_loads_and_commits_mails_in_batches(self):
+        first, second, third = self._mail('a'), self._mail('b'), self._mail('c')
+        when(self.querier).changes_since(10).thenReturn((12, {'a', 'b', 'c'}, False))
+        when(self.querier).mails_with_bodies({'a', 'b'}).thenReturn([first, second])
+        when(self.querier).mails_with_bodies({'c'}).thenReturn([third])
+
+        indexed = IncrementalIndexer(self.querier, self.search_engine, reindex_batch=2).index_changes()
+
+        self.assertEquals(3, indexed)
+        verify(self.search_engine).index_mails([first, second])
+        verify(self.search_engine).index_mails([third])
+        verify(self.search_engine).store_metadata('watermark', {'generation': 12, 'pending': ['c']})
+        verify(self.search_engine).store_metadata('watermark', {'generation': 12, 'pending': []})
+
+    def test_index_changes_without_a_watermark_streams_a_full_index(self):
+        when(self.search_engine).load_metadata('watermark', any()).thenReturn({'generation': 0, 'pending': []})
+        when(self.querier).generation().thenReturn(12)
+        when(self.querier).iter_mails(IncrementalIndexer.REINDEX_BATCH).thenReturn(iter([]))
+        when(self.querier).idents().thenReturn(set())
+        when(self.search_engine).all_idents().thenReturn(set())
+        when(self.search_engine).doc_count().thenReturn(0)
+
+        IncrementalIndexer(self.querier, self.search_engine).index_changes()
+
+        verify(self.querier).iter_mails(IncrementalIndexer.REINDEX_BATCH)
+        verify(self.querier, never).changes_since(any())
+        verify(self.querier, never).mails_with_bodies(any())
@@ -0,0 +1,103 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from mockito import mock, when, verify
+from pixelated.adapter.index_writer_queue import IndexWriterQueue, IndexWriteError
+
+
+class IndexWriterQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.index = mock()
+        self.writer = mock()
+        when(self.index).writer().thenReturn(self.writer)
+        self.batches = []
+
+    def tearDown(self):
+        self.queue.close()
+
+    def _apply_batch(self, writer, operations):
+        self.batches.append(operations)
+
+    def test_repeated_updates_of_the_same_mail_are_coalesced(self):
+        self.queue = IndexWriterQueue(self.index, self._apply_batch, max_delay=60)
+        self.queue.update('ident1', {'flags': u''})
+        self.queue.update('ident2', {'flags': u''})
+        self.queue.update('ident1', {'flags': u'\\Seen'})
+
+        self.queue.flush()
+
+        self.assertEquals([[('ident2', ('update', {'flags': u''})),
+                            ('ident1', ('update', {'flags': u'\\Seen'}))]], self.batches)
+        self.assertEquals(1, self.queue.stats()['coalesced'])
+        verify(self.writer, times=1).commit()
+
+    def test_deletion_replaces_pending_update(self):
+        self.queue = IndexWriterQueue(self.index, self._apply_batch, max_delay=60)
+        self.queue.update('ident1', {'flags': u''})
+        self.queue.delete('ident1')
+
+        self.queue.flush()
+
+        self.assertEquals([[('ident1', ('delete', None))]], self.batches)
+
+    def test_commits_in_groups_of_max_batch(self):
+        self.queue = IndexWriterQueue(self.index, self._apply_batch, max_batch=2, max_delay=60)
+        for ident in ['ident1', 'ident2', 'ident3']:
+            self.queue.update(ident, {})
+
+        self.queue.flush()
+
+        self.assertEquals([2, 1], [len(batch) for batch in self.batches])
+
+    def test_failed_commit_is_cancelled_and_raised_to_the_flush_waiting_on_it(self):
+        def failing_apply(writer, operations):
+            raise Exception('broken index')
+
+        self.queue = IndexWriterQueue(self.index, failing_apply, max_delay=60)
+        self.queue.update('ident1', {})
+
+        self.assertRaises(IndexWriteError, self.queue.flush)
+
+        verify(self.writer).cancel()
+        self.assertEquals(1, self.queue.stats()['failed'])
+        self.queue.flush()
+
+    def test_writer_is_cancelled_when_the_commit_itself_fails(self):
+        when(self.writer).commit().thenRaise(IOError('disk full'))
+        self.queue = IndexWriterQueue(self.index, self._apply_batch, max_delay=60)
+        self.queue.update('ident1', {})
+
+        self.assertRaises(IndexWriteError, self.queue.flush)
+
+        verify(self.writer).cancel()
+
+    def test_flush_waits_for_a_coalesced_update_moved_behind_a_batch(self):
+        self.queue = IndexWriterQueue(self.index, self._apply_batch, max_batch=2, max_delay=60)
+        with self.queue._condition:
+            # holding the lock keeps the writer thread from taking a batch in between
+            self.queue.update('ident1', {})
+            self.queue.update('ident2', {'flags': u''})
+            self.queue.update('ident3', {})
+            self.queue.update('ident2', {'flags': u'\\Seen'})
+
+            # the first writer of ident2 is not done until its coalesced update is committed
+            self.assertEquals(0, self.queue._committed())
+
+        self.queue.flush()
+
+        self.assertEquals([['ident1', 'ident3'], ['ident2']], [[ident for ident, _ in batch] for batch in self.batches])
+        self.assertEquals(4, self.queue.stats()['committed'])
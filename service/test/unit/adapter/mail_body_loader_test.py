@@ -0,0 +1,77 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.adapter.mail import PixelatedMail
+from pixelated.adapter.mail_body_loader import MailBodyLoader
+from test.support import test_helper
+
+
+class MailBodyLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.loader = MailBodyLoader(self._load_bodies)
+
+    def _load_bodies(self, mails):
+        self.batches.append([mail.ident for mail in mails])
+        for mail in mails:
+            mail.set_body(test_helper.TestDoc({'raw': 'body of ' + mail.ident}), None)
+
+    def _lazy_mail(self, ident):
+        fdoc, hdoc, _ = test_helper.leap_mail(chash=ident)
+        mail = PixelatedMail.from_soledad(fdoc, hdoc, body_loader=self.loader)
+        self.loader.add(mail)
+        return mail
+
+    def test_first_body_access_loads_every_pending_mail_at_once(self):
+        mails = [self._lazy_mail(ident) for ident in ['ident1', 'ident2', 'ident3']]
+
+        self.assertEquals('body of ident2', mails[1].body)
+        self.assertEquals('body of ident3', mails[2].body)
+        self.assertEquals('body of ident1', mails[0].body)
+
+        self.assertEquals([['ident1', 'ident2', 'ident3']], self.batches)
+
+    def test_flags_and_headers_do_not_load_the_body(self):
+        mail = self._lazy_mail('ident1')
+
+        mail.add_flag('\\Seen')
+        mail.headers
+        mail.tags
+
+        self.assertFalse(mail.body_loaded)
+        self.assertEquals([], self.batches)
+
+    def test_headers_of_a_multipart_mail_do_not_load_the_body(self):
+        part_map = {'1': {'multi': False, 'phash': 'plain', 'headers': [['Content-Type', 'text/plain']]},
+                    '2': {'multi': False, 'phash': 'html', 'headers': [['Content-Type', 'text/html']]},
+                    '3': {'multi': False, 'phash': 'pdf', 'headers': [['Content-Disposition', 'attachment']]}}
+        fdoc, hdoc, _ = test_helper.leap_mail(chash='ident1', headers={'date': '2014-09-03T13:00:00-03:00',
+                                                                       'multi': True, 'part_map': part_map})
+        mail = PixelatedMail.from_soledad(fdoc, hdoc, body_loader=self.loader)
+        self.loader.add(mail)
+
+        self.assertTrue(mail.headers.content_type.startswith('multipart/alternative; boundary='))
+        self.assertFalse(mail.body_loaded)
+        self.assertEquals([], self.batches)
+
+    def test_mail_added_after_a_load_is_loaded_on_its_own(self):
+        self._lazy_mail('ident1').bdoc
+        late = self._lazy_mail('ident2')
+
+        late.parts
+
+        self.assertEquals([['ident1'], ['ident2']], self.batches)
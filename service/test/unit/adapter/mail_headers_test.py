@@ -0,0 +1,83 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.adapter.mail import PixelatedMail
+from pixelated.adapter.mail_headers import MailHeaders
+from pixelated.support.date import milliseconds
+from test.support import test_helper
+
+
+class MailHeadersTest(unittest.TestCase):
+    def _hdoc_content(self, **headers):
+        return test_helper.leap_mail(extra_headers=headers)[1].content
+
+    def test_recipients_are_split_and_stripped_once(self):
+        headers = MailHeaders.from_hdoc(self._hdoc_content(To='one@pixelated.org,\n two@pixelated.org', Cc=['three@pixelated.org ']))
+
+        self.assertEquals(('one@pixelated.org', 'two@pixelated.org'), headers.to)
+        self.assertEquals(('three@pixelated.org',), headers.cc)
+        self.assertEquals((), headers.bcc)
+        self.assertEquals(headers.to, headers['To'])
+
+    def test_date_is_parsed_to_iso_format(self):
+        headers = MailHeaders.from_hdoc(test_helper.leap_mail(headers={'date': 'Wed, 3 Sep 2014 12:36:17 -0300'})[1].content)
+
+        self.assertEquals('2014-09-03T12:36:17-03:00', headers.date)
+        self.assertEquals(headers.date, headers['Date'])
+        self.assertEquals(milliseconds('2014-09-03T12:36:17-03:00'), headers.milliseconds)
+
+    def test_unset_optional_headers_are_left_out(self):
+        headers = MailHeaders.from_hdoc(self._hdoc_content())
+
+        self.assertNotIn('Reply-To', headers)
+        self.assertNotIn('content_type', headers)
+        self.assertIn('Subject', headers)
+        self.assertEquals('fallback', headers.get('Reply-To', 'fallback'))
+        self.assertRaises(KeyError, lambda: headers['content_type'])
+        self.assertNotIn('reply-to', dict(headers.items()))
+
+    def test_items_keep_the_header_names_and_list_recipients(self):
+        headers = MailHeaders.from_hdoc(self._hdoc_content(To='one@pixelated.org', **{'Reply-To': 'reply@pixelated.org'}))
+
+        items = dict(headers.items())
+        self.assertEquals(['one@pixelated.org'], items['To'])
+        self.assertEquals('reply@pixelated.org', items['Reply-To'])
+        self.assertEquals(headers.date, items['Date'])
+        self.assertEquals([name for name, _ in headers.items()], list(headers))
+
+    def test_headers_are_immutable_and_take_no_extra_attributes(self):
+        headers = MailHeaders.from_hdoc(self._hdoc_content())
+
+        self.assertRaises(AttributeError, setattr, headers, 'subject', 'changed')
+        self.assertRaises(AttributeError, setattr, headers, 'other', 'value')
+
+    def test_mail_parses_headers_once_per_header_doc_revision(self):
+        fdoc, hdoc, bdoc = test_helper.leap_mail(extra_headers={'Subject': 'first'})
+        hdoc.rev = '1'
+        mail = PixelatedMail.from_soledad(fdoc, hdoc, bdoc)
+
+        headers = mail.headers
+        self.assertIs(headers, mail.headers)
+
+        hdoc.content['headers']['Subject'] = 'second'
+        hdoc.rev = '2'
+        self.assertEquals('second', mail.headers.subject)
+
+    def test_as_dict_uses_lower_case_names(self):
+        headers = MailHeaders.from_hdoc(self._hdoc_content(To='one@pixelated.org', Subject='subject', **{'Reply-To': 'reply@pixelated.org'}))
+
+        self.assertEquals({name.lower(): value for name, value in headers.items()}, headers.as_dict())
@@ -16,6 +16,8 @@
 import unittest
 
 from pixelated.adapter.mail_service import MailService
+from pixelated.adapter.mail_headers import MailHeaders
+from pixelated.support.date import milliseconds
 from mockito import *
 
 
@@ -29,7 +31,9 @@ class TestMailService(unittest.TestCase):
         self.mailboxes.sent = lambda: mock()
 
         self.mail_sender = mock()
-        self.mail_service = MailService(self.mailboxes, self.mail_sender, self.tag_service, self.querier)
+        self.search_engine = mock()
+        self.mail_service = MailService(self.mailboxes, self.mail_sender, self.tag_service, self.querier,
+                                        self.search_engine)
 
     def test_send_mail(self):
         mail = "mail"
@@ -45,6 +49,50 @@ class TestMailService(unittest.TestCase):
 
         verify(mail).mark_as_read()
 
+    def test_mark_many_as_read_saves_only_changed_mails_at_once(self):
+        unread, read = mock(), mock()
+        unread.flags, read.flags = [], ['\\Seen']
+        when(self.querier).mails([1, 2]).thenReturn([unread, read])
+
+        mails = self.mail_service.mark_many_as_read([1, 2])
+
+        self.assertEquals([unread, read], mails)
+        verify(unread).add_flag('\\Seen')
+        verify(read, never).add_flag(any())
+        verify(self.querier).save_mails([unread])
+
+    def test_mark_many_as_unread_saves_only_changed_mails_at_once(self):
+        unread, read = mock(), mock()
+        unread.flags, read.flags = [], ['\\Seen']
+        when(self.querier).mails([1, 2]).thenReturn([unread, read])
+
+        self.mail_service.mark_many_as_unread([1, 2])
+
+        verify(read).remove_flag('\\Seen')
+        verify(unread, never).remove_flag(any())
+        verify(self.querier).save_mails([read])
+
+    def test_update_many_tags_refuses_reserved_tags(self):
+        when(self.tag_service).extract_reserved(any()).thenReturn({'inbox'})
+
+        self.assertRaises(ValueError, self.mail_service.update_many_tags, [1], ['inbox'], [])
+
+    def test_delete_many_removes_trashed_mails_and_trashes_the_others(self):
+        trash = mock()
+        trash.mailbox_name = 'TRASH'
+        self.mailboxes.trash = lambda: trash
+        in_inbox, in_trash = mock(), mock()
+        in_inbox.mailbox_name, in_trash.mailbox_name = 'INBOX', 'TRASH'
+        when(self.querier).mails([1, 2]).thenReturn([in_inbox, in_trash])
+
+        trashed, removed = self.mail_service.delete_mails([1, 2])
+
+        self.assertEquals([in_inbox], trashed)
+        self.assertEquals([in_trash], removed)
+        verify(in_inbox).set_mailbox('TRASH')
+        verify(self.querier).save_mails([in_inbox])
+        verify(self.querier).remove_mails([in_trash])
+
     def test_delete_mail(self):
         self.mail_service.delete_mail(1)
 
@@ -57,3 +105,29 @@ class TestMailService(unittest.TestCase):
         self.mail_service.reply_all_template(1)
 
         verify(mail).to_reply_template()
+
+    def _thread_mail(self, date, tags):
+        mail = mock()
+        mail.headers = MailHeaders(date=date, milliseconds=milliseconds(date))
+        mail.tags = set(tags)
+        return mail
+
+    def test_thread_returns_its_mails_oldest_first(self):
+        reply = self._thread_mail('2014-09-04T09:00:00-03:00', ['work'])
+        original = self._thread_mail('2014-09-03T13:00:00-03:00', ['important'])
+        when(self.search_engine).thread_idents('ident1').thenReturn({'ident1', 'ident2'})
+        when(self.querier).mails({'ident1', 'ident2'}).thenReturn([reply, original])
+
+        self.assertEquals([original, reply], self.mail_service.thread('ident1'))
+        self.assertEquals({'work', 'important'}, self.mail_service.tags_for_thread('ident1'))
+
+    def test_add_tag_to_thread_tags_every_mail_of_the_thread(self):
+        when(self.search_engine).thread_idents('ident1').thenReturn({'ident1'})
+        when(self.tag_service).extract_reserved(any()).thenReturn(set())
+        mail = self._thread_mail('2014-09-03T12:00:00-03:00', ['inbox'])
+        when(self.querier).mails(['ident1']).thenReturn([mail])
+
+        self.mail_service.add_tag_to_thread('ident1', 'work')
+
+        verify(mail).set_tags({'inbox', 'work'})
+        verify(self.querier).save_mails([mail])
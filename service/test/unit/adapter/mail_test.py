@@ -61,6 +61,50 @@ class TestPixelatedMail(unittest.TestCase):
 
         self.assertEquals(mail.fdoc.content['flags'], ['\\Seen'])
 
+    def test_add_flag_reports_whether_the_mail_changed(self):
+        mail = PixelatedMail.from_soledad(*test_helper.leap_mail(flags=[]), soledad_querier=self.querier)
+
+        self.assertTrue(mail.add_flag('\\Seen'))
+        self.assertFalse(mail.add_flag('\\Seen'))
+        self.assertEquals(mail.fdoc.content['flags'], ['\\Seen'])
+        verify(self.querier, never).save_mail(any())
+
+    def test_tags_are_kept_in_the_flags_doc(self):
+        mail = PixelatedMail.from_soledad(*test_helper.leap_mail(), soledad_querier=self.querier)
+
+        mail.set_tags({'work', 'important'})
+
+        self.assertEquals(['important', 'work'], mail.fdoc.content['tags'])
+        self.assertEquals({'work', 'important'}, mail.tags)
+        self.assertNotIn('X-Tags', mail.hdoc.content['headers'])
+
+    def test_setting_tags_moves_them_out_of_the_legacy_header(self):
+        mail = PixelatedMail.from_soledad(*test_helper.leap_mail(extra_headers={'X-Tags': '["work"]'}), soledad_querier=self.querier)
+        self.assertEquals({'work'}, mail.tags)
+        self.assertTrue(mail.has_legacy_tags)
+
+        mail.set_tags(mail.tags)
+
+        self.assertFalse(mail.has_legacy_tags)
+        self.assertEquals({'work'}, mail.tags)
+        self.assertEquals([mail.fdoc, mail.hdoc], mail.changed_docs())
+
+    def test_only_the_docs_a_change_touched_are_reported_as_changed(self):
+        mail = PixelatedMail.from_soledad(*test_helper.leap_mail(flags=[]), soledad_querier=self.querier)
+
+        mail.set_tags(mail.tags)
+        mail.set_mailbox('INBOX')
+        self.assertEquals([], mail.changed_docs())
+
+        mail.add_flag('\\Seen')
+        self.assertEquals([mail.fdoc], mail.changed_docs())
+
+        mail.set_tags({'work'})
+        self.assertEquals([mail.fdoc], mail.changed_docs())
+
+        mail.mark_as_saved()
+        self.assertEquals([], mail.changed_docs())
+
     def test_mark_as_not_recent(self):
         mail = PixelatedMail.from_soledad(*test_helper.leap_mail(flags=['\\Recent']), soledad_querier=self.querier)
 
@@ -145,6 +189,46 @@ class TestPixelatedMail(unittest.TestCase):
 
         self.assertRegexpMatches(mail.body, '([\s\S]*100%){2}')
 
+    def test_text_prefers_the_decoded_plain_alternative(self):
+        parts = {'alternatives': [], 'attachments': []}
+        parts['alternatives'].append({'content': 'caf=C3=A9\n  time', 'headers': {
+            'Content-Type': 'text/plain; charset=utf-8', 'Content-Transfer-Encoding': 'quoted-printable'}})
+        parts['alternatives'].append({'content': '<p>caf&eacute; time</p>', 'headers': {'Content-Type': 'text/html'}})
+
+        mail = PixelatedMail.from_soledad(None, None, None, parts=parts, soledad_querier=None)
+
+        self.assertEquals(u'caf\xe9 time', mail.text)
+
+    def test_text_of_a_single_part_html_mail(self):
+        leap_mail = test_helper.leap_mail(extra_headers={'Content-Type': 'text/html',
+                                                         'Content-Transfer-Encoding': 'base64'},
+                                          body='PGI+SGVsbG88L2I+IHdvcmxk\n')
+
+        mail = PixelatedMail.from_soledad(*leap_mail, soledad_querier=self.querier)
+
+        self.assertEquals(u'Hello world', mail.text)
+
+    def test_text_of_a_non_ascii_unicode_body(self):
+        for encoding in [None, '8bit', 'quoted-printable', 'base64']:
+            leap_mail = test_helper.leap_mail(extra_headers={'Content-Type': 'text/plain; charset=utf-8',
+                                                             'Content-Transfer-Encoding': encoding},
+                                              body=u'Ol\xe1 mundo' if encoding in [None, '8bit'] else
+                                              {'quoted-printable': u'Ol=C3=A1 mundo', 'base64': u'T2zDoSBtdW5kbw=='}[encoding])
+
+            mail = PixelatedMail.from_soledad(*leap_mail, soledad_querier=self.querier)
+
+            self.assertEquals(u'Ol\xe1 mundo', mail.text)
+
+    def test_message_id_and_references_come_from_the_headers(self):
+        leap_mail = test_helper.leap_mail(extra_headers={'Message-ID': '<3@pixelated.org>',
+                                                         'references': '<1@pixelated.org>\n <2@pixelated.org>',
+                                                         'In-Reply-To': '<2@pixelated.org>'})
+
+        mail = PixelatedMail.from_soledad(*leap_mail, soledad_querier=self.querier)
+
+        self.assertEquals('<3@pixelated.org>', mail.message_id)
+        self.assertEquals(['<1@pixelated.org>', '<2@pixelated.org>'], mail.references)
+
     def test_clean_line_breaks_on_address_headers(self):
         many_recipients = 'One <one@mail.com>,\nTwo <two@mail.com>, Normal <normal@mail.com>,\nalone@mail.com'
         headers = {'Cc': many_recipients,
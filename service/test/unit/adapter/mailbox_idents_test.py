@@ -0,0 +1,51 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.adapter.mailbox_idents import MailboxIdents
+
+
+class MailboxIdentsTest(unittest.TestCase):
+
+    def _mailbox_idents(self, all_fields):
+        mailbox_idents = MailboxIdents()
+        for fields in all_fields:
+            mailbox_idents.add(fields)
+        return mailbox_idents
+
+    def test_groups_idents_by_mailbox(self):
+        idents = self._mailbox_idents([{'mailbox': u'inbox', 'ident': u'ident1'},
+                                       {'mailbox': u'inbox', 'ident': u'ident2'},
+                                       {'mailbox': u'sent', 'ident': u'ident3'}])
+
+        self.assertEquals(2, idents.count(u'inbox'))
+        self.assertEquals({u'ident1', u'ident2', u'ident3'}, idents.all())
+
+    def test_missing_reports_idents_not_in_the_mailbox(self):
+        idents = self._mailbox_idents([{'mailbox': u'inbox', 'ident': u'ident1'},
+                                       {'mailbox': u'sent', 'ident': u'ident2'}])
+
+        self.assertEquals({u'ident2', u'ident3'}, idents.missing(u'inbox', [u'ident1', u'ident2', u'ident3']))
+
+    def test_replacing_fields_moves_idents_between_mailboxes(self):
+        idents = self._mailbox_idents([{'mailbox': u'inbox', 'ident': u'ident1'}])
+
+        idents.replace({'mailbox': u'inbox', 'ident': u'ident1'}, {'mailbox': u'trash', 'ident': u'ident1'})
+        idents.replace({'mailbox': u'trash', 'ident': u'ident1'}, None)
+
+        self.assertEquals(0, idents.count(u'inbox'))
+        self.assertEquals(0, idents.count(u'trash'))
+        self.assertEquals(set(), idents.all())
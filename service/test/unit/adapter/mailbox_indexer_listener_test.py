@@ -38,17 +38,61 @@ class MailboxListenerTest(unittest.TestCase):
 
         self.assertIn(MailboxIndexerListener('INBOX', self.querier), mailbox.listeners)
 
+    def _mail(self, ident):
+        mail = mock()
+        mail.ident = ident
+        return mail
+
     def test_reindex_missing_idents(self):
         search_engine = mock()
-        when(search_engine).search('tag:inbox', all_mails=True).thenReturn(['ident1', 'ident2'])
+        when(search_engine).missing_idents('INBOX', {'ident1', 'ident2', 'missing_ident'}).thenReturn({'missing_ident'})
 
         MailboxIndexerListener.SEARCH_ENGINE = search_engine
 
         listener = MailboxIndexerListener('INBOX', self.querier)
         when(self.querier).idents_by_mailbox('INBOX').thenReturn({'ident1', 'ident2', 'missing_ident'})
-        self.querier.used_arguments = []
-        self.querier.mails = lambda x: self.querier.used_arguments.append(x)
+        when(self.querier).mails_with_bodies({'missing_ident'}).thenReturn([self._mail('missing_ident')])
         listener.newMessages(10, 5)
 
         verify(self.querier, times=1).idents_by_mailbox('INBOX')
-        self.assertIn({'missing_ident'}, self.querier.used_arguments)
+        verify(self.querier).mails_with_bodies({'missing_ident'})
+
+    def test_later_notifications_only_look_at_mailbox_changes(self):
+        search_engine = mock()
+        when(search_engine).missing_idents('INBOX', set()).thenReturn(set())
+        when(search_engine).missing_idents('INBOX', {'new_ident'}).thenReturn({'new_ident'})
+        MailboxIndexerListener.SEARCH_ENGINE = search_engine
+
+        listener = MailboxIndexerListener('INBOX', self.querier)
+        when(self.querier).generation().thenReturn(3)
+        when(self.querier).idents_by_mailbox('INBOX').thenReturn(set())
+        when(self.querier).mailbox_changes_since('INBOX', 3).thenReturn((4, {'new_ident'}))
+        new_mail = self._mail('new_ident')
+        when(self.querier).mails_with_bodies({'new_ident'}).thenReturn([new_mail])
+
+        listener.newMessages(1, 0)
+        listener.newMessages(2, 1)
+
+        verify(self.querier, times=1).idents_by_mailbox('INBOX')
+        verify(search_engine).index_mails([new_mail])
+        self.assertEquals(4, listener.generation)
+
+    def test_mails_not_synced_yet_are_retried_on_the_next_notification(self):
+        search_engine = mock()
+        when(search_engine).missing_idents('INBOX', {'unsynced_ident'}).thenReturn({'unsynced_ident'})
+        MailboxIndexerListener.SEARCH_ENGINE = search_engine
+
+        listener = MailboxIndexerListener('INBOX', self.querier)
+        when(self.querier).generation().thenReturn(3)
+        when(self.querier).idents_by_mailbox('INBOX').thenReturn({'unsynced_ident'})
+        when(self.querier).mailbox_changes_since('INBOX', 3).thenReturn((4, set()))
+        unsynced_mail = self._mail('unsynced_ident')
+        when(self.querier).mails_with_bodies({'unsynced_ident'}).thenReturn([]).thenReturn([unsynced_mail])
+
+        listener.newMessages(1, 1)
+        self.assertEquals({'unsynced_ident'}, listener.pending)
+
+        listener.newMessages(1, 0)
+
+        verify(search_engine).index_mails([unsynced_mail])
+        self.assertEquals(set(), listener.pending)
@@ -34,3 +34,10 @@ class PixelatedMailboxTest(unittest.TestCase):
         self.mailbox.remove(1)
 
         verify(self.querier).remove_mail(mail)
+
+    def test_mails_by_tags_only_keeps_the_mails_of_the_mailbox(self):
+        inbox_mail = PixelatedMail.from_soledad(*test_helper.leap_mail(mbox='INBOX'), soledad_querier=self.querier)
+        sent_mail = PixelatedMail.from_soledad(*test_helper.leap_mail(mbox='SENT'), soledad_querier=self.querier)
+        when(self.querier).mails_by_tags(['work']).thenReturn([inbox_mail, sent_mail])
+
+        self.assertEquals([inbox_mail], self.mailbox.mails_by_tags(['work']))
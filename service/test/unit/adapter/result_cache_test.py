@@ -0,0 +1,43 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.adapter.result_cache import ResultCache
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResultCache(max_entries=2)
+        self.computed = 0
+
+    def _compute(self):
+        self.computed += 1
+        return ['ident%d' % self.computed]
+
+    def test_result_is_computed_once_per_generation(self):
+        first = self.cache.get('query', self._compute)
+        second = self.cache.get('query', self._compute)
+
+        self.assertEquals(first, second)
+        self.assertEquals(1, self.computed)
+        self.assertEquals(0.5, self.cache.stats()['hit_ratio'])
+
+    def test_invalidate_drops_results_of_older_generations(self):
+        self.cache.get('query', self._compute)
+        self.cache.invalidate()
+
+        self.assertEquals(['ident2'], self.cache.get('query', self._compute))
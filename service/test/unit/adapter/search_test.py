@@ -0,0 +1,236 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+import shutil
+import tempfile
+
+from mockito import mock, when
+from pixelated.adapter.mail_headers import MailHeaders
+from pixelated.adapter.search import SearchEngine
+from pixelated.support.date import milliseconds
+
+
+class SearchEngineTest(unittest.TestCase):
+    MASTERKEY = '_yg2oG_5ELM8_-sQYcsxI37WesI0dOtZQXpwAqjvhR4='
+
+    def setUp(self):
+        self.index_folder = tempfile.mkdtemp()
+        SearchEngine.INDEX_FOLDER = self.index_folder
+        self.search_engine = self._search_engine()
+
+    def _search_engine(self):
+        querier = mock()
+        when(querier).get_index_masterkey().thenReturn(self.MASTERKEY)
+        return SearchEngine(querier)
+
+    def tearDown(self):
+        self.search_engine.index_writer.close()
+        shutil.rmtree(self.index_folder)
+
+    def _mail(self, ident, tags=None, flags=None, mailbox='INBOX', body='mail body', attachments=None,
+              date='2014-09-03T12:36:17-03:00', message_id=None, references=None, subject=None):
+        mail = mock()
+        mail.mailbox_name = mailbox
+        mail.flags = flags or []
+        mail.text = u' '.join(body.split())
+        mail.message_id = message_id
+        mail.references = references or []
+        mail.ident = ident
+        mail.tags = set(tags or [])
+        mail.attachments = attachments or []
+        mail.headers = MailHeaders(to=('to@pixelated.org',), cc=(), bcc=(), sender='sender@pixelated.org',
+                                   subject=subject or 'subject of %s' % ident,
+                                   date=date, milliseconds=milliseconds(date),
+                                   content_type=None, reply_to=None)
+        return mail
+
+    def test_search_summaries_are_served_from_stored_fields(self):
+        self.search_engine.index_mail(self._mail('ident1', tags=['important'], flags=['\\Seen'],
+                                                 body='a   long\nbody', attachments=[{'ident': 'att'}]))
+
+        summaries, _ = self.search_engine.search_summaries('tag:inbox')
+
+        self.assertEquals({'ident': 'ident1',
+                           'header': {'from': 'sender@pixelated.org',
+                                      'to': ['to@pixelated.org'],
+                                      'cc': [],
+                                      'subject': 'subject of ident1',
+                                      'date': '2014-09-03T12:36:17-03:00'},
+                           'tags': ['important'],
+                           'status': ['read'],
+                           'mailbox': 'inbox',
+                           'snippet': 'a long body',
+                           'attachment_count': 1,
+                           'thread': 'ident1'}, summaries[0])
+
+    def test_search_returns_idents_of_the_page(self):
+        self.search_engine.index_mails([self._mail('ident1', date='2014-09-03T12:36:17-03:00'),
+                                        self._mail('ident2', date='2014-09-04T12:36:17-03:00')])
+
+        idents, total = self.search_engine.search('tag:inbox', window=1, page=1)
+
+        self.assertEquals(['ident2'], idents)
+        self.assertEquals(2, total)
+
+    def test_tag_counts_follow_index_updates_and_deletions(self):
+        self.search_engine.index_mails([self._mail('ident1', tags=['important']),
+                                        self._mail('ident2', tags=['important'], flags=['\\Seen'])])
+        self.search_engine.index_mail(self._mail('ident1', tags=['important'], flags=['\\Seen']))
+        self.search_engine.remove_from_index('ident2')
+
+        tags = dict((tag['name'], tag['counts']) for tag in self.search_engine.tags(query='', skip_default_tags=False))
+
+        self.assertEquals({'total': 1, 'read': 1}, tags['important'])
+        self.assertEquals({'total': 1, 'read': 1}, tags['inbox'])
+        self.assertEquals({'total': 0, 'read': 0}, tags['trash'])
+
+    def test_reindexed_mail_replaces_its_committed_document(self):
+        self.search_engine.index_mails([self._mail('ident1', body='first version'), self._mail('ident2')])
+        self.search_engine.flush()
+
+        self.search_engine.index_mail(self._mail('ident1', body='second version'))
+        self.search_engine.flush()
+
+        self.assertEquals(2, self.search_engine.doc_count())
+        self.assertEquals(([], 0), self.search_engine.search('first'))
+        self.assertEquals((['ident1'], 1), self.search_engine.search('second'))
+
+    def test_missing_idents_follow_index_updates_and_deletions(self):
+        self.search_engine.index_mails([self._mail('ident1'), self._mail('ident2'), self._mail('ident3', mailbox='SENT')])
+        self.search_engine.remove_from_index('ident2')
+        self.search_engine.flush()
+
+        self.assertEquals({'ident2', 'ident3'}, self.search_engine.missing_idents('INBOX', ['ident1', 'ident2', 'ident3']))
+        self.assertEquals({'ident1', 'ident3'}, self.search_engine.all_idents())
+
+    def test_contacts_come_from_indexed_senders_and_recipients(self):
+        self.search_engine.index_mail(self._mail('ident1'))
+        self.search_engine.index_mail(self._mail('ident2'))
+
+        self.assertEquals(['sender@pixelated.org', 'to@pixelated.org'], self.search_engine.contacts('PIXEL'))
+
+        self.search_engine.remove_from_index('ident1')
+        self.search_engine.remove_from_index('ident2')
+        self.assertEquals([], self.search_engine.contacts('pixel'))
+
+    def _conversation(self):
+        self.search_engine.index_mails([
+            self._mail('ident1', date='2014-09-01T10:00:00-03:00', message_id='<1@pixelated>', subject='plans'),
+            self._mail('ident2', date='2014-09-02T10:00:00-03:00', message_id='<2@pixelated>', subject='Re: plans',
+                       references=['<1@pixelated>']),
+            self._mail('ident3', date='2014-09-03T10:00:00-03:00', subject='other')])
+
+    def test_thread_idents_cover_the_whole_conversation(self):
+        self._conversation()
+
+        self.assertEquals({'ident1', 'ident2'}, self.search_engine.thread_idents('ident2'))
+        self.assertEquals('ident1', self.search_engine.search_summaries('ident:ident2')[0][0]['thread'])
+
+    def test_thread_mode_summarizes_each_conversation_by_its_newest_mail(self):
+        self._conversation()
+
+        summaries, total = self.search_engine.search_summaries('tag:inbox', threads=True)
+
+        self.assertEquals(2, total)
+        self.assertEquals([('ident3', 'ident3', 1), ('ident2', 'ident1', 2)],
+                          [(summary['ident'], summary['thread'], summary['thread_size']) for summary in summaries])
+
+    def test_tag_counts_are_rebuilt_from_the_index_when_reopened(self):
+        self.search_engine.index_mail(self._mail('ident1', tags=['important']))
+        self.search_engine.store_metadata('tag_counts', {'important': {'total': 7, 'read': 0}})
+        self.search_engine.index_writer.close()
+
+        self.search_engine = self._search_engine()
+
+        self.assertEquals({'important': 1, 'inbox': 1}, self.search_engine.tag_counts.totals())
+
+    def test_existing_index_is_reopened_with_its_mails(self):
+        self.search_engine.index_mail(self._mail('ident1'))
+        self.search_engine.index_writer.close()
+
+        self.search_engine = self._search_engine()
+
+        self.assertTrue(self.search_engine.reopened)
+        self.assertEquals(1, self.search_engine.doc_count())
+        self.assertEquals(1, self.search_engine.tag_counts.totals()['inbox'])
+
+    def test_index_with_an_outdated_schema_is_recreated(self):
+        self.search_engine.index_mail(self._mail('ident1'))
+        self.search_engine.store_metadata(SearchEngine.SCHEMA, SearchEngine.SCHEMA_VERSION - 1)
+        self.search_engine.index_writer.close()
+
+        self.search_engine = self._search_engine()
+
+        self.assertFalse(self.search_engine.reopened)
+        self.assertEquals(0, self.search_engine.doc_count())
+        self.assertEquals(SearchEngine.SCHEMA_VERSION, self.search_engine.load_metadata(SearchEngine.SCHEMA))
+
+    def test_default_field_searches_the_headers_and_the_body_text(self):
+        self.search_engine.index_mail(self._mail('ident1', body='quarterly report'))
+        self.search_engine.index_mail(self._mail('ident2', body='lunch'))
+
+        self.assertEquals(['ident1'], self.search_engine.search('quarterly')[0])
+        self.assertEquals(['ident2'], self.search_engine.search('subject ident2')[0])
+        self.assertEquals(2, len(self.search_engine.search('sender@pixelated.org')[0]))
+
+    def test_repeated_search_is_served_from_the_result_cache(self):
+        self.search_engine.index_mail(self._mail('ident1'))
+
+        self.search_engine.search('tag:inbox', window=25, page=1)
+        idents, _ = self.search_engine.search('tag:inbox', window=25, page=1)
+
+        self.assertEquals(['ident1'], idents)
+        self.assertEquals(1, self.search_engine.results.stats()['hits'])
+
+    def test_result_cache_is_invalidated_by_index_writes(self):
+        self.search_engine.index_mail(self._mail('ident1'))
+        self.search_engine.search('tag:inbox')
+
+        self.search_engine.index_mail(self._mail('ident2'))
+        idents, _ = self.search_engine.search('tag:inbox')
+
+        self.assertEquals({'ident1', 'ident2'}, set(idents))
+        self.assertEquals(0, self.search_engine.results.stats()['hits'])
+
+    def test_keyset_pagination_walks_mails_newest_first(self):
+        self.search_engine.index_mails([self._mail('ident1', date='2014-09-03T12:36:17-03:00'),
+                                        self._mail('ident2', date='2014-09-03T12:36:17-03:00'),
+                                        self._mail('ident3', date='2014-09-04T12:36:17-03:00')])
+
+        idents, cursor = [], ''
+        while cursor is not None:
+            summaries, total, cursor = self.search_engine.search_summaries_after('tag:inbox', window=2, after=cursor)
+            idents.extend(summary['ident'] for summary in summaries)
+
+        self.assertEquals(['ident3', 'ident2', 'ident1'], idents)
+        self.assertEquals(3, total)
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertRaises(ValueError, self.search_engine.search_summaries_after, 'tag:inbox', 25, 'not-a-cursor')
+
+    def test_total_counts_each_matching_mail_once_whatever_its_tags(self):
+        self.search_engine.index_mails([self._mail('ident1', tags=['important', 'work', 'later']),
+                                        self._mail('ident2')])
+
+        _, total = self.search_engine.search('tag:inbox', window=1, page=1)
+
+        self.assertEquals(2, total)
+        self.assertEquals(1, self.search_engine.count('tag:work'))
+
+    def test_estimated_count_is_an_upper_bound(self):
+        self.search_engine.index_mails([self._mail('ident1', tags=['work']), self._mail('ident2')])
+
+        self.assertTrue(self.search_engine.count('tag:inbox AND tag:work', exact=False) >= 1)
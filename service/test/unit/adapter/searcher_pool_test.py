@@ -0,0 +1,67 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from whoosh.fields import Schema, ID
+from whoosh.filedb.filestore import RamStorage
+from pixelated.adapter.searcher_pool import SearcherPool
+
+
+class SearcherPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RamStorage().create_index(Schema(ident=ID(stored=True)))
+        self._add(u'ident1')
+        self.pool = SearcherPool(self.index)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def _add(self, ident):
+        writer = self.index.writer()
+        writer.add_document(ident=unicode(ident))
+        writer.commit()
+
+    def test_returned_searcher_is_reused_while_index_is_unchanged(self):
+        with self.pool.searcher() as first:
+            pass
+        with self.pool.searcher() as second:
+            self.assertIs(first, second)
+
+        self.assertEquals({'idle': 1, 'opened': 1, 'refreshed': 0, 'reused': 1}, self.pool.stats())
+
+    def test_concurrent_queries_get_their_own_searchers(self):
+        with self.pool.searcher() as first:
+            with self.pool.searcher() as second:
+                self.assertIsNot(first, second)
+
+    def test_searchers_are_refreshed_after_a_commit(self):
+        with self.pool.searcher():
+            pass
+        self._add(u'ident2')
+        self.pool.invalidate()
+
+        with self.pool.searcher() as searcher:
+            self.assertEquals(2, searcher.doc_count())
+        self.assertEquals(1, self.pool.stats()['refreshed'])
+
+    def test_searcher_lent_during_a_commit_keeps_its_snapshot(self):
+        with self.pool.searcher() as searcher:
+            self._add(u'ident2')
+            self.pool.invalidate()
+
+            self.assertEquals(1, searcher.doc_count())
+            self.assertEquals([u'ident1'], [fields['ident'] for fields in searcher.all_stored_fields()])
@@ -14,12 +14,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
 import unittest
+from pixelated.adapter.mail import PixelatedMail
 from pixelated.adapter.soledad_querier import SoledadQuerier
-from mockito import mock, when, any
+from mockito import mock, when, any, verify, never
 import json
 import os
 import base64
 import quopri
+import sqlite3
+from collections import namedtuple
+from test.support import test_helper
+
+Doc = namedtuple('Doc', ['doc_id', 'content'])
+RevDoc = namedtuple('RevDoc', ['doc_id', 'rev', 'content'])
 
 
 class SoledadQuerierTest(unittest.TestCase):
@@ -103,3 +110,255 @@ class SoledadQuerierTest(unittest.TestCase):
         attachment = querier.attachment(u'0400BEBACAFE', 'quoted-printable')
 
         self.assertEquals('esse papo seu ta qualquer coisa', attachment['content'])
+
+    def test_changes_since_collects_idents_of_changed_flags_and_header_docs(self):
+        soledad = mock()
+        soledad._db = mock()
+        fdoc, hdoc, bdoc, deleted = mock(), mock(), mock(), mock()
+        fdoc.content = {'type': 'flags', 'chash': 'ident1'}
+        hdoc.content = {'type': 'head', 'chash': 'ident2'}
+        bdoc.content = {'type': 'cnt', 'phash': 'phash'}
+        for doc in [fdoc, hdoc, bdoc]:
+            when(doc).is_tombstone().thenReturn(False)
+        when(deleted).is_tombstone().thenReturn(True)
+        changes = [('fdoc', 2, 't'), ('hdoc', 3, 't'), ('bdoc', 4, 't'), ('deleted', 5, 't')]
+        when(soledad._db).whats_changed(1).thenReturn((5, 't', changes))
+        when(soledad).get_docs(['fdoc', 'hdoc', 'bdoc', 'deleted'], check_for_conflicts=False, include_deleted=True).thenReturn([fdoc, hdoc, bdoc, deleted])
+        querier = SoledadQuerier(soledad)
+
+        generation, idents, has_deletions = querier.changes_since(1)
+
+        self.assertEquals(5, generation)
+        self.assertEquals({'ident1', 'ident2'}, idents)
+        self.assertTrue(has_deletions)
+
+    def test_mailbox_changes_since_only_reports_live_mails_of_the_mailbox(self):
+        soledad = mock()
+        soledad._db = mock()
+        docs = {'inbox': {'type': 'flags', 'chash': 'ident1', 'mbox': 'INBOX', 'deleted': False},
+                'sent': {'type': 'flags', 'chash': 'ident2', 'mbox': 'SENT', 'deleted': False},
+                'removed': {'type': 'flags', 'chash': 'ident3', 'mbox': 'INBOX', 'deleted': True},
+                'header': {'type': 'head', 'chash': 'ident4'}}
+        changed_docs = []
+        for content in docs.values():
+            doc = mock()
+            doc.content = content
+            changed_docs.append(doc)
+        when(soledad._db).whats_changed(7).thenReturn((9, 't', [(doc_id, 8, 't') for doc_id in docs]))
+        when(soledad).get_docs(docs.keys(), check_for_conflicts=False).thenReturn(changed_docs)
+        querier = SoledadQuerier(soledad)
+
+        self.assertEquals((9, {'ident1'}), querier.mailbox_changes_since('INBOX', 7))
+
+    def _soledad_with_documents(self, docs):
+        soledad = mock()
+        soledad._db = mock()
+        soledad._db._db_handle = sqlite3.connect(':memory:')
+        soledad._db._factory = lambda doc_id, doc_rev, content: (doc_id, json.loads(content))
+        soledad._db._db_handle.execute('CREATE TABLE document (doc_id TEXT PRIMARY KEY, doc_rev TEXT, content TEXT)')
+        soledad._db._db_handle.execute('CREATE TABLE document_fields (doc_id TEXT, field_name TEXT, value TEXT)')
+        for doc_id, content in docs.items():
+            soledad._db._db_handle.execute('INSERT INTO document VALUES (?, ?, ?)', (doc_id, '1', json.dumps(content)))
+            for field in ['type', 'chash', 'phash']:
+                if field in content:
+                    soledad._db._db_handle.execute('INSERT INTO document_fields VALUES (?, ?, ?)', (doc_id, field, content[field]))
+        return soledad
+
+    def test_get_many_from_index_resolves_all_values_with_one_query_per_batch(self):
+        soledad = self._soledad_with_documents({
+            'h1': {'type': 'head', 'chash': 'ident1'},
+            'h2': {'type': 'head', 'chash': 'ident2'},
+            'f1': {'type': 'flags', 'chash': 'ident1'},
+            'c1': {'type': 'cnt', 'phash': 'ident2'}})
+        querier = SoledadQuerier(soledad)
+        querier.MAX_QUERY_VARIABLES = 1
+
+        docs = querier._get_many_from_index('head', 'chash', ['ident1', 'ident2', 'unknown'])
+
+        self.assertEquals({'ident1', 'ident2'}, set(docs.keys()))
+        self.assertEquals('h1', docs['ident1'][0][0])
+        self.assertEquals('h2', docs['ident2'][0][0])
+
+    def test_iter_mails_builds_mails_one_batch_of_flags_docs_at_a_time(self):
+        soledad = self._soledad_with_documents(dict(('f%d' % i, {'type': 'flags', 'chash': 'ident%d' % i}) for i in range(5)))
+        soledad._db._factory = lambda doc_id, doc_rev, content: Doc(doc_id, json.loads(content))
+        querier = SoledadQuerier(soledad)
+        batches = []
+        querier._build_mails_from_fdocs = lambda fdocs_chash: batches.append([chash for _, chash in fdocs_chash]) or batches[-1]
+        querier.load_bodies = lambda mails: mails
+
+        mails = querier.iter_mails(batch_size=2)
+
+        self.assertEquals([], batches)
+        self.assertEquals(['ident0', 'ident1', 'ident2', 'ident3', 'ident4'], list(mails))
+        self.assertEquals([['ident0', 'ident1'], ['ident2', 'ident3'], ['ident4']], batches)
+
+    def _querier_with_mails(self):
+        docs = {}
+        for i in [1, 2, 3]:
+            docs['f%d' % i] = {'type': 'flags', 'chash': 'ident%d' % i, 'mbox': 'INBOX', 'flags': []}
+            docs['h%d' % i] = {'type': 'head', 'chash': 'ident%d' % i, 'body': 'phash%d' % i, 'phash': 'phash%d' % i,
+                               'multi': False, 'headers': {}}
+        docs['c1'] = {'type': 'cnt', 'phash': 'phash1', 'raw': 'first body'}
+        docs['c2'] = {'type': 'cnt', 'phash': 'phash2', 'raw': 'second body'}
+        soledad = self._soledad_with_documents(docs)
+        soledad._db._factory = lambda doc_id, doc_rev, content: RevDoc(doc_id, doc_rev, json.loads(content))
+        querier = SoledadQuerier(soledad)
+        queries = []
+        get_many_from_index = querier._get_many_from_index
+        querier._get_many_from_index = lambda doc_type, field, values: queries.append(doc_type) or get_many_from_index(doc_type, field, values)
+        return querier, queries
+
+    def test_mails_fetch_their_bodies_together_on_first_access(self):
+        querier, queries = self._querier_with_mails()
+
+        mails = querier.mails(['ident1', 'ident2', 'ident3'])
+
+        self.assertEquals(['flags', 'head'], queries)
+        self.assertEquals('second body', mails[1].body)
+        self.assertEquals('first body', mails[0].body)
+        self.assertEquals(['flags', 'head', 'cnt'], queries)
+
+    def test_mails_with_bodies_leave_out_mails_whose_body_is_not_synced(self):
+        querier, _ = self._querier_with_mails()
+
+        mails = querier.mails_with_bodies(['ident1', 'ident2', 'ident3'])
+
+        self.assertEquals(['ident1', 'ident2'], [mail.ident for mail in mails])
+
+    def test_save_mails_only_writes_the_changed_docs(self):
+        soledad = mock()
+        soledad._db = mock()
+        when(soledad._db)._get_indexed_fields().thenReturn([])
+        querier = SoledadQuerier(soledad)
+        read, tagged, untouched = [PixelatedMail.from_soledad(*test_helper.leap_mail(flags=[], chash=ident), soledad_querier=querier)
+                                   for ident in ['ident1', 'ident2', 'ident3']]
+        read.add_flag('\\Seen')
+        tagged.set_tags({'work'})
+
+        querier.save_mails([read, tagged, untouched])
+
+        verify(soledad).put_doc(read.fdoc)
+        verify(soledad).put_doc(tagged.fdoc)
+        verify(soledad, times=2).put_doc(any())
+        self.assertEquals({'saves': 1, 'mails': 3, 'docs_written': 2, 'docs_per_save': 2.0}, querier.write_stats())
+
+    def test_migrate_tags_moves_legacy_tags_to_the_flags_docs(self):
+        querier, _ = self._querier_with_mails()
+        querier.MAIL_BATCH = 2
+        for hdoc in querier.soledad._db._db_handle.execute("SELECT doc_id, content FROM document WHERE doc_id IN ('h1', 'h3')").fetchall():
+            content = json.loads(hdoc[1])
+            content['headers']['X-Tags'] = '["work"]'
+            querier.soledad._db._db_handle.execute('UPDATE document SET content = ? WHERE doc_id = ?', (json.dumps(content), hdoc[0]))
+        saved = []
+        querier.save_mails = lambda mails: saved.extend((mail.ident, mail.fdoc.content['tags'], mail.has_legacy_tags) for mail in mails)
+
+        self.assertEquals(2, querier.migrate_tags())
+        self.assertEquals([('ident1', ['work'], False), ('ident3', ['work'], False)], saved)
+
+    def _add_legacy_tags(self, querier, tags_by_hdoc):
+        db = querier.soledad._db._db_handle
+        for doc_id, tags in tags_by_hdoc.items():
+            content = json.loads(db.execute('SELECT content FROM document WHERE doc_id = ?', (doc_id,)).fetchone()[0])
+            content['headers']['X-Tags'] = json.dumps(tags)
+            db.execute('UPDATE document SET content = ? WHERE doc_id = ?', (json.dumps(content), doc_id))
+
+    def _add_flags_doc(self, querier, doc_id, content):
+        db = querier.soledad._db._db_handle
+        db.execute('INSERT INTO document VALUES (?, ?, ?)', (doc_id, '1', json.dumps(content)))
+        for field in ['type', 'chash']:
+            db.execute('INSERT INTO document_fields VALUES (?, ?, ?)', (doc_id, field, content[field]))
+
+    def test_migrate_mail_tags_tags_every_flags_doc_of_the_mail(self):
+        querier, _ = self._querier_with_mails()
+        self._add_legacy_tags(querier, {'h1': ['work']})
+        self._add_flags_doc(querier, 'f1-sent', {'type': 'flags', 'chash': 'ident1', 'mbox': 'SENT', 'flags': []})
+        saved, put = [], []
+        querier.save_mails = saved.extend
+        querier.soledad.put_doc = put.append
+
+        self.assertEquals(1, querier.migrate_mail_tags(querier.mails(['ident1', 'ident2'])))
+
+        self.assertEquals(['ident1'], [mail.ident for mail in saved])
+        self.assertEquals(['work'], saved[0].fdoc.content['tags'])
+        self.assertFalse(saved[0].has_legacy_tags)
+        copies = [doc for doc in put if doc.doc_id != saved[0].fdoc.doc_id]
+        self.assertEquals([['work']], [doc.content['tags'] for doc in copies])
+
+    def test_mails_by_tags_fall_back_to_legacy_tags_until_migrated(self):
+        querier, _ = self._querier_with_mails()
+        self._add_legacy_tags(querier, {'h2': ['work'], 'h3': ['personal']})
+        when(querier.soledad).get_from_index('by-type-and-tag', 'flags', 'work').thenReturn([])
+
+        self.assertEquals(['ident2'], [mail.ident for mail in querier.mails_by_tags(['work'])])
+
+        querier.tags_migrated = True
+        self.assertEquals([], querier.mails_by_tags(['work']))
+
+    def test_mails_by_tags_come_from_the_tag_index(self):
+        soledad = mock()
+        work, important = mock(), mock()
+        work.content = {'chash': 'ident1'}
+        important.content = {'chash': 'ident2'}
+        when(soledad).get_from_index('by-type-and-tag', 'flags', 'work').thenReturn([work])
+        when(soledad).get_from_index('by-type-and-tag', 'flags', 'important').thenReturn([important, work])
+        querier = SoledadQuerier(soledad)
+        querier.tags_migrated = True
+        built = []
+        querier._build_mails_from_fdocs = lambda fdocs_chash: built.extend(sorted(chash for _, chash in fdocs_chash))
+
+        querier.mails_by_tags(['work', 'important'])
+
+        verify(soledad).create_index('by-type-and-tag', 'type', 'tags')
+        self.assertEquals(['ident1', 'ident2'], built)
+
+    def test_mail_count_counts_distinct_mails_with_flags_docs(self):
+        soledad = self._soledad_with_documents({
+            'f1': {'type': 'flags', 'chash': 'ident1'},
+            'f1-copy': {'type': 'flags', 'chash': 'ident1'},
+            'f2': {'type': 'flags', 'chash': 'ident2'},
+            'h1': {'type': 'head', 'chash': 'ident1'},
+            'h3': {'type': 'head', 'chash': 'ident3'}})
+
+        self.assertEquals(2, SoledadQuerier(soledad).mail_count())
+
+    def test_extract_parts_uses_prefetched_content_docs(self):
+        soledad = mock()
+        cdoc = mock()
+        cdoc.content = {'raw': 'prefetched content'}
+        hdoc = {'multi': True, 'part_map': {'1': {'multi': False, 'phash': u'0400BEBACAFE'}}}
+        querier = SoledadQuerier(soledad)
+
+        parts = querier._extract_parts(hdoc, {u'0400BEBACAFE': [cdoc]})
+
+        self.assertEquals('prefetched content', parts['alternatives'][0]['content'])
+        verify(soledad, never).get_from_index(any(), any(), any())
+
+    def _docs_for_cached_mail(self, soledad, fdoc_rev='1', hdoc_rev='1'):
+        fdoc, hdoc = mock(), mock()
+        fdoc.rev, hdoc.rev = fdoc_rev, hdoc_rev
+        fdoc.content = {'chash': 'ident', 'flags': [], 'mbox': 'INBOX'}
+        hdoc.content = {'body': 'body_phash', 'multi': False, 'headers': {}}
+        when(soledad).get_from_index('by-type-and-contenthash', 'flags', 'ident').thenReturn([fdoc])
+        when(soledad).get_from_index('by-type-and-contenthash', 'head', 'ident').thenReturn([hdoc])
+        return fdoc, hdoc
+
+    def test_mail_is_served_from_cache_while_docs_revisions_match(self):
+        soledad = mock()
+        bdoc = mock()
+        bdoc.content = {'raw': 'body'}
+        self._docs_for_cached_mail(soledad)
+        querier = SoledadQuerier(soledad)
+        querier._get_many_from_index = lambda doc_type, field, values: {'body_phash': [bdoc]}
+        querier._extract_parts = lambda hdoc, cdocs: None
+
+        first = querier.mail('ident')
+        first.body
+        second = querier.mail('ident')
+
+        self.assertIs(first, second)
+        self.assertEquals(1, querier.mail_cache.hits)
+
+        self._docs_for_cached_mail(soledad, hdoc_rev='2')
+
+        self.assertIsNot(first, querier.mail('ident'))
@@ -0,0 +1,54 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.adapter.tag_counts import TagCounts
+
+
+class TagCountsTest(unittest.TestCase):
+
+    def test_counts_total_and_read_mails_per_tag(self):
+        counts = TagCounts()
+        counts.add({'tag': u'inbox,work', 'flags': u'\\Seen'})
+        counts.add({'tag': u'inbox', 'flags': u''})
+
+        self.assertEquals({'inbox': 2, 'work': 1}, counts.totals())
+        self.assertEquals({'inbox': 1, 'work': 1}, counts.reads())
+
+    def test_replacing_fields_moves_counts_between_tags(self):
+        counts = TagCounts()
+        counts.add({'tag': u'inbox', 'flags': u''})
+
+        counts.replace({'tag': u'inbox', 'flags': u''}, {'tag': u'trash', 'flags': u'\\Seen'})
+
+        self.assertEquals({'trash': 1}, counts.totals())
+        self.assertEquals({'trash': 1}, counts.reads())
+
+    def test_removing_the_last_mail_of_a_tag_drops_it(self):
+        counts = TagCounts()
+        counts.add({'tag': u'inbox,work', 'flags': u''})
+
+        counts.remove({'tag': u'inbox,work', 'flags': u''})
+
+        self.assertEquals({}, counts.totals())
+
+    def test_missing_fields_are_ignored(self):
+        counts = TagCounts()
+
+        counts.replace(None, {'tag': u'inbox', 'flags': u''})
+        counts.replace({'tag': u'inbox', 'flags': u''}, None)
+
+        self.assertEquals({}, counts.totals())
@@ -0,0 +1,77 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.adapter.thread_index import ThreadIndex
+
+
+class ThreadIndexTest(unittest.TestCase):
+
+    def _fields(self, ident, date, message_id=u'', references=u'', subject=u'subject'):
+        return {'ident': ident, 'date': date, 'message_id': message_id, 'references': references, 'subject': subject}
+
+    def _thread_index(self, all_fields):
+        thread_index = ThreadIndex()
+        for fields in all_fields:
+            thread_index.add(fields)
+        return thread_index
+
+    def test_replies_join_the_thread_of_the_mail_they_reference(self):
+        threads = self._thread_index([self._fields(u'a', 1, u'<a@x>', subject=u'plans'),
+                                      self._fields(u'b', 2, u'<b@x>', u'<a@x>', subject=u'other'),
+                                      self._fields(u'c', 3, u'<c@x>', u'<a@x> <b@x>', subject=u'other')])
+
+        self.assertEquals({u'a', u'b', u'c'}, threads.idents(u'c'))
+        self.assertEquals(u'a', threads.thread_of(u'c'))
+        self.assertEquals(3, threads.size(u'a'))
+
+    def test_parent_arriving_after_its_reply_takes_over_the_thread(self):
+        threads = ThreadIndex()
+        threads.add(self._fields(u'b', 2, u'<b@x>', u'<a@x>'))
+        self.assertEquals(u'b', threads.thread_of(u'b'))
+
+        threads.add(self._fields(u'a', 1, u'<a@x>'))
+
+        self.assertEquals(u'a', threads.thread_of(u'b'))
+        self.assertEquals({u'a', u'b'}, threads.idents(u'b'))
+
+    def test_mails_without_references_are_grouped_by_subject(self):
+        threads = self._thread_index([self._fields(u'a', 1, subject=u'Lunch  plans'),
+                                      self._fields(u'b', 2, subject=u'RE: Fwd: lunch plans'),
+                                      self._fields(u'c', 3, subject=u'dinner')])
+
+        self.assertEquals({u'a', u'b'}, threads.idents(u'a'))
+        self.assertEquals({u'c'}, threads.idents(u'c'))
+
+    def test_removing_a_mail_splits_the_threads_it_was_holding_together(self):
+        b = self._fields(u'b', 2, u'<b@x>', u'<a@x>')
+        threads = self._thread_index([self._fields(u'a', 1, u'<a@x>'), b,
+                                      self._fields(u'd', 4, u'<d@x>', u'<b@x>')])
+
+        threads.replace(b, None)
+
+        self.assertEquals({u'a'}, threads.idents(u'a'))
+        self.assertEquals({u'd'}, threads.idents(u'd'))
+        self.assertEquals(set(), threads.idents(u'b'))
+        self.assertIsNone(threads.thread_of(u'b'))
+
+    def test_unchanged_threading_fields_keep_the_thread(self):
+        fields = self._fields(u'a', 1, u'<a@x>')
+        threads = self._thread_index([fields, self._fields(u'b', 2, u'<b@x>', u'<a@x>')])
+
+        threads.replace(fields, dict(fields, flags=u'\\Seen'))
+
+        self.assertEquals({u'a', u'b'}, threads.idents(u'b'))
@@ -0,0 +1,78 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import base64
+import unittest
+
+from klein.test_resource import requestMock
+from mockito import mock, when
+from pixelated.controllers.attachments_controller import AttachmentsController
+from pixelated.support.transfer_decoding import DecodedContent
+
+
+class AttachmentsControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.querier = mock()
+        self.controller = AttachmentsController(self.querier)
+        content = DecodedContent(base64.encodestring('pequeno anexo :D\n'), 'base64')
+        when(self.querier).attachment_content('ident', 'base64').thenReturn({'content': content,
+                                                                             'content-type': 'text/plain'})
+
+    def _request(self, headers=None):
+        request = requestMock('/attachment/ident', headers=headers)
+        request.args = {'encoding': ['base64']}
+        return request
+
+    def test_attachment_is_sent_with_its_decoded_length(self):
+        request = self._request()
+
+        self.controller.attachment(request, 'ident')
+
+        self.assertEquals('pequeno anexo :D\n', request.getWrittenData())
+        self.assertEquals('17', request.responseHeaders.getRawHeaders('content-length')[0])
+
+    def test_byte_range_is_served_as_partial_content(self):
+        request = self._request(headers={'Range': ['bytes=8-12']})
+
+        self.controller.attachment(request, 'ident')
+
+        self.assertEquals(206, request.code)
+        self.assertEquals('anexo', request.getWrittenData())
+        self.assertEquals('bytes 8-12/17', request.responseHeaders.getRawHeaders('content-range')[0])
+
+    def test_suffix_range_serves_the_end_of_the_attachment(self):
+        request = self._request(headers={'Range': ['bytes=-3']})
+
+        self.controller.attachment(request, 'ident')
+
+        self.assertEquals(':D\n', request.getWrittenData())
+
+    def test_unsatisfiable_range_is_rejected(self):
+        request = self._request(headers={'Range': ['bytes=20-']})
+
+        self.controller.attachment(request, 'ident')
+
+        self.assertEquals(416, request.code)
+        self.assertEquals('bytes */17', request.responseHeaders.getRawHeaders('content-range')[0])
+
+    def test_invalid_range_is_ignored(self):
+        request = self._request(headers={'Range': ['bytes=5-3']})
+
+        self.controller.attachment(request, 'ident')
+
+        self.assertEquals(200, request.code)
+        self.assertEquals('pequeno anexo :D\n', request.getWrittenData())
+        self.assertIsNone(request.responseHeaders.getRawHeaders('content-range'))
@@ -20,6 +20,7 @@ from klein.test_resource import requestMock
 from mock import MagicMock
 from mockito import *
 from pixelated.controllers.mails_controller import MailsController
+from test.support.test_helper import SynchronousExecutor, deferred_result
 
 
 class TestMailsController(unittest.TestCase):
@@ -32,7 +33,9 @@ class TestMailsController(unittest.TestCase):
 
         self.mails_controller = MailsController(mail_service=self.mail_service,
                                                 draft_service=draft_service,
-                                                search_engine=self.search_engine)
+                                                search_engine=self.search_engine,
+                                                soledad_executor=SynchronousExecutor(),
+                                                search_executor=SynchronousExecutor())
 
         self.input_mail = mock()
         self.input_mail.json = {'header': {'from': 'a@a.a', 'to': 'b@b.b'},
@@ -49,7 +52,7 @@ class TestMailsController(unittest.TestCase):
         self.mail_service.send = self._successfuly_send_mail
         request = requestMock('', body=json.dumps(self.input_mail.json))
 
-        result = self.mails_controller.send_mail(request)
+        result = deferred_result(self.mails_controller.send_mail(request))
 
         self.assertEqual(request.code, 200)
         self.assertEqual(result,
@@ -59,18 +62,86 @@ class TestMailsController(unittest.TestCase):
         self.mail_service.send = self._send_that_throws_exception
 
         request = requestMock('', body=json.dumps(self.input_mail.json))
-        result = self.mails_controller.send_mail(request)
+        result = deferred_result(self.mails_controller.send_mail(request))
 
         self.assertEqual(request.code, 422)
         self.assertEqual(result,
                          '{"message": "email sending failed\\nmore information of error\\n123\\nthere was a code before this"}')
 
+    def test_listing_mails_is_served_from_the_search_index(self):
+        request = requestMock('', body='')
+        request.args = {'q': ['tag:inbox'], 'w': ['25'], 'p': ['1']}
+        summary = {'ident': 1, 'header': {'subject': 'subject'}}
+        when(self.search_engine).search_summaries('tag:inbox', '25', '1').thenReturn(([summary], 1))
+
+        response = deferred_result(self.mails_controller.mails(request))
+
+        self.assertEqual(json.loads(response), {'stats': {'total': 1}, 'mails': [summary]})
+        verify(self.mail_service, never).mails(any())
+
+    def test_listing_mails_after_a_cursor_returns_the_next_cursor(self):
+        request = requestMock('', body='')
+        request.args = {'q': ['tag:inbox'], 'w': ['25'], 'after': ['1409758577000:ident1']}
+        summary = {'ident': 2, 'header': {'subject': 'subject'}}
+        when(self.search_engine).search_summaries_after('tag:inbox', '25', '1409758577000:ident1', True).thenReturn(([summary], 2, None))
+
+        response = deferred_result(self.mails_controller.mails(request))
+
+        self.assertEqual(json.loads(response), {'stats': {'total': 2}, 'mails': [summary], 'next': None})
+
+    def test_listing_mails_after_a_cursor_can_ask_for_an_estimated_total(self):
+        request = requestMock('', body='')
+        request.args = {'q': ['tag:inbox'], 'w': ['25'], 'after': [''], 'exact': ['false']}
+        when(self.search_engine).search_summaries_after('tag:inbox', '25', '', False).thenReturn(([], 0, None))
+
+        deferred_result(self.mails_controller.mails(request))
+
+        verify(self.search_engine).search_summaries_after('tag:inbox', '25', '', False)
+
+    def test_listing_mails_after_an_invalid_cursor_is_a_bad_request(self):
+        request = requestMock('', body='')
+        request.args = {'q': ['tag:inbox'], 'w': ['25'], 'after': ['garbage']}
+        when(self.search_engine).search_summaries_after('tag:inbox', '25', 'garbage', True).thenRaise(ValueError('Invalid cursor: garbage'))
+
+        deferred_result(self.mails_controller.mails(request))
+
+        self.assertEqual(400, request.code)
+
+    def test_listing_mails_by_thread_collapses_conversations(self):
+        request = requestMock('', body='')
+        request.args = {'q': ['tag:inbox'], 'w': ['25'], 'p': ['1'], 'threads': ['true']}
+        summary = {'ident': 2, 'thread': 1, 'thread_size': 2}
+        when(self.search_engine).search_summaries('tag:inbox', '25', '1', threads=True).thenReturn(([summary], 1))
+
+        result = deferred_result(self.mails_controller.mails(request))
+
+        self.assertEquals({'stats': {'total': 1}, 'mails': [summary]}, json.loads(result))
+
+    def test_fetching_a_thread_returns_all_its_mails_at_once(self):
+        request = requestMock('', body='')
+        first, second = mock(), mock()
+        when(first).as_dict().thenReturn({'ident': 1})
+        when(second).as_dict().thenReturn({'ident': 2})
+        when(self.mail_service).thread('1').thenReturn([first, second])
+
+        result = deferred_result(self.mails_controller.thread(request, '1'))
+
+        self.assertEquals([{'ident': 1}, {'ident': 2}], json.loads(result))
+
+    def test_fetching_an_unknown_thread_is_not_found(self):
+        request = requestMock('', body='')
+        when(self.mail_service).thread('unknown').thenReturn([])
+
+        deferred_result(self.mails_controller.thread(request, 'unknown'))
+
+        self.assertEquals(404, request.code)
+
     def test_fetching_mail_gets_mail_from_mail_service(self):
         mail = mock()
         mail.as_dict = lambda: {'ident': 1, 'body': 'le mail body'}
         when(self.mail_service).mail(1).thenReturn(mail)
 
-        response = self.mails_controller.mail(self.dummy_request, 1)
+        response = deferred_result(self.mails_controller.mail(self.dummy_request, 1))
 
         verify(self.mail_service).mail(1)
         self.assertEqual(response, '{"body": "le mail body", "ident": 1}')
@@ -95,6 +166,55 @@ class TestMailsController(unittest.TestCase):
         verify(self.mail_service).mark_as_unread(1)
         verify(self.search_engine).index_mail(mail)
 
+    def test_marking_many_mails_as_read_indexes_them_in_one_commit(self):
+        mails = [mock(), mock()]
+        request = requestMock('', body=json.dumps({'idents': [1, 2]}))
+        when(self.mail_service).mark_many_as_read([1, 2]).thenReturn(mails)
+
+        self.mails_controller.mark_many_mail_read(request)
+
+        verify(self.search_engine).index_mails(mails)
+        verify(self.search_engine, never).index_mail(any())
+
+    def test_deleting_many_mails_trashes_and_removes_them_in_bulk(self):
+        trashed, removed = mock(), mock()
+        removed.ident = 2
+        request = requestMock('', body=json.dumps({'idents': [1, 2]}))
+        when(self.mail_service).delete_mails([1, 2]).thenReturn(([trashed], [removed]))
+
+        self.mails_controller.delete_mails(request)
+
+        verify(self.search_engine).index_mails([trashed])
+        verify(self.search_engine).remove_many_from_index([2])
+
+    def test_tagging_many_mails_adds_and_removes_tags_in_bulk(self):
+        mail = mock()
+        mail.as_dict = lambda: {'ident': 1, 'tags': ['important']}
+        request = requestMock('', body=json.dumps({'idents': [1], 'add': ['Important'], 'remove': ['later']}))
+        when(self.mail_service).update_many_tags([1], ['important'], ['later']).thenReturn([mail])
+
+        response = deferred_result(self.mails_controller.many_mail_tags(request))
+
+        verify(self.search_engine).index_mails([mail])
+        self.assertEqual(json.loads(response), [{'ident': 1, 'tags': ['important']}])
+
+    def test_tagging_many_mails_without_idents_is_a_bad_request(self):
+        request = requestMock('', body=json.dumps({'add': ['important']}))
+
+        self.mails_controller.many_mail_tags(request)
+
+        self.assertEqual(request.code, 400)
+        verify(self.mail_service, never).update_many_tags(any(), any(), any())
+
+    def test_bulk_requests_with_malformed_payloads_are_bad_requests(self):
+        for body in ['not json', json.dumps(['1']), json.dumps({'idents': 'ident1'})]:
+            request = requestMock('', body=body)
+
+            self.mails_controller.delete_mails(request)
+
+            self.assertEqual(request.code, 400)
+        verify(self.mail_service, never).delete_mails(any())
+
     def test_move_message_to_trash(self):
         mail = mock()
         mail.mailbox_name = 'INBOX'
@@ -120,6 +240,16 @@ class TestMailsController(unittest.TestCase):
 
         verify(self.mail_service).reply_all_template(1)
 
+    def test_tagging_mail_with_reserved_tag_is_forbidden(self):
+        request = requestMock('', body=json.dumps({'newtags': ['drafts']}))
+        when(self.mail_service).update_tags(1, ['drafts']).thenRaise(ValueError('None of the following words can be used as tags: drafts'))
+
+        response = deferred_result(self.mails_controller.mail_tags(request, 1))
+
+        self.assertEqual(request.code, 403)
+        self.assertEqual(json.loads(response), 'None of the following words can be used as tags: drafts')
+        verify(self.search_engine, never).index_mail(any())
+
     def _successfuly_send_mail(self, ident, mail):
         sent_mail = mock()
         sent_mail.as_dict = lambda: self.input_mail.json
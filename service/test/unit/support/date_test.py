@@ -0,0 +1,66 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+import warnings
+
+import dateutil.parser
+from dateutil.tz import tzoffset, tzutc
+from mockito import when, unstub, any
+from pixelated.support import date
+
+
+class DateTest(unittest.TestCase):
+    def tearDown(self):
+        unstub()
+
+    def test_parses_rfc2822_dates_with_offsets_and_comments(self):
+        self.assertEquals('2014-09-03T12:36:17-03:00', date.parse('Wed, 3 Sep 2014 12:36:17 -0300').isoformat())
+        self.assertEquals('2014-09-03T12:36:17-07:00', date.parse('Wed, 03 Sep 2014 12:36:17 -0700 (PDT)').isoformat())
+        self.assertEquals('2014-09-03T12:36:00+00:00', date.parse('3 SEP 2014 12:36 GMT').isoformat())
+        self.assertEquals(tzutc(), date.parse('Wed, 3 Sep 2014 12:36:17 +0000').tzinfo)
+
+    def test_parses_iso_dates(self):
+        self.assertEquals('2014-09-03T12:36:17-03:00', date.parse('2014-09-03T12:36:17-03:00').isoformat())
+        self.assertEquals('2014-09-03T12:36:17.500000+00:00', date.parse('2014-09-03T12:36:17.5Z').isoformat())
+        self.assertEquals(tzoffset(None, 19800), date.parse('2014-09-03T12:36:17+0530').tzinfo)
+        self.assertIsNone(date.parse('2014-09-03T12:36:17').tzinfo)
+
+    def test_agrees_with_dateutil(self):
+        dates = ['Wed, 3 Sep 2014 12:36:17 -0300', 'Wed,3 Sep 2014 12:36 +0530', '2014-09-03 12:36:17', '2014-09-03T12:36:17.1234567+01:00',
+                 'Wed, 3 Sep 2014 12:36:17', '3 Sep 2014 12:36:17 UTC']
+        for raw in dates:
+            self.assertEquals(dateutil.parser.parse(raw), date.parse(raw), raw)
+
+    def test_falls_back_to_dateutil_for_other_formats(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for raw in ['Sep 3 2014 12:36', 'Wed, 3 Sep 14 12:36:17 +0100', 'Wed, 3 Sep 2014 12:36:17 EST', '2014/09/03 12:36']:
+                self.assertEquals(dateutil.parser.parse(raw), date.parse(raw), raw)
+
+    def test_invalid_dates_still_raise(self):
+        self.assertRaises(ValueError, date.parse, 'Wed, 31 Feb 2014 12:36:17 +0000')
+        self.assertRaises(ValueError, date.parse, 'not a date')
+
+    def test_parsed_dates_are_cached_per_string(self):
+        raw = 'Thu, 4 Sep 2014 08:00:00 -0300'
+        first = date.parse(raw)
+        when(date)._parse_rfc2822(any()).thenReturn(None)
+
+        self.assertIs(first, date.parse(raw))
+
+    def test_milliseconds_since_epoch_ignore_the_offset(self):
+        self.assertEquals(1409747777000, date.milliseconds('Wed, 3 Sep 2014 12:36:17 -0300'))
+        self.assertEquals(1409747777000, date.milliseconds('2014-09-03T12:36:17+02:00'))
@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+
+from pixelated.support.encrypted_file_storage import EncryptedFileStorage
+
+
+class EncryptedFileStorageTest(unittest.TestCase):
+    MASTERKEY = '_yg2oG_5ELM8_-sQYcsxI37WesI0dOtZQXpwAqjvhR4='
+    CONTENT = ''.join(chr(i % 256) for i in range(10000))
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.storage = EncryptedFileStorage(self.folder, self.MASTERKEY)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, storage, name, content):
+        f = storage.create_file(name)
+        f.write(content)
+        f.close()
+
+    def _read(self, storage, name, offset=0, size=-1):
+        f = storage.open_file(name)
+        try:
+            f.seek(offset)
+            return f.read(size)
+        finally:
+            f.close()
+
+    def test_files_are_encrypted_on_disk(self):
+        self._write(self.storage, 'segment', 'plain index content')
+
+        with open(os.path.join(self.folder, 'segment'), 'rb') as f:
+            self.assertNotIn('plain index content', f.read())
+        self.assertEquals('plain index content', self._read(EncryptedFileStorage(self.folder, self.MASTERKEY), 'segment'))
+
+    def test_reopening_an_unchanged_file_is_served_from_the_cache(self):
+        self._write(self.storage, 'segment', self.CONTENT)
+
+        self._read(self.storage, 'segment')
+        self._read(self.storage, 'segment')
+
+        self.assertEquals(2, self.storage.cache.stats()['hits'])
+
+    def test_large_files_are_read_chunk_by_chunk(self):
+        storage = EncryptedFileStorage(self.folder, self.MASTERKEY)
+        storage.CHUNK_SIZE = 1000
+        storage.MAX_CACHED_FILE = 100
+        self._write(storage, 'segment', self.CONTENT)
+        storage = EncryptedFileStorage(self.folder, self.MASTERKEY)
+        storage.MAX_CACHED_FILE = 100
+
+        self.assertEquals(self.CONTENT[2500:4100], self._read(storage, 'segment', offset=2500, size=1600))
+        self.assertEquals(len(self.CONTENT), storage.file_length('segment'))
+        self.assertEquals(0, len(storage.cache))
+
+    def test_files_in_the_previous_whole_file_format_are_still_read(self):
+        with open(os.path.join(self.folder, 'segment'), 'wb') as f:
+            f.write(self.storage.f.encrypt(self.CONTENT))
+
+        self.assertEquals(self.CONTENT, self._read(self.storage, 'segment'))
+        self.assertEquals(len(self.CONTENT), EncryptedFileStorage(self.folder, self.MASTERKEY).file_length('segment'))
+
+    def test_files_written_through_their_raw_file_are_stored_on_close(self):
+        temp_storage = self.storage.temp_storage('pool.tmp')
+        raw = temp_storage.create_file('sort.run').raw_file()
+        raw.write('sorted postings')
+        raw.close()
+
+        self.assertEquals('sorted postings', temp_storage.open_file('sort.run').raw_file().read())
+        with open(os.path.join(self.folder, 'pool.tmp', 'sort.run'), 'rb') as f:
+            self.assertNotIn('sorted postings', f.read())
+
+    def test_large_files_can_be_unpickled(self):
+        items = [('content', 'term%d\nwith newline' % i, i) for i in range(500)]
+        storage = EncryptedFileStorage(self.folder, self.MASTERKEY)
+        storage.CHUNK_SIZE = 1000
+        storage.MAX_CACHED_FILE = 100
+        self._write(storage, 'sort.run', ''.join(cPickle.dumps(item) for item in items))
+
+        f = storage.open_file('sort.run').raw_file()
+        self.assertEquals(items, [cPickle.load(f) for _ in items])
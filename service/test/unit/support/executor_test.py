@@ -0,0 +1,82 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import threading
+import unittest
+
+from pixelated.support.executor import Executor
+
+
+class ImmediateReactor(object):
+
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+    def addSystemEventTrigger(self, phase, event, f, *args, **kwargs):
+        pass
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = Executor('test', max_threads=1, reactor=ImmediateReactor())
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_runs_call_off_the_calling_thread(self):
+        done = threading.Event()
+        results = []
+
+        d = self.executor.run(lambda: threading.current_thread().name)
+        d.addCallback(results.append)
+        d.addCallback(lambda _: done.set())
+
+        done.wait(5)
+        self.assertNotEqual(threading.current_thread().name, results[0])
+
+    def test_errors_are_delivered_to_the_deferred(self):
+        done = threading.Event()
+        failures = []
+
+        def fail():
+            raise ValueError('boom')
+
+        d = self.executor.run(fail)
+        d.addErrback(failures.append)
+        d.addBoth(lambda _: done.set())
+
+        done.wait(5)
+        self.assertTrue(failures[0].check(ValueError))
+
+    def test_stats_report_queue_depth_behind_a_busy_worker(self):
+        started, release, done = threading.Event(), threading.Event(), threading.Event()
+
+        def busy():
+            started.set()
+            release.wait(5)
+
+        self.executor.run(busy)
+        started.wait(5)
+        self.executor.run(lambda: None).addCallback(lambda _: done.set())
+        queued = self.executor.stats()['queued']
+        release.set()
+        done.wait(5)
+
+        stats = self.executor.stats()
+        self.assertEqual(1, queued)
+        self.assertEqual(2, stats['submitted'])
+        self.assertEqual(1, stats['max_threads'])
+        self.assertEqual(0, stats['queued'])
@@ -0,0 +1,64 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.support.lru_cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used_entries_when_full(self):
+        cache = LRUCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+
+        cache.put('c', 3)
+
+        self.assertEquals(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEquals(3, cache.get('c'))
+
+    def test_accounts_entries_by_their_size(self):
+        cache = LRUCache(max_size=10, sizeof=len)
+        cache.put('a', 'x' * 6)
+        cache.put('b', 'x' * 6)
+
+        self.assertEquals(1, len(cache))
+        self.assertEquals(6, cache.size)
+
+    def test_does_not_keep_values_bigger_than_the_cache(self):
+        cache = LRUCache(max_size=5, sizeof=len)
+        cache.put('a', 'x' * 6)
+
+        self.assertEquals(0, len(cache))
+
+    def test_invalid_entries_are_dropped_and_count_as_miss(self):
+        cache = LRUCache(max_size=2)
+        cache.put('a', 1)
+
+        self.assertIsNone(cache.get('a', is_valid=lambda value: value == 2))
+        self.assertEquals(0, len(cache))
+        self.assertEquals({'hits': 0, 'misses': 1, 'hit_ratio': 0.0, 'entries': 0, 'size': 0, 'max_size': 2},
+                          cache.stats())
+
+    def test_tracks_hit_ratio(self):
+        cache = LRUCache(max_size=2)
+        cache.put('a', 1)
+        cache.get('a')
+        cache.get('b')
+
+        self.assertEquals(0.5, cache.stats()['hit_ratio'])
@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+from pixelated.support.text_extraction import readable_text, part_text, html_to_text
+
+
+class TextExtractionTest(unittest.TestCase):
+
+    def test_decodes_the_transfer_encoding_with_the_declared_charset(self):
+        self.assertEquals(u'ol\xe1', part_text('b2zh', 'text/plain; charset="iso-8859-1"', 'base64'))
+
+    def test_unknown_charset_falls_back_to_utf8(self):
+        self.assertEquals(u'caf\xe9', part_text('caf=C3=A9', 'text/plain; charset=x-unknown', 'quoted-printable'))
+
+    def test_unicode_content_without_transfer_encoding_is_kept(self):
+        self.assertEquals(u'ol\xe1', part_text(u'ol\xe1', 'text/plain; charset="iso-8859-1"', None))
+        self.assertEquals(u'ol\xe1', part_text(u'ol\xe1', 'text/plain', '8bit'))
+
+    def test_unicode_transfer_encoded_content_is_decoded(self):
+        self.assertEquals(u'ol\xe1', part_text(u'ol=C3=A1', 'text/plain; charset=utf-8', 'quoted-printable'))
+
+    def test_html_is_reduced_to_its_visible_text(self):
+        html = '<html><head><title>t</title><style>p {}</style></head><body><p>Fish&amp;chips</p>' \
+               '<script>alert(1)</script><div>at&#32;noon</div></body></html>'
+
+        self.assertEquals(u'Fish&chips at noon', u' '.join(html_to_text(html).split()))
+
+    def test_plain_alternatives_are_preferred_over_html(self):
+        parts = [('<p>html version</p>', 'text/html', None), ('plain\n\n version', 'text/plain', None)]
+
+        self.assertEquals(u'plain version', readable_text(parts))
+
+    def test_html_only_mails_are_extracted(self):
+        self.assertEquals(u'only html', readable_text([('<p>only</p><p>html</p>', 'text/html', None)]))
+
+    def test_non_text_parts_are_ignored(self):
+        parts = [('iVBORw0KGgo=', 'image/png', 'base64'), ('<p>the html</p>', 'text/html', None),
+                 ('JVBERi0=', 'application/pdf', 'base64')]
+
+        self.assertEquals(u'the html', readable_text(parts))
+
+    def test_parts_without_content_type_are_plain_text(self):
+        self.assertEquals(u'no type', readable_text([('no type', None, None), ('<p>html</p>', 'text/html', None)]))
@@ -0,0 +1,97 @@
+#
+# Copyright (c) 2014 ThoughtWorks, Inc.
+#
+# Pixelated is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pixelated is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Pixelated. If not, see <http://www.gnu.org/licenses/>.
+import base64
+import quopri
+import unittest
+
+from pixelated.support.transfer_decoding import DecodedContent, ChunkProducer
+
+
+class ListConsumer(object):
+
+    def __init__(self):
+        self.written = []
+        self.producer = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+        while self.producer:
+            producer.resumeProducing()
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class DecodedContentTest(unittest.TestCase):
+    CONTENT = ''.join(chr(i % 256) for i in range(1000))
+
+    def test_base64_is_decoded_across_chunk_boundaries(self):
+        content = DecodedContent(base64.encodestring(self.CONTENT), 'base64', chunk_size=7)
+
+        self.assertEquals(self.CONTENT, content.read())
+        self.assertEquals(len(self.CONTENT), len(content))
+
+    def test_base64_length_matches_the_decoded_content_when_malformed(self):
+        encoded = base64.encodestring(self.CONTENT)
+        malformed = encoded[:100] + '!*\x00' + encoded[100:200] + '-' + encoded[200:]
+        content = DecodedContent(malformed, 'base64', chunk_size=7)
+
+        self.assertEquals(self.CONTENT, content.read())
+        self.assertEquals(len(self.CONTENT), len(content))
+
+    def test_base64_length_of_content_padded_in_the_middle(self):
+        raw = base64.encodestring('ab') + base64.encodestring('cde')
+        content = DecodedContent(raw, 'base64', chunk_size=3)
+
+        self.assertEquals(len(content.read()), len(content))
+
+    def test_quoted_printable_is_decoded_across_chunk_boundaries(self):
+        content = DecodedContent(quopri.encodestring(self.CONTENT), 'Quoted-Printable', chunk_size=7)
+
+        self.assertEquals(self.CONTENT, content.read())
+        self.assertEquals(len(self.CONTENT), len(content))
+
+    def test_unencoded_content_is_passed_through(self):
+        content = DecodedContent(u'plain text', None, chunk_size=3)
+
+        self.assertEquals('plain text', content.read())
+
+    def test_unicode_content_is_encoded_with_its_charset(self):
+        self.assertEquals('ol\xc3\xa1', DecodedContent(u'ol\xe1', '8bit', chunk_size=2).read())
+        self.assertEquals('ol\xe1', DecodedContent(u'ol\xe1', None, charset='iso-8859-1').read())
+        self.assertEquals('ol\xc3\xa1', DecodedContent(u'ol\xe1', None, charset='x-unknown').read())
+        self.assertEquals('ol\xe1', DecodedContent(u'b2zh', 'base64').read())
+
+    def test_chunks_cover_only_the_requested_range(self):
+        content = DecodedContent(base64.encodestring(self.CONTENT), 'base64', chunk_size=64)
+
+        self.assertEquals(self.CONTENT[100:501], ''.join(content.chunks(100, 500)))
+        self.assertEquals(self.CONTENT[990:], ''.join(content.chunks(990)))
+
+
+class ChunkProducerTest(unittest.TestCase):
+
+    def test_writes_every_chunk_and_fires_when_done(self):
+        consumer = ListConsumer()
+        done = []
+
+        ChunkProducer(['a', '', 'b']).beginProducing(consumer).addCallback(done.append)
+
+        self.assertEquals(['a', 'b'], consumer.written)
+        self.assertEquals([None], done)
@@ -40,6 +40,7 @@ define(
         lastQuery: '',
         currentPage: 1,
         numPages: 1,
+        pageCursors: {},
         w: 25
       });
 
@@ -192,13 +193,25 @@ define(
         }
       };
 
+      this.pageQuery = function (page) {
+        var cursor = this.attr.pageCursors[page];
+        return _.isUndefined(cursor) ? '&p=' + page : '&after=' + encodeURIComponent(cursor);
+      };
+
       this.fetchMail = function (query, tag, fromRefresh, eventData) {
         var p = this.attr.currentPage;
         var w = this.attr.w;
-        var url = this.attr.mailsResource + '?q=' + escaped(this.excludeTrashedEmailsForDraftsAndSent(query)) + '&p=' + p + '&w=' + w;
-        this.attr.lastQuery = this.excludeTrashedEmailsForDraftsAndSent(query);
+        query = this.excludeTrashedEmailsForDraftsAndSent(query);
+        if (query !== this.attr.lastQuery) {
+          this.attr.pageCursors = { 1: '' };
+        }
+        var url = this.attr.mailsResource + '?q=' + escaped(query) + this.pageQuery(p) + '&w=' + w;
+        this.attr.lastQuery = query;
         $.ajax(url, { dataType: 'json' })
           .done(function (data) {
+            if (data.next) {
+              this.attr.pageCursors[p + 1] = data.next;
+            }
             this.attr.numPages = Math.ceil(data.stats.total / this.attr.w);
             var eventToTrigger = fromRefresh ? events.mails.availableForRefresh : events.mails.available;
             this.trigger(document, eventToTrigger, _.merge(_.merge({tag: tag }, eventData), this.parseMails(data)));
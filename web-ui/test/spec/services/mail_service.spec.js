@@ -290,6 +290,15 @@ describeComponent('services/mail_service', function () {
       expect(pageChangedEvent).toHaveBeenTriggeredOnAndWith(document, {currentPage: 1, numPages: 10});
     });
 
+    it('fetches the next page after the cursor returned with the current page', function() {
+      this.component.trigger(Pixelated.events.ui.mails.fetchByTag, {tag: 'inbox'});
+      deferred.resolve({stats: {total: 50}, mails: [], next: '1409747777000:ident2'});
+
+      this.component.trigger(Pixelated.events.ui.page.next);
+
+      expect($.ajax.calls.mostRecent().args[0]).toContain('&after=' + encodeURIComponent('1409747777000:ident2'));
+    });
+
     describe('total page numbers', function() {
       var mailSetData = {
         tag: 'inbox',